@@ -0,0 +1,150 @@
+import os
+import time
+from app.logger import app_logger, event_logger
+
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "3"))
+CIRCUIT_RESET_TIMEOUT = float(os.getenv("CIRCUIT_RESET_TIMEOUT", "30"))
+CIRCUIT_HALF_OPEN_TRIALS = 1
+# A half-open trial that has not settled by then is written off and another may start
+CIRCUIT_TRIAL_TIMEOUT = float(os.getenv("CIRCUIT_TRIAL_TIMEOUT", "60"))
+
+
+class CircuitOpen(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """
+    Closed: calls go through and consecutive failures are counted.
+    Open: calls fail immediately with CircuitOpen until reset_timeout
+    has passed (or reset() is called by the recovery side).
+    Half-open: a limited number of trial calls go through; a success
+    closes the circuit, a failure opens it again. A trial that is
+    cancelled, or still unsettled after trial_timeout, frees its slot.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+                 reset_timeout: float = CIRCUIT_RESET_TIMEOUT, half_open_trials: int = CIRCUIT_HALF_OPEN_TRIALS,
+                 trial_timeout: float = CIRCUIT_TRIAL_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_trials = half_open_trials
+        self.trial_timeout = trial_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.trials = 0
+        self._trial_started = 0.0
+        self._half_open_round = 0
+        self.trips = 0
+        self.rejected = 0
+        self.last_error = None
+        self._listeners = []
+
+    def add_listener(self, callback):
+        """Register callback(breaker) fired on every state change"""
+        self._listeners.append(callback)
+
+    def _set_state(self, state: str):
+        if state == self.state:
+            return
+        event_logger.info(f"Circuit {self.name}: {self.state} -> {state}")
+        self.state = state
+        self.trials = 0
+        if state == self.OPEN:
+            self.opened_at = time.monotonic()
+            self.trips += 1
+        elif state == self.HALF_OPEN:
+            self._half_open_round += 1
+        elif state == self.CLOSED:
+            self.failures = 0
+            self.opened_at = None
+        for callback in self._listeners:
+            try:
+                callback(self)
+            except Exception:
+                app_logger.exception(f"Circuit {self.name} listener failed")
+
+    def rejecting(self) -> bool:
+        """Whether allow() would raise right now, without admitting anything"""
+        now = time.monotonic()
+        if self.state == self.OPEN:
+            return now - self.opened_at < self.reset_timeout
+        return (self.state == self.HALF_OPEN and self.trials >= self.half_open_trials
+                and now - self._trial_started < self.trial_timeout)
+
+    def allow(self):
+        """Admit one call or raise CircuitOpen"""
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self._set_state(self.HALF_OPEN)
+        if (self.state == self.HALF_OPEN and self.trials >= self.half_open_trials
+                and time.monotonic() - self._trial_started >= self.trial_timeout):
+            app_logger.warning(f"Circuit {self.name}: half-open trial unsettled after {self.trial_timeout}s")
+            self.trials = 0
+        if self.state == self.OPEN or (self.state == self.HALF_OPEN and self.trials >= self.half_open_trials):
+            self.rejected += 1
+            raise CircuitOpen(f"{self.name} circuit is {self.state}")
+        if self.state == self.HALF_OPEN:
+            self.trials += 1
+            self._trial_started = time.monotonic()
+
+    def record_success(self):
+        self.failures = 0
+        if self.state != self.CLOSED:
+            self._set_state(self.CLOSED)
+
+    def record_failure(self, error=None):
+        self.last_error = f"{error}" if error is not None else None
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self._set_state(self.OPEN)
+
+    def trip(self, reason=None):
+        """Open the circuit from outside evidence (e.g. the upstream probe failing)"""
+        if self.state != self.OPEN:
+            self.last_error = reason
+            self._set_state(self.OPEN)
+
+    def reset(self):
+        """Upstream looks healthy again: let trial calls through now"""
+        if self.state == self.OPEN:
+            self._set_state(self.HALF_OPEN)
+
+    async def call(self, func, *args, failures=(Exception,), exclude=()):
+        """Run func(*args) through the breaker; only `failures` not in `exclude` count"""
+        self.allow()
+        trial_round = self._half_open_round if self.state == self.HALF_OPEN else None
+        try:
+            result = await func(*args)
+        except Exception as e:
+            if isinstance(e, failures) and not isinstance(e, exclude):
+                self.record_failure(e)
+            else:
+                self.record_success()
+            raise
+        except BaseException:
+            # Cancelled: no verdict on upstream, but give the trial slot back
+            if trial_round is not None and self.state == self.HALF_OPEN and self._half_open_round == trial_round:
+                self.trials = max(self.trials - 1, 0)
+            raise
+        self.record_success()
+        return result
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "trips": self.trips,
+            "rejected": self.rejected,
+            "open_for": round(time.monotonic() - self.opened_at, 1) if self.opened_at else None,
+            "last_error": self.last_error,
+        }
+
+
+# Global instance guarding the kiosk API
+upstream_breaker = CircuitBreaker("upstream")
@@ -0,0 +1,84 @@
+import os
+import time
+from collections import OrderedDict
+
+INVALID_CODE_TTL = float(os.getenv("INVALID_CODE_TTL", "300"))
+INVALID_CODE_CACHE_SIZE = int(os.getenv("INVALID_CODE_CACHE_SIZE", "1000"))
+# Upstream lookups per code prefix: burst size and sustained rate per minute
+CODE_PREFIX_LENGTH = int(os.getenv("CODE_PREFIX_LENGTH", "3"))
+CODE_PREFIX_BURST = int(os.getenv("CODE_PREFIX_BURST", "5"))
+CODE_PREFIX_RATE = float(os.getenv("CODE_PREFIX_RATE", "10"))
+CODE_PREFIX_TRACKED = 1000
+
+
+def normalize_code(code: str) -> str:
+    """The one form of a print code used for dedup, caching and lookups"""
+    return code.strip()
+
+
+class InvalidCodeCache:
+    """
+    Codes the server rejected, answered locally with the original message
+    until they expire. Lookups that do go upstream are rate limited per
+    code prefix (token bucket) to blunt guessing. Both tables are LRU
+    bounded. Codes are expected in normalize_code() form.
+    """
+
+    def __init__(self, ttl: float = INVALID_CODE_TTL, max_size: int = INVALID_CODE_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._rejected = OrderedDict()  # code -> (expires_at, message)
+        self._buckets = OrderedDict()  # prefix -> (tokens, updated_at)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.rate_limited = 0
+
+    def get(self, code: str):
+        """The cached rejection message for code, or None"""
+        entry = self._rejected.get(code)
+        if entry is None or entry[0] <= time.monotonic():
+            if entry is not None:
+                del self._rejected[code]
+            self.misses += 1
+            return None
+        self._rejected.move_to_end(code)
+        self.hits += 1
+        return entry[1]
+
+    def add(self, code: str, message: str):
+        self._rejected[code] = (time.monotonic() + self.ttl, message)
+        self._rejected.move_to_end(code)
+        while len(self._rejected) > self.max_size:
+            self._rejected.popitem(last=False)
+            self.evictions += 1
+
+    def allow_lookup(self, code: str) -> bool:
+        """Take one token from the code's prefix bucket"""
+        prefix = code[:CODE_PREFIX_LENGTH]
+        now = time.monotonic()
+        tokens, updated_at = self._buckets.get(prefix, (CODE_PREFIX_BURST, now))
+        tokens = min(CODE_PREFIX_BURST, tokens + (now - updated_at) * CODE_PREFIX_RATE / 60)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        else:
+            self.rate_limited += 1
+        self._buckets[prefix] = (tokens, now)
+        self._buckets.move_to_end(prefix)
+        while len(self._buckets) > CODE_PREFIX_TRACKED:
+            self._buckets.popitem(last=False)
+        return allowed
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._rejected),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "rate_limited": self.rate_limited,
+        }
+
+
+# Global instance
+invalid_codes = InvalidCodeCache()
@@ -0,0 +1,131 @@
+import asyncio
+import os
+import socket
+import time
+from urllib.parse import urlsplit
+import httpx
+from app.http_client import get_client
+from app.logger import health_logger
+from app.server_api import SERVER_URL
+
+UPSTREAM_HEALTH_URL = os.getenv("UPSTREAM_HEALTH_URL", SERVER_URL.replace('/kiosk', '/health'))
+# Short, so the dns stage notices a resolver outage within one or two probes
+DNS_CACHE_TTL = float(os.getenv("DNS_CACHE_TTL", "30"))
+CONNECT_PROBE_TIMEOUT = 3
+
+
+class DnsCache:
+    """getaddrinfo results cached for DNS_CACHE_TTL seconds"""
+
+    def __init__(self, ttl: float = DNS_CACHE_TTL):
+        self.ttl = ttl
+        self._entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def resolve(self, host: str, port: int) -> list:
+        key = (host, port)
+        entry = self._entries.get(key)
+        now = time.monotonic()
+        if entry and now - entry[0] < self.ttl:
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        addresses = [info[4][:2] for info in infos]
+        self._entries[key] = (now, addresses)
+        return addresses
+
+    def invalidate(self, host: str, port: int):
+        self._entries.pop((host, port), None)
+
+    def stats(self) -> dict:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+dns_cache = DnsCache()
+
+
+class ConnectivityResult:
+    def __init__(self):
+        self.ok = False
+        self.failed_stage = None
+        self.error = None
+        self.rtt = {}
+        self.status_code = None
+
+    def to_dict(self) -> dict:
+        return {
+            "ok": self.ok,
+            "failed_stage": self.failed_stage,
+            "error": self.error,
+            "rtt": self.rtt,
+            "status_code": self.status_code,
+        }
+
+
+async def probe_connectivity(url: str = UPSTREAM_HEALTH_URL) -> ConnectivityResult:
+    """
+    Staged reachability check of the kiosk API: DNS (briefly cached), then
+    a HEAD on the pooled client, so a healthy probe costs one small request
+    on a kept-alive connection. Only when the HTTP stage cannot connect is
+    the name resolved afresh and a bare TCP connect made to that address,
+    to tell a resolver, network or server failure apart.
+    """
+    result = ConnectivityResult()
+    parts = urlsplit(url)
+    host = parts.hostname
+    port = parts.port or (443 if parts.scheme == "https" else 80)
+
+    # Stage 1: DNS
+    start = time.monotonic()
+    try:
+        addresses = await asyncio.wait_for(dns_cache.resolve(host, port), timeout=CONNECT_PROBE_TIMEOUT)
+    except Exception as e:
+        result.failed_stage = "dns"
+        result.error = f"{type(e).__name__}: {e}"
+        return result
+    result.rtt["dns"] = round(time.monotonic() - start, 4)
+
+    # Stage 2: HEAD over the pooled connection
+    start = time.monotonic()
+    try:
+        resp = await get_client().head(url, timeout=CONNECT_PROBE_TIMEOUT)
+        result.rtt["http"] = round(time.monotonic() - start, 4)
+        result.status_code = resp.status_code
+        if resp.status_code >= 500:
+            result.failed_stage = "http"
+            result.error = f"HTTP {resp.status_code}"
+            return result
+        result.ok = True
+        return result
+    except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+        http_error = e
+    except Exception as e:
+        result.failed_stage = "http"
+        result.error = f"{type(e).__name__}: {e}"
+        return result
+
+    # Stage 3: could not connect - resolve again (httpx did its own lookup,
+    # the cached answer may be stale) and check plain TCP to locate the failure
+    dns_cache.invalidate(host, port)
+    try:
+        addresses = await asyncio.wait_for(dns_cache.resolve(host, port), timeout=CONNECT_PROBE_TIMEOUT)
+    except Exception as e:
+        result.failed_stage = "dns"
+        result.error = f"{type(e).__name__}: {e}"
+        health_logger.info(f"Connectivity probe failed at dns: {result.error}")
+        return result
+    start = time.monotonic()
+    try:
+        _, writer = await asyncio.wait_for(
+            asyncio.open_connection(addresses[0][0], port), timeout=CONNECT_PROBE_TIMEOUT)
+        writer.close()
+        result.rtt["tcp"] = round(time.monotonic() - start, 4)
+        result.failed_stage = "http"
+        result.error = f"{type(http_error).__name__}: {http_error}"
+    except Exception as e:
+        result.failed_stage = "tcp"
+        result.error = f"{type(e).__name__}: {e}"
+    health_logger.info(f"Connectivity probe failed at {result.failed_stage}: {result.error}")
+    return result
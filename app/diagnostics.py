@@ -1,81 +1,173 @@
-import subprocess
-import socket
-import urllib.request
-from app.health import internet_ok, printer_connected
+import asyncio
+import os
+import shutil
+import time
+from email.utils import parsedate_to_datetime
+from app.health import printer_connected, check_cups_queue
+from app.connectivity import probe_connectivity, UPSTREAM_HEALTH_URL
+from app.http_client import get_client
+from app.ipp import ipp_client, CUPS_IPP
+from app.logger import health_logger
 
-PRINTER_USB_VENDORS = {
-    "03f0",  # HP
-    "04a9",  # Canon
-    "04f9"  # Brother
-}
+# Overall budget for one diagnostics run; checks still running are reported as timed out
+DIAGNOSTICS_DEADLINE = float(os.getenv("DIAGNOSTICS_DEADLINE", "4"))
+# Dashboard refreshes within this window reuse the previous run
+DIAGNOSTICS_CACHE_TTL = float(os.getenv("DIAGNOSTICS_CACHE_TTL", "5"))
 
+CUPS_SPOOL_DIR = "/var/spool/cups"
+MIN_SPOOL_FREE_MB = int(os.getenv("MIN_SPOOL_FREE_MB", "200"))
+MAX_NOTIFICATION_BACKLOG = int(os.getenv("MAX_NOTIFICATION_BACKLOG", "100"))
+MAX_NOTIFICATION_AGE = 3600
+MAX_CLOCK_SKEW = 60
 
-'''def check_internet():
-    try:
-        urllib.request.urlopen("https://www.google.com", timeout=3)
-        return True
-    except Exception:
-        return False
-def check_internet(timeout=2) -> bool:
-    hosts = [
-        ("1.1.1.1", 53),
-        ("8.8.8.8", 53),
-    ]
-    for host in hosts:
-        try:
-            health_logger.info(f"Internet is ok {host}")
-            socket.create_connection(host, timeout=timeout)
-            return True
-        except:
-            continue
-    return False'''
-
-
-def check_backend():
-    try:
-        socket.create_connection(("127.0.0.1", 8000), timeout=2)
-        return True
-    except Exception:
-        return False
+_checks = {}
 
 
-def check_frontend():
-    try:
-        socket.create_connection(("127.0.0.1", 5173), timeout=2)
-        return True
-    except Exception:
-        return False
+def diagnostic(name: str):
+    """
+    Register an async check for /owner/health. The check returns a bool
+    or (bool, detail); exceptions count as a failure.
+    """
+    def register(func):
+        _checks[name] = func
+        return func
+    return register
+
+
+async def _port_open(host: str, port: int):
+    _, writer = await asyncio.open_connection(host, port)
+    writer.close()
+    return True
+
+
+@diagnostic("internet")
+async def check_internet():
+    result = await probe_connectivity()
+    return result.ok, result.to_dict()
+
 
+@diagnostic("backend")
+async def check_backend():
+    return await _port_open("127.0.0.1", 8000)
 
-'''def check_printer():
+
+@diagnostic("frontend")
+async def check_frontend():
+    return await _port_open("127.0.0.1", 5173)
+
+
+@diagnostic("printer")
+async def check_printer():
+    return printer_connected()
+
+
+@diagnostic("cups_scheduler")
+async def check_cups_scheduler():
+    if CUPS_IPP:
+        # Any answer on the CUPS socket means the scheduler is up
+        queues = await ipp_client.get_printers(("printer-name",))
+        return True, f"scheduler is running, {len(queues)} queue(s)"
+    proc = await asyncio.create_subprocess_exec(
+        "lpstat", "-r",
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.DEVNULL
+    )
     try:
-        result = subprocess.check_output(["/usr/bin/lsusb"], text=True)
-        for line in result.splitlines():
-            for vendor_id in PRINTER_USB_VENDORS:
-                if f"ID {vendor_id}:" in line:
-                    return True
-        return False
-    except Exception:
-        return False
+        stdout, _ = await proc.communicate()
+    except asyncio.CancelledError:
+        # The run's deadline passed; don't leave lpstat behind
+        proc.kill()
+        raise
+    output = stdout.decode(errors="replace").strip()
+    # Output: "scheduler is running" / "scheduler is not running"
+    return proc.returncode == 0 and "not running" not in output, output
+
+
+@diagnostic("queue_enabled")
+async def check_queue_enabled():
+    return await check_cups_queue()
+
+
+@diagnostic("spool_disk")
+async def check_spool_disk():
+    path = CUPS_SPOOL_DIR if os.path.isdir(CUPS_SPOOL_DIR) else "/"
+    usage = await asyncio.to_thread(shutil.disk_usage, path)
+    free_mb = usage.free // (1024 * 1024)
+    return free_mb >= MIN_SPOOL_FREE_MB, {"path": path, "free_mb": free_mb}
+
+
+@diagnostic("notification_backlog")
+async def check_notification_backlog():
+    from app.notification_queue import notification_queue
+    stats = await asyncio.to_thread(notification_queue.stats)
+    oldest_age = stats["oldest_age"] or 0
+    ok = stats["depth"] <= MAX_NOTIFICATION_BACKLOG and oldest_age <= MAX_NOTIFICATION_AGE
+    return ok, {"depth": stats["depth"], "oldest_age": stats["oldest_age"]}
+
+
+@diagnostic("clock_skew")
+async def check_clock_skew():
+    """Compare the local clock with the API server's Date header"""
+    resp = await get_client().head(UPSTREAM_HEALTH_URL, timeout=3)
+    date = resp.headers.get("date")
+    if not date:
+        return False, "server sent no Date header"
+    skew = time.time() - parsedate_to_datetime(date).timestamp()
+    return abs(skew) <= MAX_CLOCK_SKEW, {"skew_seconds": round(skew, 1)}
+
+
+async def _timed(name: str, check) -> dict:
+    start = time.monotonic()
     try:
-        result1 = subprocess.check_output(
-            ["/usr/bin/lpstat", "-p"],
-            #stdout=subprocess.PIPE,
-            #stderr=subprocess.DEVNULL,
-            timeout=4,
-            text=True
-        )
-        #return out #or "enabled" in out"""
-        return "HpQueue" in result1
-    except Exception:
-        print("exception")
-        return False'''
-
-
-def run_diagnostics():
-    return {
-        "internet": internet_ok(), #check_internet(),
-        "backend": check_backend(),
-        "frontend": check_frontend(),
-        "printer": printer_connected(), #check_printer(),
+        result = await check()
+        ok, detail = result if isinstance(result, tuple) else (result, None)
+    except Exception as e:
+        ok, detail = False, f"{type(e).__name__}: {e}"
+    return {"ok": bool(ok), "latency": round(time.monotonic() - start, 4), "detail": detail}
+
+
+_last_run = None
+_last_run_at = 0.0
+_running = None
+
+
+async def run_diagnostics(deadline: float = DIAGNOSTICS_DEADLINE) -> dict:
+    """
+    Run every registered check concurrently under one deadline. Results
+    are reused for DIAGNOSTICS_CACHE_TTL and concurrent callers share a run.
+    """
+    global _running
+    if _last_run is not None and time.monotonic() - _last_run_at < DIAGNOSTICS_CACHE_TTL:
+        return dict(_last_run, cached=True)
+    if _running is None or _running.done():
+        _running = asyncio.get_running_loop().create_task(_run_all(deadline))
+    return await asyncio.shield(_running)
+
+
+async def _run_all(deadline: float) -> dict:
+    global _last_run, _last_run_at
+    start = time.monotonic()
+    tasks = {name: asyncio.create_task(_timed(name, check)) for name, check in _checks.items()}
+    done, pending = await asyncio.wait(tasks.values(), timeout=deadline)
+    for task in pending:
+        task.cancel()
+
+    checks = {}
+    for name, task in tasks.items():
+        if task in done:
+            checks[name] = task.result()
+        else:
+            checks[name] = {"ok": False, "latency": deadline, "detail": "timed out"}
+    failed = [name for name, check in checks.items() if not check["ok"]]
+    if failed:
+        health_logger.warning(f"Diagnostics failed: {', '.join(failed)}")
+
+    _last_run = {
+        "status": "FAIL" if failed else "OK",
+        "duration": round(time.monotonic() - start, 4),
+        "checked_at": time.time(),
+        "checks": checks,
+        "cached": False,
     }
+    _last_run_at = time.monotonic()
+    return _last_run
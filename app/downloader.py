@@ -0,0 +1,129 @@
+import asyncio
+import hashlib
+import os
+import time
+import httpx
+from app.http_client import get_client
+from app.logger import app_logger, event_logger
+
+DOWNLOAD_CHUNK_SIZE = int(os.getenv("DOWNLOAD_CHUNK_SIZE", str(64 * 1024)))
+DOWNLOAD_MAX_BYTES = int(os.getenv("DOWNLOAD_MAX_BYTES", str(200 * 1024 * 1024)))
+DOWNLOAD_MAX_RETRIES = int(os.getenv("DOWNLOAD_MAX_RETRIES", "4"))
+DOWNLOAD_TIMEOUT = float(os.getenv("DOWNLOAD_TIMEOUT", "30"))
+
+# Errors worth resuming after: the connection dropped, the read stalled or the
+# server had a transient hiccup
+RETRYABLE_ERRORS = (httpx.TransportError,)
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+class DownloadFailed(Exception):
+    pass
+
+
+class DownloadTooLarge(DownloadFailed):
+    pass
+
+
+class ChecksumMismatch(DownloadFailed):
+    pass
+
+
+async def download_to_file(url: str, file_obj, expected_sha256: str = None) -> dict:
+    """
+    Stream url into an open binary file, resuming with HTTP Range after
+    transient failures.
+
+    Returns a dict with size, sha256, ttfb, elapsed, throughput and resumes.
+    Raises DownloadFailed (or a subclass) when the download cannot complete.
+    """
+    client = get_client()
+    hasher = hashlib.sha256()
+    received = 0
+    total = None
+    resumes = 0
+    ttfb = None
+    start = time.monotonic()
+
+    for attempt in range(DOWNLOAD_MAX_RETRIES + 1):
+        # Identity encoding keeps byte offsets valid for Range resumes
+        headers = {"Accept-Encoding": "identity"}
+        if received:
+            headers["Range"] = f"bytes={received}-"
+        try:
+            async with client.stream("GET", url, headers=headers, timeout=DOWNLOAD_TIMEOUT) as resp:
+                if resp.status_code in RETRYABLE_STATUS:
+                    raise DownloadFailed(f"HTTP {resp.status_code}")
+                if resp.status_code == 200 and received:
+                    # Server ignored the Range header - start over
+                    app_logger.warning(f"Range not honoured for {url}, restarting download")
+                    file_obj.seek(0)
+                    file_obj.truncate()
+                    hasher = hashlib.sha256()
+                    received = 0
+                elif resp.status_code not in (200, 206):
+                    resp.raise_for_status()
+                    raise DownloadFailed(f"HTTP {resp.status_code}")
+
+                if total is None:
+                    total = _content_total(resp)
+                    if total is not None and total > DOWNLOAD_MAX_BYTES:
+                        raise DownloadTooLarge(f"{total} bytes exceeds limit of {DOWNLOAD_MAX_BYTES}")
+
+                async for chunk in resp.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                    if ttfb is None:
+                        ttfb = time.monotonic() - start
+                    received += len(chunk)
+                    if received > DOWNLOAD_MAX_BYTES:
+                        raise DownloadTooLarge(f"more than {DOWNLOAD_MAX_BYTES} bytes received")
+                    hasher.update(chunk)
+                    file_obj.write(chunk)
+            break
+
+        except DownloadTooLarge:
+            raise
+        except httpx.HTTPStatusError as e:
+            raise DownloadFailed(f"HTTP {e.response.status_code}")
+        except (DownloadFailed, *RETRYABLE_ERRORS) as e:
+            if attempt >= DOWNLOAD_MAX_RETRIES:
+                raise DownloadFailed(f"gave up after {attempt + 1} attempts: {e}")
+            resumes += 1
+            delay = min(0.5 * (2 ** attempt), 5)
+            app_logger.warning(f"Download of {url} interrupted at {received} bytes ({e}), resuming in {delay}s")
+            await asyncio.sleep(delay)
+
+    file_obj.flush()
+    elapsed = time.monotonic() - start
+
+    if total is not None and received != total:
+        raise DownloadFailed(f"incomplete download: {received}/{total} bytes")
+
+    digest = hasher.hexdigest()
+    if expected_sha256 and digest.lower() != expected_sha256.lower():
+        raise ChecksumMismatch(f"sha256 {digest} does not match expected {expected_sha256}")
+
+    stats = {
+        "size": received,
+        "sha256": digest,
+        "ttfb": round(ttfb, 3) if ttfb is not None else None,
+        "elapsed": round(elapsed, 3),
+        "throughput_kbps": round(received / 1024 / elapsed, 1) if elapsed > 0 else None,
+        "resumes": resumes,
+    }
+    event_logger.info(
+        f"Downloaded {received} bytes in {stats['elapsed']}s "
+        f"(ttfb {stats['ttfb']}s, {stats['throughput_kbps']} KB/s, resumes {resumes})"
+    )
+    return stats
+
+
+def _content_total(resp: httpx.Response):
+    """Full size of the resource from Content-Range or Content-Length"""
+    content_range = resp.headers.get("content-range")
+    if content_range and "/" in content_range:
+        size = content_range.rsplit("/", 1)[1]
+        return int(size) if size.isdigit() else None
+    length = resp.headers.get("content-length")
+    if length and length.isdigit() and resp.status_code == 200:
+        return int(length)
+    return None
@@ -0,0 +1,206 @@
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from app.logger import app_logger, event_logger
+
+PDF_CACHE_DIR = os.getenv("PDF_CACHE_DIR", "/home/vinay/backend/pdf_cache")
+PDF_CACHE_MAX_BYTES = int(os.getenv("PDF_CACHE_MAX_BYTES", str(500 * 1024 * 1024)))
+INDEX_FILE = "index.json"
+# Index changes within this window are written together, from a timer thread
+INDEX_SAVE_DELAY = 2.0
+
+
+class FileCache:
+    """
+    Content-addressed store for downloaded PDFs. Files are stored once per
+    sha256 and found by the server's file id. Entries in use by a print
+    are reference counted and never evicted; the rest are evicted least
+    recently used first once the byte budget is exceeded.
+    """
+
+    def __init__(self, directory: str = PDF_CACHE_DIR, max_bytes: int = PDF_CACHE_MAX_BYTES):
+        self.directory = os.path.abspath(directory)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # sha256 -> {"size", "refs", "file_ids"}
+        self._ids = {}  # file id -> sha256
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self.evictions = 0
+        self._save_timer = None
+        self._load()
+
+    def _path(self, sha256: str) -> str:
+        return os.path.join(self.directory, f"{sha256}.pdf")
+
+    def _load(self):
+        """Rebuild the index from disk, dropping entries whose file is gone"""
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(os.path.join(self.directory, INDEX_FILE)) as f:
+                index = json.load(f)
+        except FileNotFoundError:
+            index = {}
+        except Exception as e:
+            app_logger.error(f"Failed to load PDF cache index: {e}")
+            index = {}
+        for name in os.listdir(self.directory) if os.path.isdir(self.directory) else []:
+            if name.endswith(".part"):
+                # Download interrupted by a restart
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+        for file_id, sha256 in index.items():
+            try:
+                size = os.path.getsize(self._path(sha256))
+            except OSError:
+                continue
+            entry = self._entries.setdefault(sha256, {"size": size, "refs": 0, "file_ids": set()})
+            entry["file_ids"].add(file_id)
+            self._ids[file_id] = sha256
+
+    def _save_index(self):
+        """Schedule an index write; called with the lock held"""
+        if self._save_timer is None:
+            self._save_timer = threading.Timer(INDEX_SAVE_DELAY, self.flush)
+            self._save_timer.daemon = True
+            self._save_timer.start()
+
+    def flush(self):
+        """Write the index now if it changed. Blocking."""
+        with self._lock:
+            if self._save_timer is None:
+                return
+            self._save_timer.cancel()
+            self._save_timer = None
+            index = json.dumps(self._ids)
+        path = os.path.join(self.directory, INDEX_FILE)
+        try:
+            with open(path + ".tmp", "w") as f:
+                f.write(index)
+            os.replace(path + ".tmp", path)
+        except Exception as e:
+            app_logger.error(f"Failed to save PDF cache index: {e}")
+
+    def new_file(self):
+        """Open a temp file on the cache's filesystem for a download"""
+        os.makedirs(self.directory, exist_ok=True)
+        return tempfile.NamedTemporaryFile(delete=False, suffix=".part", dir=self.directory)
+
+    def acquire(self, file_id: str, sha256: str = None):
+        """Path of a cached copy of file_id (pinned until released), or None"""
+        with self._lock:
+            cached = self._ids.get(file_id)
+            if cached is None or (sha256 and cached != sha256.lower()) or not os.path.exists(self._path(cached)):
+                self.misses += 1
+                return None
+            entry = self._entries[cached]
+            entry["refs"] += 1
+            self._entries.move_to_end(cached)
+            self.hits += 1
+            self.bytes_saved += entry["size"]
+        event_logger.info(f"PDF cache hit for file {file_id} ({entry['size']} bytes)")
+        return self._path(cached)
+
+    def store(self, file_id: str, temp_path: str, sha256: str) -> str:
+        """Move a finished download into the cache and pin it; returns the path to print"""
+        if self.max_bytes <= 0:
+            return temp_path
+        sha256 = sha256.lower()
+        path = self._path(sha256)
+        with self._lock:
+            entry = self._entries.get(sha256)
+            if entry is None:
+                size = os.path.getsize(temp_path)
+                if size > self.max_bytes:
+                    return temp_path
+                os.replace(temp_path, path)
+                entry = self._entries[sha256] = {"size": size, "refs": 0, "file_ids": set()}
+            else:
+                # Same content under another id: keep the copy we already have
+                os.remove(temp_path)
+            entry["refs"] += 1
+            entry["file_ids"].add(file_id)
+            self._entries.move_to_end(sha256)
+            self._ids[file_id] = sha256
+            self._evict()
+            self._save_index()
+        return path
+
+    def _entry_for(self, file_path: str):
+        name = os.path.basename(file_path)
+        sha256 = name[:-4] if name.endswith(".pdf") else None
+        return self._entries.get(sha256) if os.path.dirname(file_path) == self.directory else None
+
+    def pin(self, file_path: str) -> bool:
+        """Pin a cached file again, e.g. for a job resumed after a restart"""
+        if not file_path:
+            return False
+        with self._lock:
+            entry = self._entry_for(file_path)
+            if entry is None:
+                return False
+            entry["refs"] += 1
+            return True
+
+    def release(self, file_path: str):
+        """Unpin a file after printing; files outside the cache are deleted"""
+        if not file_path:
+            return
+        with self._lock:
+            entry = self._entry_for(file_path)
+            if entry is not None:
+                entry["refs"] = max(entry["refs"] - 1, 0)
+                if self._evict():
+                    self._save_index()
+                return
+        try:
+            if os.path.exists(file_path):
+                os.remove(file_path)
+                event_logger.info(f"Temp file deleted: {file_path}")
+        except Exception as e:
+            app_logger.error(f"Failed to delete temp file {file_path}: {e}")
+
+    def _evict(self) -> int:
+        """Evict unpinned entries over the budget; returns how many went"""
+        evicted = 0
+        total = sum(entry["size"] for entry in self._entries.values())
+        for sha256 in list(self._entries):
+            if total <= self.max_bytes:
+                break
+            entry = self._entries[sha256]
+            if entry["refs"] > 0:
+                continue
+            try:
+                os.remove(self._path(sha256))
+            except OSError:
+                pass
+            for file_id in entry["file_ids"]:
+                self._ids.pop(file_id, None)
+            del self._entries[sha256]
+            total -= entry["size"]
+            self.evictions += 1
+            evicted += 1
+        return evicted
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": sum(entry["size"] for entry in self._entries.values()),
+                "pinned": sum(1 for entry in self._entries.values() if entry["refs"]),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 3) if lookups else None,
+                "bytes_saved": self.bytes_saved,
+                "evictions": self.evictions,
+            }
+
+
+# Global instance
+file_cache = FileCache()
@@ -1,33 +1,52 @@
-import subprocess
-import urllib.request
+import asyncio
 from app.logger import health_logger
+from app.connectivity import probe_connectivity
+from app.usb_presence import printer_presence
+from app.health_snapshot import health_snapshot
+from app.probes import probe_scheduler, Probe
+from app.ipp import ipp_client, CUPS_IPP, PRINTER_STATES
 
-# Known printer USB vendor IDs (hex)
-PRINTER_USB_VENDORS = {
-    "03f0",  # HP
-    "04a9",  # Canon
-    "04f9",  # Brother
-}
-
-def internet_ok():
-    try:
-        urllib.request.urlopen("https://www.google.com", timeout=3)
-        return True
-    except Exception:
-        return False
-        
 def printer_connected() -> bool:
     try:
-        result = subprocess.check_output(["/usr/bin/lsusb"], text=True, timeout=3)
-        for line in result.splitlines():
-            for vendor_id in PRINTER_USB_VENDORS:
-                if f"ID {vendor_id}:" in line:
-                    return True
-        return False
+        return printer_presence.connected()
     except Exception:
-        health_logger.exception("Printer status not retrieved. Error occured while runing 'lsusb'")
+        health_logger.exception("Printer status not retrieved. Error occured while scanning USB devices")
         return False
 
 
-def system_healthy() -> bool:
-    return internet_ok() and printer_connected()
+async def check_upstream():
+    """DNS, TCP and HTTP reachability of the kiosk API, with per-stage RTTs"""
+    result = await probe_connectivity()
+    return result.ok, result.to_dict()
+
+
+async def check_printer() -> bool:
+    return printer_connected()
+
+
+async def check_cups_queue():
+    """The CUPS queue exists and is accepting jobs"""
+    from app.printer_registry import printer_registry
+    queue = await printer_registry.resolve_default()
+    if CUPS_IPP:
+        attributes = await ipp_client.get_printer_attributes(queue)
+        accepting = attributes.get("printer-is-accepting-jobs", True)
+        state = PRINTER_STATES.get(attributes.get("printer-state"), "unknown")
+        detail = f"printer {queue} is {state}. {attributes.get('printer-state-message') or ''}".strip()
+        return state != "stopped" and accepting, detail
+    proc = await asyncio.create_subprocess_exec(
+        "lpstat", "-p", queue,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.DEVNULL
+    )
+    stdout, _ = await asyncio.wait_for(proc.communicate(), timeout=5)
+    output = stdout.decode(errors="replace")
+    # Output: "printer HpQueue is idle.  enabled since ..."
+    return proc.returncode == 0 and "disabled" not in output, output.split("\n")[0].strip()
+
+
+# Cadences in seconds: base, fastest (degraded / print active), slowest (stable)
+probe_scheduler.add(Probe("upstream", check_upstream, 30, 5, 300))
+probe_scheduler.add(Probe("printer", check_printer, 30, 2, 120, rise=1, fall=1))
+probe_scheduler.add(Probe("cups_queue", check_cups_queue, 60, 10, 300))
+health_snapshot.set_refresher(probe_scheduler.run_all)
@@ -0,0 +1,69 @@
+import asyncio
+import time
+
+
+class HealthSnapshot:
+    """
+    In-memory health state written by the background checkers and read
+    by /health. Reads never probe anything; refresh() runs the registered
+    checks once and shares the result with every concurrent caller.
+    """
+
+    def __init__(self, required=("upstream", "printer")):
+        self.required = required
+        self.components = {}
+        self.updated_at = None
+        self._refresher = None
+        self._refreshing = None
+        self.refreshes = 0
+        self.coalesced_refreshes = 0
+
+    def set_refresher(self, refresher):
+        """refresher() is an async callable that re-runs every check"""
+        self._refresher = refresher
+
+    def update(self, name: str, ok: bool, detail=None):
+        now = time.time()
+        self.components[name] = {"ok": bool(ok), "checked_at": now, "detail": detail}
+        self.updated_at = now
+
+    def get(self, name: str):
+        component = self.components.get(name)
+        return component["ok"] if component else None
+
+    def healthy(self) -> bool:
+        return all(self.get(name) for name in self.required)
+
+    def to_dict(self) -> dict:
+        now = time.time()
+        return {
+            "healthy": self.healthy(),
+            "timestamp": self.updated_at,
+            "components": {
+                name: {
+                    "ok": component["ok"],
+                    "checked_at": component["checked_at"],
+                    "age": round(now - component["checked_at"], 3),
+                    "detail": component["detail"],
+                }
+                for name, component in self.components.items()
+            },
+        }
+
+    async def refresh(self):
+        """Run every check once; concurrent callers share one run"""
+        if self._refreshing is not None and not self._refreshing.done():
+            self.coalesced_refreshes += 1
+            return await asyncio.shield(self._refreshing)
+        self._refreshing = asyncio.get_running_loop().create_task(self._run_checks())
+        return await asyncio.shield(self._refreshing)
+
+    async def _run_checks(self):
+        self.refreshes += 1
+        if self._refresher is None:
+            return self.healthy()
+        return await self._refresher()
+
+
+# Global instance
+health_snapshot = HealthSnapshot()
@@ -1,40 +1,48 @@
-import time
 import asyncio
-from app.health import system_healthy
+from app.health_snapshot import health_snapshot
 from app.ws import ws_manager
-from app.logger import health_logger, app_logger
+from app.logger import health_logger, app_logger, event_logger
 from app.state import kiosk_state
 from app.notification_queue import notification_queue
+from app.http_client import get_client
+from app.supervisor import supervisor
 
-def start_health_watcher():
-    """Background health monitor thread"""
-    
-    # Create event loop for this thread
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
+_wake = asyncio.Event()
+
+def wake_health_watcher():
+    """Re-evaluate health now instead of waiting for the tick. Safe from any thread."""
+    loop = supervisor.loop
+    if loop is None:
+        return
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is loop:
+        _wake.set()
+    else:
+        loop.call_soon_threadsafe(_wake.set)
+
+async def run_health_watcher():
+    """Background health monitor task"""
     health_logger.info("started health watcher")
     
     last_state = None
-    time.sleep(10)
+    await health_snapshot.refresh()
+    await asyncio.sleep(10)
     while True:
         try:
-            healthy = system_healthy()
+            # Probes run on their own cadence; this only reacts to the snapshot
+            healthy = health_snapshot.healthy()
             #health_logger.info("in health watcher loop")
             if healthy != last_state:
                 if healthy:
-                    # Use loop.run_until_complete to run async function
                     try:
-                        loop.run_until_complete(
-                            ws_manager.broadcast({"event": "HEALTHY"})
-                        )
+                        await ws_manager.broadcast({"event": "HEALTHY"})
                     except Exception as e :
                         health_logger.error(f"Broadcast exception: {e}")
-                    loop.run_until_complete(
-                            notification_queue.process_queue()
-                        )
-                    loop.run_until_complete(
-                                send_server_enable("Printer is back online or the system is healthy")
-                        )
+                    await notification_queue.process_queue()
+                    await send_server_enable("Printer is back online or the system is healthy")
                     last_state = healthy
                 else:
                     if kiosk_state.is_handling_print_error():
@@ -42,64 +50,62 @@ def start_health_watcher():
                         last_state = None
                     else:
                         try:
-                            #health_logger.info("started health watcher")  # Use loop.run_until_complete to run async function
-                            loop.run_until_complete(
-                                ws_manager.broadcast({"event": "OUT_OF_SERVICE"})
-                            )
+                            await ws_manager.broadcast({"event": "OUT_OF_SERVICE"})
                         except Exception as e :
                             health_logger.error(f"Broadcast exception: {e}")
-                        loop.run_until_complete(
-                                send_server_outOfService("Printer is offline or the system is out of service.")
-                        )    
+                        await send_server_outOfService("Printer is offline or the system is out of service.")
                         last_state = healthy
                 # No state change - log current status periodically
         except Exception as e:
             health_logger.error(f"Health watcher error: {e}", exc_info=True)
         
-        time.sleep(10)  # Check every 10 seconds
+        # Re-evaluate every 10 seconds or as soon as a probe flips
+        try:
+            await asyncio.wait_for(_wake.wait(), timeout=10)
+        except asyncio.TimeoutError:
+            pass
+        _wake.clear()
 
 async def send_server_outOfService(message_str: str):
-    import httpx
     from app.server_api import SERVER_URL, KIOSK_ID
     
     notify_url = f"{SERVER_URL}/{KIOSK_ID}/out_of_service"
     
     try:
-        async with httpx.AsyncClient(timeout=5) as client:
-            resp = await client.post(
-                notify_url,
-                json={
-                    "message": f"{message_str}  Kiosk ID : {KIOSK_ID}"
-                }
-            )
+        resp = await get_client().post(
+            notify_url,
+            json={
+                "message": f"{message_str}  Kiosk ID : {KIOSK_ID}"
+            },
+            timeout=5
+        )
+        
+        if resp.status_code == 200:
+            event_logger.info("Server notification for Out of Service Successful")
+        else:
+            app_logger.warning(f"Failed to notify out of service to server: {resp.status_code}")
             
-            if resp.status_code == 200:
-                event_logger.info(f"Server notification for Out of Service Successful: {code}")
-            else:
-                app_logger.warning(f"Failed to notify out of service to server: {resp.status_code}")
-                
     except Exception as e:
         app_logger.error(f"Failed to notify out of service to server: {e}")
         
 async def send_server_enable(message_str: str):
-    import httpx
     from app.server_api import SERVER_URL, KIOSK_ID
     
     notify_url = f"{SERVER_URL}/{KIOSK_ID}/out_of_enable"
     
     try:
-        async with httpx.AsyncClient(timeout=5) as client:
-            resp = await client.post(
-                notify_url,
-                json={
-                    "message": f"{message_str}  Kiosk ID : {KIOSK_ID}"
-                }
-            )
+        resp = await get_client().post(
+            notify_url,
+            json={
+                "message": f"{message_str}  Kiosk ID : {KIOSK_ID}"
+            },
+            timeout=5
+        )
+        
+        if resp.status_code == 200:
+            event_logger.info("Server notification for Enable Successful")
+        else:
+            app_logger.warning(f"Failed to notify Enable to server: {resp.status_code}")
             
-            if resp.status_code == 200:
-                event_logger.info(f"Server notification for Enable Successful: {code}")
-            else:
-                app_logger.warning(f"Failed to notify Enable to server: {resp.status_code}")
-                
     except Exception as e:
         app_logger.error(f"Failed to notify Enable to server: {e}")
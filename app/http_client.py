@@ -0,0 +1,105 @@
+import asyncio
+import os
+import threading
+import weakref
+import httpx
+from app.logger import app_logger
+
+# Pool / timeout configuration for upstream (kiosk API) calls
+UPSTREAM_HTTP2 = os.getenv("UPSTREAM_HTTP2", "1") == "1"
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "10"))
+UPSTREAM_MAX_KEEPALIVE = int(os.getenv("UPSTREAM_MAX_KEEPALIVE", "5"))
+UPSTREAM_KEEPALIVE_EXPIRY = float(os.getenv("UPSTREAM_KEEPALIVE_EXPIRY", "120"))
+UPSTREAM_TIMEOUT = float(os.getenv("UPSTREAM_TIMEOUT", "8"))
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", "5"))
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+class ClientStats:
+    """Connection reuse counters shared by every pooled client"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.new_connections = 0
+        self.tls_handshakes = 0
+
+    def incr(self, name: str, amount: int = 1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            reused = max(self.requests - self.new_connections, 0)
+            return {
+                "requests": self.requests,
+                "new_connections": self.new_connections,
+                "reused_connections": reused,
+                "tls_handshakes": self.tls_handshakes,
+                "reuse_ratio": round(reused / self.requests, 3) if self.requests else None,
+            }
+
+
+client_stats = ClientStats()
+
+# One client per event loop - httpx clients cannot be shared across loops
+_clients = weakref.WeakKeyDictionary()
+_clients_lock = threading.Lock()
+
+
+async def _trace(event_name: str, info: dict):
+    if event_name == "connection.connect_tcp.complete":
+        client_stats.incr("new_connections")
+    elif event_name == "connection.start_tls.complete":
+        client_stats.incr("tls_handshakes")
+
+
+async def _on_request(request: httpx.Request):
+    request.extensions["trace"] = _trace
+
+
+async def _on_response(response: httpx.Response):
+    client_stats.incr("requests")
+
+
+def _build_client(http2: bool) -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        http2=http2,
+        timeout=httpx.Timeout(UPSTREAM_TIMEOUT, connect=UPSTREAM_CONNECT_TIMEOUT),
+        limits=httpx.Limits(
+            max_connections=UPSTREAM_MAX_CONNECTIONS,
+            max_keepalive_connections=UPSTREAM_MAX_KEEPALIVE,
+            keepalive_expiry=UPSTREAM_KEEPALIVE_EXPIRY,
+        ),
+        event_hooks={"request": [_on_request], "response": [_on_response]},
+    )
+
+
+def get_client() -> httpx.AsyncClient:
+    """Return the long-lived upstream client for the running event loop"""
+    loop = asyncio.get_running_loop()
+    with _clients_lock:
+        client = _clients.get(loop)
+        if client is None or client.is_closed:
+            http2 = UPSTREAM_HTTP2 and _http2_available()
+            client = _build_client(http2)
+            _clients[loop] = client
+            app_logger.info(f"Created pooled upstream client (http2={http2})")
+        return client
+
+
+async def close_client():
+    """Close the pooled client owned by the running event loop"""
+    loop = asyncio.get_running_loop()
+    with _clients_lock:
+        client = _clients.pop(loop, None)
+    if client is not None and not client.is_closed:
+        await client.aclose()
+        app_logger.info("Pooled upstream client closed")
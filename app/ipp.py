@@ -0,0 +1,463 @@
+import asyncio
+import getpass
+import os
+import struct
+import time
+
+# Talk IPP to CUPS directly instead of forking lp/lpstat/cancel/cupsenable
+CUPS_IPP = os.getenv("CUPS_IPP", "1") == "1"
+# Unix socket path, or host:port (e.g. a local ipp_standin server)
+CUPS_SERVER = os.getenv("CUPS_SERVER", "/run/cups/cups.sock")
+IPP_TIMEOUT = float(os.getenv("IPP_TIMEOUT", "30"))
+IPP_USER = os.getenv("IPP_USER")
+IPP_CHUNK = 256 * 1024
+HTTP_UNAUTHORIZED = 401
+IPP_NOT_FOUND = 0x0406
+
+# Operations
+PRINT_JOB = 0x0002
+CANCEL_JOB = 0x0008
+GET_JOB_ATTRIBUTES = 0x0009
+GET_JOBS = 0x000A
+GET_PRINTER_ATTRIBUTES = 0x000B
+ENABLE_PRINTER = 0x0022
+CUPS_GET_DEFAULT = 0x4001
+CUPS_GET_PRINTERS = 0x4002
+
+# Delimiter tags
+OPERATION_ATTRIBUTES = 0x01
+JOB_ATTRIBUTES = 0x02
+END_OF_ATTRIBUTES = 0x03
+PRINTER_ATTRIBUTES = 0x04
+
+# Value tags
+INTEGER = 0x21
+BOOLEAN = 0x22
+ENUM = 0x23
+RANGE_OF_INTEGER = 0x33
+BEG_COLLECTION = 0x34
+END_COLLECTION = 0x37
+TEXT = 0x41
+NAME = 0x42
+KEYWORD = 0x44
+URI = 0x45
+CHARSET = 0x47
+NATURAL_LANGUAGE = 0x48
+MIME_MEDIA_TYPE = 0x49
+MEMBER_ATTR_NAME = 0x4A
+
+JOB_STATES = {3: "pending", 4: "pending-held", 5: "processing", 6: "processing-stopped",
+              7: "canceled", 8: "aborted", 9: "completed"}
+PRINTER_STATES = {3: "idle", 4: "printing", 5: "stopped"}
+
+# Job template attributes with a fixed IPP syntax; anything else (PPD
+# options such as ColorModel) is sent as a name, like lp -o does
+_JOB_ATTRIBUTE_TAGS = {
+    "copies": INTEGER,
+    "orientation-requested": ENUM,
+    "print-quality": ENUM,
+    "sides": KEYWORD,
+    "media": KEYWORD,
+    "print-color-mode": KEYWORD,
+    "page-ranges": RANGE_OF_INTEGER,
+}
+
+
+class IppError(Exception):
+    def __init__(self, message: str, status: int = None):
+        super().__init__(message)
+        self.status = status
+
+
+def _encode_value(tag: int, value) -> bytes:
+    if tag in (INTEGER, ENUM):
+        return struct.pack(">i", int(value))
+    if tag == BOOLEAN:
+        return b"\x01" if value else b"\x00"
+    if tag == RANGE_OF_INTEGER:
+        return struct.pack(">ii", *value)
+    if isinstance(value, bytes):
+        return value
+    return str(value).encode("utf-8")
+
+
+def _encode_attribute(tag: int, name: str, values) -> bytes:
+    if not isinstance(values, list):
+        values = [values]
+    out = bytearray()
+    for i, value in enumerate(values):
+        encoded_name = name.encode("utf-8") if i == 0 else b""
+        encoded = _encode_value(tag, value)
+        out += struct.pack(">BH", tag, len(encoded_name)) + encoded_name
+        out += struct.pack(">H", len(encoded)) + encoded
+    return bytes(out)
+
+
+def encode_message(code: int, request_id: int, groups: list) -> bytes:
+    """
+    Encode an IPP/1.1 message header. code is the operation (requests) or
+    status (responses); groups is [(group_tag, [(value_tag, name, value), ...])].
+    """
+    out = bytearray(struct.pack(">BBHI", 1, 1, code, request_id))
+    for group_tag, attributes in groups:
+        out.append(group_tag)
+        for tag, name, value in attributes:
+            out += _encode_attribute(tag, name, value)
+    out.append(END_OF_ATTRIBUTES)
+    return bytes(out)
+
+
+def _decode_value(tag: int, data: bytes):
+    if tag in (INTEGER, ENUM) and len(data) == 4:
+        return struct.unpack(">i", data)[0]
+    if tag == BOOLEAN and len(data) == 1:
+        return data != b"\x00"
+    if tag == RANGE_OF_INTEGER and len(data) == 8:
+        return struct.unpack(">ii", data)
+    if 0x40 <= tag <= 0x5F:
+        return data.decode("utf-8", errors="replace")
+    return data  # octetString, dateTime, resolution, out-of-band values
+
+
+class IppMessage:
+    def __init__(self, version, code: int, request_id: int, groups: list, data: bytes = b""):
+        self.version = version
+        self.code = code
+        self.request_id = request_id
+        self.groups = groups  # [(group_tag, {name: value or [values]})]
+        self.data = data
+
+    def group(self, tag: int) -> dict:
+        """First group with the tag, e.g. the operation attributes"""
+        for group_tag, attributes in self.groups:
+            if group_tag == tag:
+                return attributes
+        return {}
+
+    def all_groups(self, tag: int) -> list:
+        """Every group with the tag, e.g. one per job in a Get-Jobs response"""
+        return [attributes for group_tag, attributes in self.groups if group_tag == tag]
+
+
+def decode_message(payload: bytes) -> IppMessage:
+    """Decode an IPP message; collections become dicts, multiple values lists"""
+    if len(payload) < 9:
+        raise IppError("Truncated IPP message")
+    major, minor, code, request_id = struct.unpack(">BBHI", payload[:8])
+    groups = []
+    pos = 8
+    attributes = None
+    name = None
+    stack = []  # enclosing (attributes, name) while inside a collection
+    while pos < len(payload):
+        tag = payload[pos]
+        pos += 1
+        if tag == END_OF_ATTRIBUTES:
+            break
+        if tag < 0x10:
+            attributes = {}
+            groups.append((tag, attributes))
+            continue
+        if attributes is None or pos + 4 > len(payload):
+            raise IppError("Malformed IPP message")
+        name_length = struct.unpack(">H", payload[pos:pos + 2])[0]
+        attr_name = payload[pos + 2:pos + 2 + name_length].decode("utf-8", errors="replace")
+        pos += 2 + name_length
+        value_length = struct.unpack(">H", payload[pos:pos + 2])[0]
+        value = payload[pos + 2:pos + 2 + value_length]
+        pos += 2 + value_length
+
+        if tag == END_COLLECTION:
+            attributes, name = stack.pop()
+            continue
+        if tag == MEMBER_ATTR_NAME:
+            name = value.decode("utf-8", errors="replace")
+            continue
+        if attr_name:
+            name = attr_name
+        if tag == BEG_COLLECTION:
+            collection = {}
+            _add_value(attributes, name, collection)
+            stack.append((attributes, name))
+            attributes = collection
+            continue
+        _add_value(attributes, name, _decode_value(tag, value))
+    return IppMessage((major, minor), code, request_id, groups, payload[pos:])
+
+
+def _add_value(attributes: dict, name: str, value):
+    if name not in attributes:
+        attributes[name] = value
+    elif isinstance(attributes[name], list):
+        attributes[name].append(value)
+    else:
+        attributes[name] = [attributes[name], value]
+
+
+def as_list(value) -> list:
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+def parse_page_ranges(text: str) -> list:
+    """"1-5,8" -> [(1, 5), (8, 8)]"""
+    ranges = []
+    for part in str(text).split(","):
+        part = part.strip()
+        if not part:
+            continue
+        low, _, high = part.partition("-")
+        ranges.append((int(low), int(high or low)))
+    return ranges
+
+
+def job_attribute(name: str, value):
+    """(value tag, name, value) for one job option"""
+    tag = _JOB_ATTRIBUTE_TAGS.get(name, NAME)
+    if tag == RANGE_OF_INTEGER:
+        value = parse_page_ranges(value)
+    return tag, name, value
+
+
+def _default_user() -> str:
+    try:
+        return getpass.getuser()
+    except Exception:
+        return "kiosk"
+
+
+class IppClient:
+    """
+    Minimal async IPP/1.1 client for the local CUPS scheduler. Each request
+    is one HTTP/1.1 POST over the CUPS unix socket (or TCP for a stand-in
+    server); documents are streamed from disk in chunks. Requests cupsd
+    answers with 401 (admin operations) are retried with PeerCred
+    authentication, which cupsd accepts over its local socket.
+    """
+
+    def __init__(self, server: str = CUPS_SERVER, timeout: float = IPP_TIMEOUT, user: str = None):
+        self.server = server
+        self.timeout = timeout
+        self.user = user or IPP_USER or _default_user()
+        self._request_id = 0
+        self.requests = 0
+        self.errors = 0
+        self.total_time = 0.0
+
+    def _printer_uri(self, printer: str) -> str:
+        return f"ipp://localhost/printers/{printer}"
+
+    def _operation(self, *attributes) -> tuple:
+        return OPERATION_ATTRIBUTES, [
+            (CHARSET, "attributes-charset", "utf-8"),
+            (NATURAL_LANGUAGE, "attributes-natural-language", "en"),
+            *attributes,
+        ]
+
+    async def _connect(self):
+        if self.server.startswith("/"):
+            return await asyncio.open_unix_connection(self.server)
+        host, _, port = self.server.rpartition(":")
+        return await asyncio.open_connection(host or "localhost", int(port))
+
+    async def request(self, operation: int, path: str, groups: list, document: str = None) -> IppMessage:
+        """Send one IPP request, optionally followed by a document file"""
+        started = time.monotonic()
+        self.requests += 1
+        try:
+            try:
+                response = await asyncio.wait_for(self._exchange(operation, path, groups, document), self.timeout)
+            except IppError as e:
+                if e.status != HTTP_UNAUTHORIZED or not self.server.startswith("/"):
+                    raise
+                response = await asyncio.wait_for(
+                    self._exchange(operation, path, groups, document, authorization=f"PeerCred {self.user}"),
+                    self.timeout)
+        except Exception:
+            self.errors += 1
+            raise
+        finally:
+            self.total_time += time.monotonic() - started
+        if response.code >= 0x0400:
+            self.errors += 1
+            message = response.group(OPERATION_ATTRIBUTES).get("status-message") or ""
+            raise IppError(f"IPP status 0x{response.code:04x} {message}".strip(), response.code)
+        return response
+
+    async def _exchange(self, operation, path, groups, document, authorization: str = None) -> IppMessage:
+        self._request_id = self._request_id % 0x7FFFFFFF + 1
+        body = encode_message(operation, self._request_id, groups)
+        length = len(body) + (os.path.getsize(document) if document else 0)
+        auth_header = f"Authorization: {authorization}\r\n" if authorization else ""
+        reader, writer = await self._connect()
+        try:
+            writer.write(
+                f"POST {path} HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/ipp\r\n"
+                f"Content-Length: {length}\r\n{auth_header}Connection: close\r\n\r\n".encode("ascii") + body
+            )
+            if document:
+                # Plain writes rather than loop.sendfile(), which uvloop does not implement
+                with open(document, "rb") as f:
+                    while True:
+                        chunk = await asyncio.to_thread(f.read, IPP_CHUNK)
+                        if not chunk:
+                            break
+                        writer.write(chunk)
+                        await writer.drain()
+            await writer.drain()
+            return decode_message(await _read_http_response(reader))
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except Exception:
+                pass
+
+    async def print_job(self, printer: str, file_path: str, options: list = (), job_name: str = None) -> int:
+        """Print-Job with the document streamed from file_path; returns the CUPS job id"""
+        operation = self._operation(
+            (URI, "printer-uri", self._printer_uri(printer)),
+            (NAME, "requesting-user-name", self.user),
+            (NAME, "job-name", job_name or os.path.basename(file_path)),
+            (MIME_MEDIA_TYPE, "document-format", "application/pdf"),
+        )
+        groups = [operation]
+        if options:
+            groups.append((JOB_ATTRIBUTES, [job_attribute(name, value) for name, value in options]))
+        response = await self.request(PRINT_JOB, f"/printers/{printer}", groups, document=file_path)
+        job_id = response.group(JOB_ATTRIBUTES).get("job-id")
+        if job_id is None:
+            raise IppError("Print-Job response carried no job-id")
+        return job_id
+
+    async def get_jobs(self, which: str = "not-completed", attributes=("job-id", "job-state",
+                       "job-state-reasons", "job-state-message", "job-printer-uri")) -> list:
+        """Get-Jobs across all queues; one attribute dict per job"""
+        response = await self.request(GET_JOBS, "/", [self._operation(
+            (URI, "printer-uri", "ipp://localhost/"),
+            (NAME, "requesting-user-name", self.user),
+            (KEYWORD, "which-jobs", which),
+            (KEYWORD, "requested-attributes", list(attributes)),
+        )])
+        return response.all_groups(JOB_ATTRIBUTES)
+
+    async def get_job_attributes(self, job_id: int) -> dict:
+        response = await self.request(GET_JOB_ATTRIBUTES, "/jobs", [self._operation(
+            (URI, "job-uri", f"ipp://localhost/jobs/{job_id}"),
+            (NAME, "requesting-user-name", self.user),
+        )])
+        return response.group(JOB_ATTRIBUTES)
+
+    async def cancel_job(self, job_id: int):
+        await self.request(CANCEL_JOB, "/jobs", [self._operation(
+            (URI, "job-uri", f"ipp://localhost/jobs/{job_id}"),
+            (NAME, "requesting-user-name", self.user),
+        )])
+
+    async def enable_printer(self, printer: str):
+        await self.request(ENABLE_PRINTER, "/admin/", [self._operation(
+            (URI, "printer-uri", self._printer_uri(printer)),
+            (NAME, "requesting-user-name", self.user),
+        )])
+
+    async def get_printer_attributes(self, printer: str, attributes=("printer-state", "printer-state-message",
+                                     "printer-state-reasons", "printer-is-accepting-jobs")) -> dict:
+        response = await self.request(GET_PRINTER_ATTRIBUTES, f"/printers/{printer}", [self._operation(
+            (URI, "printer-uri", self._printer_uri(printer)),
+            (KEYWORD, "requested-attributes", list(attributes)),
+        )])
+        return response.group(PRINTER_ATTRIBUTES)
+
+    async def get_default(self):
+        """CUPS-Get-Default; the default queue's name, or None if there is none"""
+        try:
+            response = await self.request(CUPS_GET_DEFAULT, "/", [self._operation(
+                (KEYWORD, "requested-attributes", ["printer-name"]),
+            )])
+        except IppError as e:
+            if e.status == IPP_NOT_FOUND:
+                return None
+            raise
+        return response.group(PRINTER_ATTRIBUTES).get("printer-name") or None
+
+    async def get_printers(self, attributes=("printer-name", "printer-state", "printer-state-message")) -> list:
+        """CUPS-Get-Printers; one attribute dict per queue, in CUPS order"""
+        response = await self.request(CUPS_GET_PRINTERS, "/", [self._operation(
+            (KEYWORD, "requested-attributes", list(attributes)),
+        )])
+        return [printer for printer in response.all_groups(PRINTER_ATTRIBUTES) if printer.get("printer-name")]
+
+    async def printer_states(self) -> dict:
+        """{queue: (enabled, status line)} for every queue, like parse_lpstat_printers()"""
+        states = {}
+        for printer in await self.get_printers():
+            name = printer["printer-name"]
+            state = printer.get("printer-state")
+            line = f"printer {name} is {PRINTER_STATES.get(state, state)}. {printer.get('printer-state-message') or ''}"
+            states[name] = (state != 5, line.strip())
+        return states
+
+    def stats(self) -> dict:
+        return {
+            "server": self.server,
+            "requests": self.requests,
+            "errors": self.errors,
+            "avg_ms": round(self.total_time / self.requests * 1000, 1) if self.requests else None,
+        }
+
+
+async def _read_http_response(reader: asyncio.StreamReader) -> bytes:
+    """Read an HTTP/1.1 response body (Content-Length, chunked or until close)"""
+    while True:
+        status_line = (await reader.readline()).decode("latin-1").strip()
+        if not status_line:
+            raise IppError("Connection closed before a response")
+        parts = status_line.split(None, 2)
+        status = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else 0
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode("latin-1").strip()
+            if not line:
+                break
+            key, _, value = line.partition(":")
+            headers[key.strip().lower()] = value.strip()
+        if 100 <= status < 200:
+            continue  # interim response, e.g. 100 Continue
+        break
+
+    if headers.get("transfer-encoding", "").lower() == "chunked":
+        body = bytearray()
+        while True:
+            size = int((await reader.readline()).split(b";")[0].strip() or b"0", 16)
+            if size == 0:
+                await reader.readline()
+                break
+            body += await reader.readexactly(size)
+            await reader.readline()
+        body = bytes(body)
+    elif "content-length" in headers:
+        body = await reader.readexactly(int(headers["content-length"]))
+    else:
+        body = await reader.read()
+
+    if status != 200:
+        raise IppError(f"HTTP {status} from CUPS", status)
+    return body
+
+
+def split_job_id(lp_job_id: str) -> int:
+    """"HpQueue-12" -> 12"""
+    return int(str(lp_job_id).rsplit("-", 1)[-1])
+
+
+def job_status_line(job: dict) -> str:
+    """One-line job status in the spirit of lpstat, used by the job tracker"""
+    reasons = ", ".join(str(reason) for reason in as_list(job.get("job-state-reasons")))
+    state = JOB_STATES.get(job.get("job-state"), job.get("job-state"))
+    message = job.get("job-state-message") or ""
+    return f"{state} {reasons} {message}".strip()
+
+
+# Global instance
+ipp_client = IppClient()
@@ -0,0 +1,315 @@
+"""
+Pure-Python stand-in for the CUPS IPP endpoint, for developing and
+exercising the IPP client without a CUPS install:
+
+    python -m app.ipp_standin --listen 127.0.0.1:8631 --printers HpQueue,Office
+    CUPS_SERVER=127.0.0.1:8631 uvicorn app.main:app
+
+It implements the operations the kiosk uses (Print-Job, Get-Jobs,
+Get-Job-Attributes, Cancel-Job, Enable-Printer, Get-Printer-Attributes,
+CUPS-Get-Default, CUPS-Get-Printers). Jobs go pending -> processing ->
+completed on a timer; abort_job() and stop_printer() simulate faults.
+Like cupsd, requests to /admin/ without an Authorization header get 401.
+"""
+import argparse
+import asyncio
+import itertools
+import time
+from app.ipp import (
+    encode_message, decode_message, IppError, OPERATION_ATTRIBUTES, JOB_ATTRIBUTES, PRINTER_ATTRIBUTES,
+    PRINT_JOB, CANCEL_JOB, GET_JOB_ATTRIBUTES, GET_JOBS, GET_PRINTER_ATTRIBUTES, ENABLE_PRINTER,
+    CUPS_GET_DEFAULT, CUPS_GET_PRINTERS, INTEGER, BOOLEAN, ENUM, TEXT, NAME, KEYWORD, URI, CHARSET,
+    NATURAL_LANGUAGE,
+)
+
+OK = 0x0000
+BAD_REQUEST = 0x0400
+NOT_FOUND = 0x0406
+NOT_POSSIBLE = 0x0404
+NOT_ACCEPTING = 0x0506
+OPERATION_NOT_SUPPORTED = 0x0501
+
+PENDING, PROCESSING, CANCELED, ABORTED, COMPLETED = 3, 5, 7, 8, 9
+
+
+class StandinError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class StandinJob:
+    def __init__(self, job_id: int, printer: str, name: str, user: str, size: int, options: dict):
+        self.id = job_id
+        self.printer = printer
+        self.name = name
+        self.user = user
+        self.size = size
+        self.options = options
+        self.state = PENDING
+        self.reasons = ["none"]
+        self.message = ""
+        self.created = time.time()
+
+    def attributes(self) -> list:
+        return [
+            (INTEGER, "job-id", self.id),
+            (URI, "job-uri", f"ipp://localhost/jobs/{self.id}"),
+            (URI, "job-printer-uri", f"ipp://localhost/printers/{self.printer}"),
+            (NAME, "job-name", self.name),
+            (NAME, "job-originating-user-name", self.user),
+            (ENUM, "job-state", self.state),
+            (KEYWORD, "job-state-reasons", list(self.reasons)),
+            (TEXT, "job-state-message", self.message),
+            (INTEGER, "job-k-octets", max(self.size // 1024, 1)),
+        ]
+
+
+class StandinPrinter:
+    def __init__(self, name: str):
+        self.name = name
+        self.state = 3  # idle
+        self.accepting = True
+        self.message = ""
+
+    def attributes(self) -> list:
+        return [
+            (NAME, "printer-name", self.name),
+            (URI, "printer-uri-supported", f"ipp://localhost/printers/{self.name}"),
+            (ENUM, "printer-state", self.state),
+            (TEXT, "printer-state-message", self.message),
+            (KEYWORD, "printer-state-reasons", "paused" if self.state == 5 else "none"),
+            (BOOLEAN, "printer-is-accepting-jobs", self.accepting),
+        ]
+
+
+class IppStandin:
+    def __init__(self, printers=("Kiosk",), print_seconds: float = 3.0):
+        self.printers = {name: StandinPrinter(name) for name in printers}
+        self.default = next(iter(self.printers), None)
+        self.print_seconds = print_seconds
+        self.jobs = {}
+        self._ids = itertools.count(1)
+        self._timers = set()
+        self.requests = []  # (operation, attributes) of every request, for inspection
+        self.unauthorized = 0
+
+    # Fault injection
+
+    def abort_job(self, job_id: int, reason: str = "job-aborted-by-system"):
+        job = self.jobs[job_id]
+        job.state = ABORTED
+        job.reasons = [reason]
+
+    def stop_printer(self, name: str, message: str = "Paused"):
+        printer = self.printers[name]
+        printer.state = 5
+        printer.message = message
+
+    # Server
+
+    async def start(self, listen: str):
+        """Listen on a unix socket path or host:port"""
+        if listen.startswith("/"):
+            return await asyncio.start_unix_server(self._serve, listen)
+        host, _, port = listen.rpartition(":")
+        return await asyncio.start_server(self._serve, host or "127.0.0.1", int(port))
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request = await _read_http_request(reader)
+                if request is None:
+                    break
+                path, headers, body = request
+                if path.startswith("/admin") and "authorization" not in headers:
+                    self.unauthorized += 1
+                    writer.write(b"HTTP/1.1 401 Unauthorized\r\nWWW-Authenticate: PeerCred\r\n"
+                                 b"Content-Length: 0\r\n\r\n")
+                else:
+                    writer.write(self.respond(body))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    def respond(self, body: bytes) -> bytes:
+        """Handle one IPP request and return the full HTTP response"""
+        operation = [(CHARSET, "attributes-charset", "utf-8"), (NATURAL_LANGUAGE, "attributes-natural-language", "en")]
+        request_id = 0
+        try:
+            request = decode_message(body)
+            request_id = request.request_id
+            status, groups = OK, self.handle(request)
+        except (IppError, StandinError) as e:
+            status, groups = getattr(e, "status", None) or BAD_REQUEST, []
+            operation.append((TEXT, "status-message", str(e)))
+        payload = encode_message(status, request_id, [(OPERATION_ATTRIBUTES, operation)] + groups)
+        head = (f"HTTP/1.1 200 OK\r\nContent-Type: application/ipp\r\n"
+                f"Content-Length: {len(payload)}\r\n\r\n").encode("ascii")
+        return head + payload
+
+    def handle(self, request):
+        operation = request.group(OPERATION_ATTRIBUTES)
+        self.requests.append((request.code, operation))
+        handler = {
+            PRINT_JOB: self._print_job,
+            CANCEL_JOB: self._cancel_job,
+            GET_JOB_ATTRIBUTES: self._get_job_attributes,
+            GET_JOBS: self._get_jobs,
+            GET_PRINTER_ATTRIBUTES: self._get_printer_attributes,
+            ENABLE_PRINTER: self._enable_printer,
+            CUPS_GET_DEFAULT: self._get_default,
+            CUPS_GET_PRINTERS: self._get_printers,
+        }.get(request.code)
+        if handler is None:
+            raise StandinError(OPERATION_NOT_SUPPORTED, "operation not supported")
+        return handler(request, operation)
+
+    def _printer(self, operation):
+        uri = str(operation.get("printer-uri") or "")
+        return self.printers.get(uri.rstrip("/").rsplit("/", 1)[-1])
+
+    def _job(self, operation):
+        uri = str(operation.get("job-uri") or "")
+        job_id = operation.get("job-id") or uri.rstrip("/").rsplit("/", 1)[-1]
+        try:
+            return self.jobs.get(int(job_id))
+        except ValueError:
+            return None
+
+    def _print_job(self, request, operation):
+        printer = self._printer(operation)
+        if printer is None:
+            raise StandinError(NOT_FOUND, "printer not found")
+        if not printer.accepting:
+            raise StandinError(NOT_ACCEPTING, "printer not accepting jobs")
+        job = StandinJob(next(self._ids), printer.name, operation.get("job-name") or "untitled",
+                         operation.get("requesting-user-name") or "anonymous", len(request.data),
+                         request.group(JOB_ATTRIBUTES))
+        self.jobs[job.id] = job
+        self._schedule(job)
+        return [(JOB_ATTRIBUTES, job.attributes())]
+
+    def _schedule(self, job: StandinJob):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        task = loop.create_task(self._run_job(job))
+        self._timers.add(task)
+        task.add_done_callback(self._timers.discard)
+
+    async def _run_job(self, job: StandinJob):
+        while self.printers[job.printer].state == 5 or any(
+                other.state == PROCESSING and other.printer == job.printer for other in self.jobs.values()):
+            await asyncio.sleep(0.1)
+            if job.state != PENDING:
+                return
+        if job.state != PENDING:
+            return
+        job.state = PROCESSING
+        job.reasons = ["job-printing"]
+        self.printers[job.printer].state = 4
+        await asyncio.sleep(self.print_seconds)
+        if job.state == PROCESSING:
+            job.state = COMPLETED
+            job.reasons = ["job-completed-successfully"]
+        if self.printers[job.printer].state == 4:
+            self.printers[job.printer].state = 3
+
+    def _cancel_job(self, request, operation):
+        job = self._job(operation)
+        if job is None:
+            raise StandinError(NOT_FOUND, "job not found")
+        if job.state >= CANCELED:
+            raise StandinError(NOT_POSSIBLE, "job already finished")
+        job.state = CANCELED
+        job.reasons = ["job-canceled-by-user"]
+        return []
+
+    def _get_job_attributes(self, request, operation):
+        job = self._job(operation)
+        if job is None:
+            raise StandinError(NOT_FOUND, "job not found")
+        return [(JOB_ATTRIBUTES, job.attributes())]
+
+    def _get_jobs(self, request, operation):
+        which = operation.get("which-jobs") or "not-completed"
+        jobs = [job for job in self.jobs.values()
+                if which == "all" or (job.state >= CANCELED) == (which == "completed")]
+        printer = self._printer(operation)
+        if printer is not None:
+            jobs = [job for job in jobs if job.printer == printer.name]
+        return [(JOB_ATTRIBUTES, job.attributes()) for job in jobs]
+
+    def _get_printer_attributes(self, request, operation):
+        printer = self._printer(operation)
+        if printer is None:
+            raise StandinError(NOT_FOUND, "printer not found")
+        return [(PRINTER_ATTRIBUTES, printer.attributes())]
+
+    def _enable_printer(self, request, operation):
+        printer = self._printer(operation)
+        if printer is None:
+            raise StandinError(NOT_FOUND, "printer not found")
+        printer.state = 3
+        printer.accepting = True
+        printer.message = ""
+        return []
+
+    def _get_default(self, request, operation):
+        if self.default is None:
+            raise StandinError(NOT_FOUND, "no default printer")
+        return [(PRINTER_ATTRIBUTES, self.printers[self.default].attributes())]
+
+    def _get_printers(self, request, operation):
+        return [(PRINTER_ATTRIBUTES, printer.attributes()) for printer in self.printers.values()]
+
+
+async def _read_http_request(reader: asyncio.StreamReader):
+    """(path, headers, body) of the next HTTP POST on the connection, or None at EOF"""
+    request_line = await reader.readline()
+    if not request_line.strip():
+        return None
+    parts = request_line.decode("latin-1").split()
+    path = parts[1] if len(parts) > 1 else "/"
+    headers = {}
+    while True:
+        line = (await reader.readline()).decode("latin-1").strip()
+        if not line:
+            break
+        key, _, value = line.partition(":")
+        headers[key.strip().lower()] = value.strip()
+    if headers.get("transfer-encoding", "").lower() == "chunked":
+        body = bytearray()
+        while True:
+            size = int((await reader.readline()).split(b";")[0].strip() or b"0", 16)
+            if size == 0:
+                await reader.readline()
+                return path, headers, bytes(body)
+            body += await reader.readexactly(size)
+            await reader.readline()
+    return path, headers, await reader.readexactly(int(headers.get("content-length", "0")))
+
+
+async def _main(listen: str, printers: list, print_seconds: float):
+    standin = IppStandin(printers, print_seconds)
+    server = await standin.start(listen)
+    print(f"IPP stand-in listening on {listen} with printers: {', '.join(printers)}")
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stand-in IPP server emulating the local CUPS scheduler")
+    parser.add_argument("--listen", default="127.0.0.1:8631", help="host:port or unix socket path")
+    parser.add_argument("--printers", default="Kiosk", help="comma separated queue names")
+    parser.add_argument("--print-seconds", type=float, default=3.0, help="time each job spends printing")
+    args = parser.parse_args()
+    try:
+        asyncio.run(_main(args.listen, [p.strip() for p in args.printers.split(",") if p.strip()],
+                          args.print_seconds))
+    except KeyboardInterrupt:
+        pass
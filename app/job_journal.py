@@ -0,0 +1,161 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from app.logger import app_logger, event_logger
+from app.job_tracker import job_tracker, TrackedJob, JobEvent
+from app.file_cache import file_cache
+
+JOB_JOURNAL_DB = os.getenv("JOB_JOURNAL_DB", "/home/vinay/backend/job_journal.db")
+# A resumed job gets at least this long before the tracker times it out
+RESUME_MIN_TIMEOUT = 60
+
+
+class JobJournal:
+    """
+    Durable record of the CUPS jobs the tracker is watching, so a restart
+    can re-attach to them instead of cancelling everything. A row is
+    written when tracking starts and deleted once the outcome has been
+    handed to the listeners (notification sent or queued).
+    """
+
+    def __init__(self, path: str = JOB_JOURNAL_DB):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = None
+        self.resumed = 0
+        self.orphans_cancelled = 0
+        try:
+            self._open()
+        except Exception as e:
+            app_logger.error(f"Failed to open job journal, restarts will not resume jobs: {e}")
+
+    def _open(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        # NORMAL is crash-safe under WAL; a power cut may only lose the last commits
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute(
+            """CREATE TABLE IF NOT EXISTS jobs (
+                lp_job_id TEXT PRIMARY KEY,
+                code TEXT,
+                server_job_id TEXT,
+                local_id TEXT,
+                printer TEXT,
+                file_path TEXT,
+                stage TEXT NOT NULL,
+                print_options TEXT,
+                estimate TEXT,
+                deadline_at REAL NOT NULL,
+                submitted_at REAL NOT NULL
+            )"""
+        )
+        self._db = db
+
+    def record(self, job: TrackedJob, stage: str = "printing"):
+        if self._db is None:
+            return
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                """INSERT OR REPLACE INTO jobs (lp_job_id, code, server_job_id, local_id, printer, file_path,
+                                                stage, print_options, estimate, deadline_at, submitted_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                (job.lp_job_id, job.code, job.server_job_id, job.local_id, job.printer, job.file_path, stage,
+                 json.dumps(job.print_options), json.dumps(job.estimate),
+                 now + job.timeout - job.elapsed(), now - job.elapsed())
+            )
+
+    def set_stage(self, lp_job_id: str, stage: str):
+        if self._db is None:
+            return
+        with self._lock:
+            self._db.execute("UPDATE jobs SET stage = ? WHERE lp_job_id = ?", (stage, lp_job_id))
+
+    def remove(self, lp_job_id: str):
+        if self._db is None:
+            return
+        with self._lock:
+            self._db.execute("DELETE FROM jobs WHERE lp_job_id = ?", (lp_job_id,))
+
+    def entries(self) -> list:
+        if self._db is None:
+            return []
+        with self._lock:
+            rows = self._db.execute(
+                """SELECT lp_job_id, code, server_job_id, local_id, printer, file_path, stage,
+                          print_options, estimate, deadline_at FROM jobs ORDER BY submitted_at"""
+            ).fetchall()
+        return [
+            {"lp_job_id": row[0], "code": row[1], "server_job_id": row[2], "local_id": row[3],
+             "printer": row[4], "file_path": row[5], "stage": row[6],
+             "print_options": json.loads(row[7]) if row[7] else None,
+             "estimate": json.loads(row[8]) if row[8] else None, "deadline_at": row[9]}
+            for row in rows
+        ]
+
+    def count(self) -> int:
+        if self._db is None:
+            return 0
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+
+    def stats(self) -> dict:
+        return {
+            "open": self._db is not None,
+            "entries": self.count(),
+            "resumed": self.resumed,
+            "orphans_cancelled": self.orphans_cancelled,
+        }
+
+
+# Global instance
+job_journal = JobJournal()
+job_tracker.set_journal(job_journal)
+
+
+async def resume_jobs() -> dict:
+    """
+    Re-attach the tracker to journaled jobs after a restart and cancel
+    CUPS jobs nobody accounts for. Jobs that finished while the service
+    was down are reported by the tracker's first poll as usual; jobs whose
+    outcome was known but not yet reported are reported straight away.
+    """
+    entries = await asyncio.to_thread(job_journal.entries)
+    try:
+        active = await job_tracker.source.active_jobs()
+    except Exception as e:
+        app_logger.error(f"Could not list CUPS jobs on startup, leaving them alone: {e}")
+        active = None
+
+    now = time.time()
+    known = set()
+    for entry in entries:
+        known.add(entry["lp_job_id"])
+        # Pinned like a fresh print (the outcome's listener releases it), so a
+        # failover resubmit still finds the spool file
+        file_cache.pin(entry["file_path"])
+        job = TrackedJob(entry["lp_job_id"], entry["code"], entry["server_job_id"], entry["printer"],
+                         entry["file_path"], timeout=max(entry["deadline_at"] - now, RESUME_MIN_TIMEOUT),
+                         local_id=entry["local_id"], print_options=entry["print_options"],
+                         estimate=entry["estimate"])
+        if entry["stage"] in (JobEvent.COMPLETED, JobEvent.FAILED):
+            event_logger.info(f"Reporting {entry['stage']} print job {job.lp_job_id} interrupted by restart")
+            job_tracker.dispatch(job, entry["stage"], "Print error" if entry["stage"] == JobEvent.FAILED else "")
+            continue
+        job_tracker.track(job)
+        event_logger.info(f"Resumed tracking of print job {job.lp_job_id} ({entry['stage']}, code: {job.code})")
+
+    orphans = [lp_job_id for lp_job_id in (active or {}) if lp_job_id not in known]
+    for lp_job_id in orphans:
+        event_logger.warning(f"Cancelling orphaned CUPS job {lp_job_id}")
+        try:
+            await job_tracker.source.cancel(lp_job_id)
+        except Exception as e:
+            app_logger.warning(f"Failed to cancel orphaned job {lp_job_id}: {e}")
+    job_journal.resumed += len(entries)
+    job_journal.orphans_cancelled += len(orphans)
+    return {"resumed": len(entries), "orphans_cancelled": len(orphans)}
@@ -0,0 +1,327 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from app.logger import app_logger, event_logger
+from app.ipp import ipp_client, CUPS_IPP, JOB_STATES, job_status_line, split_job_id
+
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "2"))
+JOB_TIMEOUT = float(os.getenv("JOB_TIMEOUT", "300"))  # 5 minutes
+
+
+class TrackedJob:
+    def __init__(self, lp_job_id: str, code: str, server_job_id: str, printer: str, file_path: str,
+                 timeout: float = JOB_TIMEOUT, local_id: str = None, print_options: dict = None,
+                 estimate: dict = None):
+        self.lp_job_id = lp_job_id
+        self.local_id = local_id
+        self.code = code
+        self.server_job_id = server_job_id
+        self.printer = printer
+        self.file_path = file_path
+        self.print_options = print_options
+        self.estimate = estimate
+        self.tried = {printer}
+        self.timeout = timeout
+        self.started = time.monotonic()
+        self.last_state = None
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+
+class JobEvent:
+    COMPLETED = "completed"
+    FAILED = "failed"
+
+    def __init__(self, job: TrackedJob, kind: str, message: str = ""):
+        self.job = job
+        self.kind = kind
+        self.message = message
+
+
+class LpstatSource:
+    """Reads the state of every active CUPS job with a single lpstat call"""
+
+    async def active_jobs(self) -> dict:
+        """Return {lp_job_id: status text} for all not-completed jobs"""
+        proc = await asyncio.create_subprocess_exec(
+            "lpstat", "-l", "-o",
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        try:
+            stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout=5)
+        except asyncio.TimeoutError:
+            proc.kill()
+            raise
+        if proc.returncode != 0:
+            raise RuntimeError(f"lpstat failed: {stderr.decode(errors='replace').strip()}")
+        return parse_lpstat_jobs(stdout.decode(errors="replace"))
+
+    async def printer_present(self) -> bool:
+        from app.health import printer_connected
+        return printer_connected()
+
+    async def cancel(self, lp_job_id: str):
+        proc = await asyncio.create_subprocess_exec(
+            "cancel", lp_job_id,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.DEVNULL
+        )
+        await asyncio.wait_for(proc.wait(), timeout=5)
+
+
+class IppSource:
+    """Reads job states from CUPS over IPP, without forking lpstat"""
+
+    async def active_jobs(self) -> dict:
+        """Return {lp_job_id: status text} for all not-completed jobs"""
+        jobs = {}
+        for job in await ipp_client.get_jobs():
+            printer = str(job.get("job-printer-uri") or "").rstrip("/").rsplit("/", 1)[-1]
+            jobs[f"{printer}-{job.get('job-id')}"] = job_status_line(job)
+        return jobs
+
+    async def final_state(self, lp_job_id: str):
+        """State name of a job that left the queue (completed, canceled, aborted)"""
+        job = await ipp_client.get_job_attributes(split_job_id(lp_job_id))
+        return JOB_STATES.get(job.get("job-state"))
+
+    async def printer_present(self) -> bool:
+        from app.health import printer_connected
+        return printer_connected()
+
+    async def cancel(self, lp_job_id: str):
+        await ipp_client.cancel_job(split_job_id(lp_job_id))
+
+
+def parse_lpstat_jobs(output: str) -> dict:
+    """
+    Parse `lpstat -l -o` output. Job lines start at column 0
+    ("HpQueue-12  root  1024  Fri 06 Mar ..."), detail lines are indented.
+    """
+    jobs = {}
+    current = None
+    for line in output.splitlines():
+        if not line.strip():
+            continue
+        if not line[0].isspace():
+            current = line.split()[0]
+            jobs[current] = line
+        elif current:
+            jobs[current] += "\n" + line
+    return jobs
+
+
+class JobTracker:
+    """
+    Watches every in-flight CUPS job from one task on the app's event loop.
+
+    Each tick makes a single batched query to the job source and turns job
+    transitions into JobEvents for the registered listeners. The source is
+    anything with async active_jobs(), printer_present() and cancel(), so a
+    fake CUPS can drive the tracker in tests. Sources that also offer
+    final_state() let a job that was aborted or cancelled outside the
+    kiosk be reported as failed rather than completed.
+    """
+
+    def __init__(self, source=None, poll_interval: float = JOB_POLL_INTERVAL):
+        self.source = source or (IppSource() if CUPS_IPP else LpstatSource())
+        self.poll_interval = poll_interval
+        self.jobs = {}
+        self._listeners = []
+        self._failover = None
+        self._journal = None
+        self._journal_writer = None
+        self._on_busy = None
+        self._reporting = set()
+        self._loop = None
+        self._wakeup = None
+
+    def add_listener(self, callback):
+        """Register an async callback(event: JobEvent)"""
+        self._listeners.append(callback)
+
+    def set_failover(self, handler):
+        """
+        Register async handler(job, message) -> TrackedJob | None, asked
+        before a failure is reported. A returned job (resubmitted on
+        another printer) replaces the failed one and no event is emitted.
+        """
+        self._failover = handler
+
+    def set_busy_callback(self, callback):
+        """Register callback() run when the tracker goes from no jobs to watching one"""
+        self._on_busy = callback
+
+    def set_journal(self, journal):
+        """
+        Register a journal with record(job, stage), set_stage(lp_job_id,
+        stage) and remove(lp_job_id) so tracked jobs survive a restart.
+        Writes go through one writer thread, in order, off the event loop.
+        """
+        self._journal = journal
+        if self._journal_writer is None:
+            self._journal_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="job-journal")
+
+    def start(self, loop: asyncio.AbstractEventLoop = None):
+        """Bind the tracker to the app's event loop; run() does the watching"""
+        self._loop = loop or asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+
+    def track(self, job: TrackedJob):
+        """Start watching a submitted job. Safe to call from any thread."""
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            self._add(job)
+        else:
+            self._loop.call_soon_threadsafe(self._add, job)
+
+    def active_count(self) -> int:
+        return len(self.jobs)
+
+    def _add(self, job: TrackedJob):
+        was_idle = not self.jobs
+        self.jobs[job.lp_job_id] = job
+        event_logger.info(f"Tracking print job {job.lp_job_id} (code: {job.code})")
+        self._journal_call("record", job)
+        self._wakeup.set()
+        if was_idle and self._on_busy is not None:
+            try:
+                self._on_busy()
+            except Exception:
+                app_logger.exception("Job tracker busy callback failed")
+
+    def _journal_call(self, method: str, *args):
+        if self._journal is None:
+            return
+        future = self._journal_writer.submit(getattr(self._journal, method), *args)
+        future.add_done_callback(lambda f: self._journal_done(method, f))
+
+    def _journal_done(self, method: str, future):
+        error = future.exception()
+        if error is not None:
+            app_logger.error(f"Job journal {method} failed: {error}")
+
+    async def run(self):
+        """Watch loop, run as a supervised task on the bound loop"""
+        while True:
+            if not self.jobs:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+            try:
+                await self.poll_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                app_logger.error(f"Job tracker poll failed: {e}")
+            await asyncio.sleep(self.poll_interval)
+
+    async def poll_once(self):
+        """Query the source once and emit events for finished jobs"""
+        if not self.jobs:
+            return
+        try:
+            active = await self.source.active_jobs()
+        except asyncio.TimeoutError:
+            app_logger.error("Job state query timed out")
+            active = None
+        except Exception as e:
+            # CUPS down or restarting; deadlines below must still fire
+            app_logger.error(f"Job state query failed: {e}")
+            active = None
+
+        for lp_job_id, job in list(self.jobs.items()):
+            if job.elapsed() > job.timeout:
+                event_logger.error(f"Print job {lp_job_id} timed out")
+                await self._cancel(lp_job_id)
+                await self._finish(job, JobEvent.FAILED, "Print Timed Out")
+                continue
+
+            if active is None:
+                continue
+
+            state = active.get(lp_job_id)
+            if state is None:
+                # Job left the queue - completed unless it was aborted or the printer went away
+                final = await self._final_state(lp_job_id)
+                if final in ("aborted", "canceled"):
+                    event_logger.error(f"Print job {lp_job_id} {final} by CUPS")
+                    await self._finish(job, JobEvent.FAILED, "Print error")
+                elif await self.source.printer_present():
+                    event_logger.info(f"Print job {lp_job_id} completed")
+                    await self._finish(job, JobEvent.COMPLETED)
+                else:
+                    event_logger.info(f"Cups print job {lp_job_id} completed but printer connection interrupted")
+                    await self._finish(job, JobEvent.FAILED,
+                                       "Cups print job completed but printer connection interuppted")
+                continue
+
+            job.last_state = state
+            lowered = state.lower()
+            if "error" in lowered or "aborted" in lowered:
+                event_logger.error(f"Print job {lp_job_id} error: {state}")
+                await self._cancel(lp_job_id)
+                await self._finish(job, JobEvent.FAILED, "Print error")
+
+    async def _final_state(self, lp_job_id: str):
+        final_state = getattr(self.source, "final_state", None)
+        if final_state is None:
+            return None
+        try:
+            return await final_state(lp_job_id)
+        except Exception as e:
+            app_logger.warning(f"Could not read final state of job {lp_job_id}: {e}")
+            return None
+
+    async def _cancel(self, lp_job_id: str):
+        try:
+            await self.source.cancel(lp_job_id)
+        except Exception as e:
+            app_logger.warning(f"Failed to cancel job {lp_job_id}: {e}")
+
+    async def _finish(self, job: TrackedJob, kind: str, message: str = ""):
+        self.jobs.pop(job.lp_job_id, None)
+        if kind == JobEvent.FAILED and self._failover is not None:
+            try:
+                replacement = await self._failover(job, message)
+            except Exception:
+                app_logger.exception(f"Failover failed for {job.lp_job_id}")
+                replacement = None
+            if replacement is not None:
+                event_logger.info(f"Print job {job.lp_job_id} moved to {replacement.printer} as {replacement.lp_job_id}")
+                self._add(replacement)
+                self._journal_call("remove", job.lp_job_id)
+                return
+        self.dispatch(job, kind, message)
+
+    def dispatch(self, job: TrackedJob, kind: str, message: str = ""):
+        """
+        Report an outcome in the background, so the poll loop keeps its
+        cadence and outcomes of one poll reach the status reporter together
+        """
+        # Kept in the journal until the listeners have reported the outcome
+        self._journal_call("set_stage", job.lp_job_id, kind)
+        task = asyncio.get_running_loop().create_task(self.report(job, kind, message))
+        self._reporting.add(task)
+        task.add_done_callback(self._reporting.discard)
+
+    async def report(self, job: TrackedJob, kind: str, message: str = ""):
+        """Hand an outcome to all listeners concurrently, bypassing failover"""
+        event = JobEvent(job, kind, message)
+        await asyncio.gather(*(self._notify(callback, event) for callback in self._listeners))
+        self._journal_call("remove", job.lp_job_id)
+
+    async def _notify(self, callback, event: JobEvent):
+        try:
+            await callback(event)
+        except Exception:
+            app_logger.exception(f"Job event listener failed for {event.job.lp_job_id}")
+
+
+# Global instance
+job_tracker = JobTracker()
@@ -1,4 +1,3 @@
-import threading
 import asyncio
 import subprocess
 from fastapi import FastAPI, WebSocket, Request, WebSocketDisconnect
@@ -6,14 +5,31 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 from app.ws import ws_manager
 from app.models import PrintRequest
-from app.server_api import fetch_print_job, InvalidCode, UpstreamFailure, SERVER_URL
-from app.printer import print_document, PrinterUnavailable
-from app.health import system_healthy
-from app.health_watcher import start_health_watcher
+from app.health_snapshot import health_snapshot
+from app.probes import probe_scheduler
+from app import health as _health_probes  # noqa: F401  registers the health probes
+from app.health_watcher import run_health_watcher, wake_health_watcher
 from app.logger import app_logger, event_logger
 from app.diagnostics import run_diagnostics
-from app.heartbeat import start_heartbeat
-from app.recovery_poller import start_recovery_polling, is_in_recovery_mode
+from app.heartbeat import heartbeat_tick, HEARTBEAT_INTERVAL
+from app.http_client import close_client, client_stats
+from app.connectivity import dns_cache
+from app.job_tracker import job_tracker
+from app.job_journal import job_journal, resume_jobs
+from app.ipp import ipp_client, IppError, CUPS_IPP
+from app.usb_presence import printer_presence
+from app.printer_registry import printer_registry, PrinterNotFound
+from app.print_jobs import print_jobs, start_print_job
+from app.supervisor import supervisor
+from app.notification_queue import notification_queue, QUEUE_COMPACT_INTERVAL
+from app.status_reporter import status_reporter
+from app.circuit_breaker import upstream_breaker
+from app.code_cache import invalid_codes
+from app.file_cache import file_cache
+from app.prefetch import prefetcher, PREFETCH_ENABLED, PREFETCH_EXPIRY_INTERVAL
+from app.print_scheduler import print_scheduler
+from app.printer_pool import printer_pool, PRINTER_POOL_REFRESH
+from app.preflight import print_time_model, shutdown_preflight
 
 app = FastAPI()
 
@@ -25,43 +41,30 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-def cleanup_printer_on_startup():
+async def cleanup_printer_on_startup():
     """
-    Clear all print jobs and enable printer on startup.
-    Prevents stuck jobs from previous sessions.
+    Enable every printer of the pool on startup. Jobs left over from the
+    previous session are resumed or cancelled by resume_jobs().
     """
     try:
-        # Cancel all print jobs
-        event_logger.info("Canceling all pending print jobs...")
-        result = subprocess.run(
-            ["cancel", "-a"],
-            capture_output=True,
-            text=True,
-            timeout=10
-        )
-        
-        if result.returncode == 0:
-            event_logger.info("✅ All print jobs cancelled")
-        else:
-            event_logger.warning(f"Cancel jobs returned code {result.returncode}: {result.stderr}")
-        
-        # Get printer name
-        lpstat_result = subprocess.run(
-            ["/usr/bin/lpstat", "-p"],
-            capture_output=True,
-            text=True,
-            timeout=5
-        )
+        # Get every printer of the pool
+        try:
+            printer_names = await printer_registry.resolve_printers()
+        except PrinterNotFound:
+            printer_names = []
         
-        if lpstat_result.returncode == 0 and lpstat_result.stdout:
-            # Extract printer name from first line
-            # Output: "printer HP_LaserJet_Pro is idle..."
-            first_line = lpstat_result.stdout.split("\n")[0]
-            printer_name = "HpQueue" #first_line.split()[1]
-            
+        for printer_name in printer_names:
             # Enable the printer
             event_logger.info(f"Enabling printer: {printer_name}")
-            enable_result = subprocess.run(
+            if CUPS_IPP:
+                try:
+                    await ipp_client.enable_printer(printer_name)
+                    event_logger.info(f"✅ Printer {printer_name} enabled")
+                    continue
+                except (IppError, OSError) as e:
+                    event_logger.warning(f"Enable-Printer failed for {printer_name}, using cupsenable: {e}")
+            enable_result = await asyncio.to_thread(
+                subprocess.run,
                 ["cupsenable", printer_name],
                 capture_output=True,
                 text=True,
@@ -72,10 +75,10 @@ def cleanup_printer_on_startup():
                 event_logger.info(f"✅ Printer {printer_name} enabled")
             else:
                 event_logger.warning(f"cupsenable returned code {enable_result.returncode}: {enable_result.stderr}")
-        else:
+        if not printer_names:
             event_logger.warning("No printer found to enable")
             
-    except subprocess.TimeoutExpired:
+    except (subprocess.TimeoutExpired, asyncio.TimeoutError):
         event_logger.error("Timeout during printer cleanup")
     except Exception as e:
         event_logger.error(f"Error during printer cleanup: {e}", exc_info=True)
@@ -97,13 +100,54 @@ async def global_exception_handler(request: Request, exc: Exception):
         }
     )
 
+def on_printer_presence(connected: bool):
+    """Re-probe the printer now. The polling fallback calls this from a worker thread."""
+    loop = supervisor.loop
+    if loop is None:
+        return
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is loop:
+        probe_scheduler.wake("printer")
+    else:
+        loop.call_soon_threadsafe(probe_scheduler.wake, "printer")
+
 @app.on_event("startup")
-def startup():
-    cleanup_printer_on_startup()
-    '''async def startup_event():
-        asyncio.create_task(start_health_watcher)'''
-    threading.Thread(target=start_health_watcher, daemon=True).start()
-    threading.Thread(target=start_heartbeat, daemon=True).start()
+async def startup():
+    await cleanup_printer_on_startup()
+    supervisor.start()
+    await printer_pool.refresh_async()
+    print_scheduler.set_pool_size(len(printer_pool.names()))
+    supervisor.every("printer_pool", print_scheduler.refresh_pool,
+                     interval=PRINTER_POOL_REFRESH, initial_delay=PRINTER_POOL_REFRESH)
+    job_tracker.start()
+    await resume_jobs()
+    supervisor.spawn("job_tracker", job_tracker.run)
+    printer_presence.add_listener(on_printer_presence)
+    printer_presence.start()
+    probe_scheduler.set_busy_check(lambda: job_tracker.active_count() > 0)
+    job_tracker.set_busy_callback(probe_scheduler.busy_started)
+    probe_scheduler.add_listener(lambda name, ok: wake_health_watcher())
+    supervisor.spawn("probe_scheduler", probe_scheduler.run)
+    supervisor.spawn("health_watcher", run_health_watcher)
+    supervisor.every("heartbeat", heartbeat_tick, interval=HEARTBEAT_INTERVAL)
+    supervisor.spawn("notification_delivery", notification_queue.run)
+    supervisor.every("notification_compaction", notification_queue.compact,
+                     interval=QUEUE_COMPACT_INTERVAL, initial_delay=QUEUE_COMPACT_INTERVAL)
+    if PREFETCH_ENABLED:
+        supervisor.spawn("prefetch_stream", prefetcher.listen)
+        supervisor.spawn("prefetch_downloads", prefetcher.run)
+        supervisor.every("prefetch_expiry", prefetcher.expire, interval=PREFETCH_EXPIRY_INTERVAL)
+
+@app.on_event("shutdown")
+async def shutdown():
+    await supervisor.shutdown()
+    shutdown_preflight()
+    await asyncio.to_thread(file_cache.flush)
+    printer_presence.stop()
+    await close_client()
 
 @app.post("/log/frontend")
 def frontend_log(payload: dict):
@@ -111,105 +155,70 @@ def frontend_log(payload: dict):
     return {"ok": True}
 
 @app.get("/health")
-async def health():
-    return system_healthy()
+async def health(fresh: bool = False, detail: bool = False):
+    # Served from the in-memory snapshot; fresh=1 runs one shared refresh
+    if fresh:
+        await health_snapshot.refresh()
+    if detail:
+        return health_snapshot.to_dict()
+    return health_snapshot.healthy()
 
 @app.get("/owner/health")
-def owner_health():
-    result = run_diagnostics()
+async def owner_health():
+    # Checks run concurrently under one deadline; results are cached briefly
+    return await run_diagnostics()
+
+@app.get("/owner/stats")
+def owner_stats():
     return {
-        "status": "OK" if all(result.values()) else "FAIL",
-        "checks": result
+        "upstream_http": client_stats.snapshot(),
+        "dns_cache": dns_cache.stats(),
+        "tasks": supervisor.stats(),
+        "websockets": ws_manager.stats(),
+        "notifications": notification_queue.stats(),
+        "status_reporter": status_reporter.stats(),
+        "probes": probe_scheduler.stats(),
+        "circuit": upstream_breaker.stats(),
+        "print_dedup": print_jobs.stats(),
+        "invalid_codes": invalid_codes.stats(),
+        "pdf_cache": file_cache.stats(),
+        "prefetch": prefetcher.stats(),
+        "print_queue": print_scheduler.stats(),
+        "printers": printer_pool.stats(),
+        "print_time_model": print_time_model.stats(),
+        "job_journal": job_journal.stats(),
+        "ipp": ipp_client.stats() if CUPS_IPP else None,
     }
 
 @app.post("/print")
 async def start_print(req: PrintRequest):
-    try:
-        # Step 1: Validate & fetch
-        event_logger.info(
-            "Request received to fetch the document with code : %s", req.code)
-        await ws_manager.broadcast({"event": "FETCHING"})
-        job = await fetch_print_job(req.code)
-        print_options = {
-            "color_mode": job["colorMode"],
-            "duplex": job["duplex"],
-            "copies": job["copies"],
-            "orientation": job["orientation"],
-            }
-        # Step 2: Print
-        event_logger.info(
-            "successfull dowloaded the document with code : %s", req.code)
-        await ws_manager.broadcast({"event": "PRINTING"})
-        print_document(job["file_path"], code=req.code, jobId1=job["jobId2"], print_options=print_options)
-        #await ws_manager.broadcast({"event": "DONE"})
-        
+    job, task = start_print_job(req.code)
+    if not req.wait and job.admitted:
         return JSONResponse(
-            status_code=200,
-            content={"status": "DONE"}
-        )
-        
-    except InvalidCode as ex:
-        app_logger.error(
-            f"Code entered is not valid. Resulted in invalid state : {ex}")
-        try:
-            await ws_manager.broadcast({"event": "INVALID_CODE"})
-        except Exception as e:
-            app_logger.error(f"Failed to broadcast INVALID_CODE: {e}")
-        return JSONResponse(
-            status_code=400,
-            content={"status": "INVALID_CODE",
-                    "errorMsg": f"{ex}"
-            }
-        )
-        
-    except UpstreamFailure as e:
-        app_logger.error(
-            f"Error invoked in print job: {e}"
-        )
-        try:
-            await ws_manager.broadcast({"event": "OUT_OF_SERVICE"})
-        except Exception as broadcast_err:
-            app_logger.error(f"Failed to broadcast OUT_OF_SERVICE: {broadcast_err}")
-        
-        # Start recovery polling if not already active
-        if not is_in_recovery_mode():
-            start_recovery_polling(SERVER_URL, interval=300)  # Poll every 10 seconds
-        
-        return JSONResponse(
-            status_code=503,
-            content={"status": "OUT_OF_SERVICE"}
-        )
-    except PrinterUnavailable as e:
-        app_logger.error(
-            f"Error invoked in print job: {e}"
-        )
-        try:
-            await ws_manager.broadcast({"event": "OUT_OF_SERVICE"})
-        except Exception as broadcast_err:
-            app_logger.error(f"Failed to broadcast OUT_OF_SERVICE: {broadcast_err}")
-        return JSONResponse(
-            status_code=503,
-            content={"status": "OUT_OF_SERVICE"}
-        )
-        
-    except Exception as e:
-        app_logger.exception(
-            "Error invoked in user request"
-        )
-        try:
-            await ws_manager.broadcast({"event": "OUT_OF_SERVICE"})
-        except Exception as broadcast_err:
-            app_logger.error(f"Failed to broadcast OUT_OF_SERVICE: {broadcast_err}")
-        
-        # Start recovery polling if not already active
-        if not is_in_recovery_mode():
-            start_recovery_polling(SERVER_URL, interval=300)
-        
-        return JSONResponse(
-            status_code=500,
-            content={"status": "OUT_OF_SERVICE"}
+            status_code=202,
+            content={"status": "ACCEPTED", "position": job.queue_position, "eta": job.eta, "job": job.to_dict()}
         )
 
+    # Shielded so a dropped client connection does not abort the pipeline
+    await asyncio.shield(task)
+    if job.status == "INVALID_CODE":
+        content = {"status": "INVALID_CODE", "errorMsg": job.error}
+    elif job.status == "QUEUE_FULL":
+        content = {"status": "QUEUE_FULL", "errorMsg": job.error}
+    elif job.status == "DONE":
+        content = {"status": "DONE"}
+    else:
+        content = {"status": "OUT_OF_SERVICE"}
+    content["jobId"] = job.id
+    return JSONResponse(status_code=job.http_status or 500, content=content)
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = print_jobs.get(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"status": "NOT_FOUND"})
+    return job.to_dict()
+
 @app.websocket("/ws")
 async def websocket_endpoint(ws: WebSocket):
     """WebSocket endpoint for real-time status updates"""
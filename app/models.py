@@ -2,3 +2,6 @@ from pydantic import BaseModel
 
 class PrintRequest(BaseModel):
     code: str
+    # Queued jobs answer 202 with position/ETA right away; legacy clients
+    # pass wait=true to block until the job has been submitted
+    wait: bool = False
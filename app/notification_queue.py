@@ -1,86 +1,316 @@
 import asyncio
-import httpx
 import json
 import os
+import random
+import sqlite3
+import threading
+import time
+from collections import deque
 from datetime import datetime
 from app.logger import app_logger, event_logger
+from app.status_reporter import status_reporter, STATUS_BATCH_MAX
 
+# Legacy JSON queue, migrated into the journal on first start
 QUEUE_FILE = "/home/vinay/backend/notification_queue.json"
+QUEUE_DB = os.getenv("NOTIFICATION_QUEUE_DB", "/home/vinay/backend/notification_queue.db")
+QUEUE_COMPACT_INTERVAL = 3600
+
+# Delivery engine tuning
+NOTIFY_CONCURRENCY = int(os.getenv("NOTIFY_CONCURRENCY", "4"))
+NOTIFY_BATCH = int(os.getenv("NOTIFY_BATCH", "50"))
+NOTIFY_BACKOFF_BASE = float(os.getenv("NOTIFY_BACKOFF_BASE", "5"))
+NOTIFY_BACKOFF_MAX = float(os.getenv("NOTIFY_BACKOFF_MAX", "900"))
+NOTIFY_MAX_AGE = float(os.getenv("NOTIFY_MAX_AGE", str(7 * 24 * 3600)))
+NOTIFY_IDLE_WAIT = 30
+
+
+def dedup_key_for(payload: dict):
+    """Entries for the same server job replace each other"""
+    job_id = payload.get("job_id")
+    return f"job:{job_id}" if job_id else None
+
+
+class NotificationStore:
+    """
+    Crash-safe notification journal on SQLite in WAL mode. Enqueue and
+    ack are single-row transactions, so nothing is rewritten on each
+    change and a crash mid-write cannot corrupt earlier entries.
+    """
+
+    def __init__(self, path: str = QUEUE_DB):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        # NORMAL is crash-safe under WAL; a power cut may only lose the last commits
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            """CREATE TABLE IF NOT EXISTS notifications (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                url TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                timestamp TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0
+            )"""
+        )
+        self._upgrade_schema()
+
+    def _upgrade_schema(self):
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(notifications)")}
+        if "dedup_key" not in columns:
+            self._db.execute("ALTER TABLE notifications ADD COLUMN dedup_key TEXT")
+        if "next_attempt_at" not in columns:
+            self._db.execute("ALTER TABLE notifications ADD COLUMN next_attempt_at REAL NOT NULL DEFAULT 0")
+        if "revision" not in columns:
+            self._db.execute("ALTER TABLE notifications ADD COLUMN revision INTEGER NOT NULL DEFAULT 0")
+        self._db.execute(
+            "CREATE UNIQUE INDEX IF NOT EXISTS notifications_dedup ON notifications (dedup_key)"
+        )
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS notifications_due ON notifications (next_attempt_at)"
+        )
+
+    def enqueue(self, url: str, payload: dict, timestamp: str = None, attempts: int = 0) -> int:
+        """Insert an entry, replacing any queued entry for the same job"""
+        with self._lock:
+            return self._upsert(url, payload, timestamp, attempts)
+
+    def _upsert(self, url, payload, timestamp, attempts) -> int:
+        dedup_key = dedup_key_for(payload)
+        cur = self._db.execute(
+            """INSERT INTO notifications (url, payload, timestamp, attempts, dedup_key, next_attempt_at)
+               VALUES (?, ?, ?, ?, ?, 0)
+               ON CONFLICT(dedup_key) DO UPDATE SET
+                   url = excluded.url,
+                   payload = excluded.payload,
+                   attempts = 0,
+                   next_attempt_at = 0,
+                   revision = revision + 1""",
+            (url, json.dumps(payload), timestamp or datetime.now().isoformat(), attempts, dedup_key)
+        )
+        if dedup_key is None:
+            return cur.lastrowid
+        return self._db.execute(
+            "SELECT id FROM notifications WHERE dedup_key = ?", (dedup_key,)
+        ).fetchone()[0]
+
+    def settle(self, acks: list, reschedules: list):
+        """
+        Apply the outcome of one delivery pass in a single transaction:
+        acks [(id, revision)], reschedules [(id, revision, attempts, next_attempt_at)]
+        """
+        if not acks and not reschedules:
+            return
+        with self._lock:
+            self._db.execute("BEGIN")
+            try:
+                self._db.executemany("DELETE FROM notifications WHERE id = ? AND revision = ?", acks)
+                self._db.executemany(
+                    "UPDATE notifications SET attempts = ?, next_attempt_at = ? WHERE id = ? AND revision = ?",
+                    [(attempts, next_attempt_at, entry_id, revision)
+                     for entry_id, revision, attempts, next_attempt_at in reschedules]
+                )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def retry_all_now(self):
+        with self._lock:
+            self._db.execute("UPDATE notifications SET next_attempt_at = 0")
+
+    def due(self, now: float, limit: int) -> list:
+        with self._lock:
+            rows = self._db.execute(
+                """SELECT id, url, payload, timestamp, attempts, revision FROM notifications
+                   WHERE next_attempt_at <= ? ORDER BY next_attempt_at, id LIMIT ?""",
+                (now, limit)
+            ).fetchall()
+        return [
+            {"id": row[0], "url": row[1], "payload": json.loads(row[2]), "timestamp": row[3],
+             "attempts": row[4], "revision": row[5]}
+            for row in rows
+        ]
+
+    def next_due_at(self):
+        with self._lock:
+            return self._db.execute("SELECT MIN(next_attempt_at) FROM notifications").fetchone()[0]
+
+    def oldest_timestamp(self):
+        with self._lock:
+            return self._db.execute("SELECT MIN(timestamp) FROM notifications").fetchone()[0]
+
+    def count(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM notifications").fetchone()[0]
+
+    def compact(self):
+        """Fold the WAL back into the database and reclaim free pages"""
+        with self._lock:
+            self._db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            free_pages = self._db.execute("PRAGMA freelist_count").fetchone()[0]
+            if free_pages > 256:
+                self._db.execute("VACUUM")
+
+    def migrate_json(self, json_path: str):
+        """Import a legacy notification_queue.json once and set it aside"""
+        if not os.path.exists(json_path):
+            return
+        try:
+            with open(json_path, 'r') as f:
+                legacy = json.load(f)
+        except Exception as e:
+            app_logger.error(f"Failed to read legacy notification queue: {e}")
+            return
+        with self._lock:
+            self._db.execute("BEGIN")
+            try:
+                for item in legacy:
+                    self._upsert(item["url"], item["payload"], item.get("timestamp"), item.get("attempts", 0))
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        os.replace(json_path, json_path + ".migrated")
+        app_logger.info(f"Migrated {len(legacy)} notifications from {json_path}")
+
+
+def backoff_delay(attempts: int) -> float:
+    """Exponential backoff with full jitter around the nominal delay"""
+    nominal = min(NOTIFY_BACKOFF_BASE * (2 ** max(attempts - 1, 0)), NOTIFY_BACKOFF_MAX)
+    return nominal * random.uniform(0.5, 1.5)
+
 
 class NotificationQueue:
-    def __init__(self):
-        self.queue = []
+    """
+    Durable queue of server status updates plus the background engine
+    that drains it with bounded concurrency and per-entry backoff.
+    """
+
+    def __init__(self, store: NotificationStore = None, concurrency: int = NOTIFY_CONCURRENCY):
+        self.store = store
+        self.concurrency = concurrency
+        self._wake = asyncio.Event()
+        self._delivered = deque()  # delivery times for the drain rate
+        self.sent_total = 0
+        self.failed_total = 0
+        self.dropped_total = 0
         self.load_queue()
-    
+
     def load_queue(self):
-        """Load pending notifications from disk"""
+        """Open the journal, migrating the legacy JSON queue if present"""
         try:
-            if os.path.exists(QUEUE_FILE):
-                with open(QUEUE_FILE, 'r') as f:
-                    self.queue = json.load(f)
-                app_logger.info(f"Loaded {len(self.queue)} pending notifications")
+            if self.store is None:
+                self.store = NotificationStore()
+            self.store.migrate_json(QUEUE_FILE)
+            app_logger.info(f"Loaded {self.store.count()} pending notifications")
         except Exception as e:
             app_logger.error(f"Failed to load notification queue: {e}")
-            self.queue = []
-    
-    def save_queue(self):
-        """Save pending notifications to disk"""
+
+    def __len__(self):
+        return self.store.count() if self.store else 0
+
+    async def add(self, url: str, payload: dict):
+        """Add a notification to the queue; the write runs off the event loop"""
         try:
-            with open(QUEUE_FILE, 'w') as f:
-                json.dump(self.queue, f, indent=2)
+            await asyncio.to_thread(self.store.enqueue, url, payload)
         except Exception as e:
-            app_logger.error(f"Failed to save notification queue: {e}")
-    
-    def add(self, url: str, payload: dict):
-        """Add a notification to the queue"""
-        notification = {
-            "url": url,
-            "payload": payload,
-            "timestamp": datetime.now().isoformat(),
-            "attempts": 0
-        }
-        self.queue.append(notification)
-        self.save_queue()
+            app_logger.error(f"Failed to save notification: {e}")
+            return
         app_logger.info(f"Added notification to queue: {payload.get('code')}")
-    
+        self._wake.set()
+
     async def process_queue(self):
-        """Try to send all pending notifications"""
-        if not self.queue:
+        """Retry every pending notification now (e.g. after the system turned healthy)"""
+        if not await asyncio.to_thread(len, self):
             return
-        
-        app_logger.info(f"Processing {len(self.queue)} pending notifications...")
-        
-        sent = []
-        for notification in self.queue:
-            notification["attempts"] += 1
-            
+        await asyncio.to_thread(self.store.retry_all_now)
+        self._wake.set()
+
+    async def run(self):
+        """Continuous drain loop, run as a supervised task"""
+        semaphore = asyncio.Semaphore(self.concurrency)
+        while True:
+            self._wake.clear()
+            due = await asyncio.to_thread(self.store.due, time.time(), NOTIFY_BATCH)
+            if due:
+                app_logger.info(f"Processing {len(due)} pending notifications...")
+                # Each chunk goes out as one bulk request where the server supports it
+                chunks = [due[i:i + STATUS_BATCH_MAX] for i in range(0, len(due), STATUS_BATCH_MAX)]
+                await asyncio.gather(*(self._deliver(chunk, semaphore) for chunk in chunks))
+                app_logger.info(f"Queue processed. Remaining: {await asyncio.to_thread(len, self)}")
+                continue
+
+            next_due = await asyncio.to_thread(self.store.next_due_at)
+            wait = NOTIFY_IDLE_WAIT if next_due is None else min(max(next_due - time.time(), 0.1), NOTIFY_IDLE_WAIT)
             try:
-                async with httpx.AsyncClient(timeout=5) as client:
-                    resp = await client.post(
-                        notification["url"],
-                        json=notification["payload"]
-                    )
-                    
-                    if resp.status_code == 200:
-                        event_logger.info(f"✅ Sent queued notification: {notification['payload'].get('code')} to {notification['url']}")
-                        sent.append(notification)
-                    else:
-                        app_logger.warning(f"Server returned {resp.status_code} for queued notification")
-                        
-            except Exception as e:
-                app_logger.error(f"Failed to send queued notification (attempt {notification['attempts']}): {e}")
-            
-            # Give up after 10 attempts
-            if notification["attempts"] >= 10:
-                app_logger.error(f"Giving up on notification after 10 attempts: {notification['payload'].get('code')}")
-                sent.append(notification)  # Remove it from queue
-        
-        # Remove successfully sent notifications
-        for notification in sent:
-            self.queue.remove(notification)
-        
-        self.save_queue()
-        app_logger.info(f"Queue processed. Remaining: {len(self.queue)}")
+                await asyncio.wait_for(self._wake.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _deliver(self, chunk: list, semaphore: asyncio.Semaphore):
+        try:
+            # The semaphore bounds each request, including per-job fallback posts
+            results = await status_reporter.send_many(
+                [(notification["url"], notification["payload"]) for notification in chunk], semaphore)
+        except Exception as e:
+            app_logger.error(f"Failed to send queued notifications: {e}")
+            results = [False] * len(chunk)
+
+        acks = []
+        reschedules = []
+        for notification, sent in zip(chunk, results):
+            attempts = notification["attempts"] + 1
+            code = notification["payload"].get("code")
+            if sent:
+                event_logger.info(f"✅ Sent queued notification: {code} to {notification['url']}")
+                acks.append((notification["id"], notification["revision"]))
+                self._record_delivery()
+                continue
+
+            app_logger.error(f"Failed to send queued notification (attempt {attempts}): {code}")
+            self.failed_total += 1
+            if self._age(notification) > NOTIFY_MAX_AGE:
+                app_logger.error(f"Giving up on notification after {attempts} attempts: {code}")
+                acks.append((notification["id"], notification["revision"]))
+                self.dropped_total += 1
+                continue
+            reschedules.append((notification["id"], notification["revision"], attempts,
+                                time.time() + backoff_delay(attempts)))
+        # One transaction per chunk, off the event loop
+        await asyncio.to_thread(self.store.settle, acks, reschedules)
+
+    def _age(self, notification: dict) -> float:
+        try:
+            return (datetime.now() - datetime.fromisoformat(notification["timestamp"])).total_seconds()
+        except (TypeError, ValueError):
+            return 0.0
+
+    def _record_delivery(self):
+        now = time.monotonic()
+        self.sent_total += 1
+        self._delivered.append(now)
+        while self._delivered and now - self._delivered[0] > 60:
+            self._delivered.popleft()
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        while self._delivered and now - self._delivered[0] > 60:
+            self._delivered.popleft()
+        oldest = self.store.oldest_timestamp()
+        return {
+            "depth": len(self),
+            "oldest_age": round(self._age({"timestamp": oldest}), 1) if oldest else None,
+            "drain_rate_per_min": len(self._delivered),
+            "sent": self.sent_total,
+            "failed_attempts": self.failed_total,
+            "dropped": self.dropped_total,
+        }
+
+    async def compact(self):
+        """Periodic journal compaction, scheduled by the supervisor"""
+        await asyncio.to_thread(self.store.compact)
 
 # Global instance
 notification_queue = NotificationQueue()
@@ -0,0 +1,166 @@
+import asyncio
+import json
+import os
+import time
+from collections import OrderedDict
+from app.http_client import get_client
+from app.logger import app_logger, event_logger
+from app.server_api import SERVER_URL, KIOSK_ID, download_file
+from app.file_cache import file_cache
+
+PREFETCH_ENABLED = os.getenv("PREFETCH_ENABLED", "0") == "1"
+PREFETCH_STREAM_URL = os.getenv("PREFETCH_STREAM_URL", f"{SERVER_URL}/{KIOSK_ID}/events")
+# How long an announced document is kept pinned waiting for its code
+PREFETCH_TTL = float(os.getenv("PREFETCH_TTL", "3600"))
+PREFETCH_MAX_BYTES = int(os.getenv("PREFETCH_MAX_BYTES", str(200 * 1024 * 1024)))
+PREFETCH_QUEUE_SIZE = 100
+PREFETCH_EXPIRY_INTERVAL = 60
+
+
+class Prefetcher:
+    """
+    Listens on a server-sent events stream for jobs the backend assigns to
+    this kiosk and downloads their documents into the PDF cache before
+    the customer arrives. Prefetched files stay pinned until their code is
+    used, they expire, or the storage cap forces the oldest out.
+
+    Expected events (data is JSON):
+        event: job_paid       {"job_id": ..., "file": {"id": ..., "sha256": ..., "size": ...}}
+        event: job_cancelled  {"job_id": ..., "file": {"id": ...}}
+    """
+
+    def __init__(self, url: str = PREFETCH_STREAM_URL, ttl: float = PREFETCH_TTL,
+                 max_bytes: int = PREFETCH_MAX_BYTES):
+        self.url = url
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._queue = asyncio.Queue(maxsize=PREFETCH_QUEUE_SIZE)
+        self._store = OrderedDict()  # file id -> {"path", "size", "expires_at"}
+        self._last_event_id = None
+        self.connected = False
+        self.announced = 0
+        self.prefetched = 0
+        self.consumed = 0
+        self.expired = 0
+        self.skipped = 0
+        self.failed = 0
+
+    async def listen(self):
+        """Read the event stream; supervised, so a dropped stream is reconnected with backoff"""
+        headers = {"Accept": "text/event-stream", "Cache-Control": "no-cache"}
+        if self._last_event_id:
+            headers["Last-Event-ID"] = self._last_event_id
+        try:
+            async with get_client().stream("GET", self.url, headers=headers, timeout=None) as resp:
+                if resp.status_code != 200:
+                    raise ConnectionError(f"prefetch stream returned HTTP {resp.status_code}")
+                self.connected = True
+                event_logger.info("Prefetch stream connected")
+                event, data = "message", []
+                async for line in resp.aiter_lines():
+                    if not line:
+                        if data:
+                            self._dispatch(event, "\n".join(data))
+                        event, data = "message", []
+                    elif line.startswith(":"):
+                        continue  # keep-alive comment
+                    else:
+                        field, _, value = line.partition(":")
+                        value = value[1:] if value.startswith(" ") else value
+                        if field == "event":
+                            event = value
+                        elif field == "data":
+                            data.append(value)
+                        elif field == "id":
+                            self._last_event_id = value
+        finally:
+            self.connected = False
+        raise ConnectionError("prefetch stream closed")
+
+    def _dispatch(self, event: str, data: str):
+        try:
+            payload = json.loads(data)
+            file_info = payload["file"]
+        except (ValueError, KeyError, TypeError):
+            app_logger.warning(f"Ignoring malformed prefetch event {event}: {data[:200]}")
+            return
+        if event == "job_cancelled":
+            self._drop(file_info["id"])
+            return
+        if event != "job_paid":
+            return
+        self.announced += 1
+        try:
+            self._queue.put_nowait(file_info)
+        except asyncio.QueueFull:
+            self.skipped += 1
+
+    async def run(self):
+        """Download announced documents one at a time so prints keep the bandwidth"""
+        while True:
+            file_info = await self._queue.get()
+            file_id = file_info["id"]
+            if file_id in self._store:
+                continue
+            size = file_info.get("size") or 0
+            if self._stored_bytes() + size > self.max_bytes:
+                self.skipped += 1
+                continue
+            cached = file_cache.acquire(file_id, file_info.get("sha256"))
+            try:
+                if cached is None:
+                    path, download = await download_file(file_id, file_info.get("sha256"))
+                    size = download["size"]
+                else:
+                    path, size = cached, os.path.getsize(cached)
+            except Exception as e:
+                self.failed += 1
+                app_logger.warning(f"Prefetch of file {file_id} failed: {e}")
+                continue
+            self._store[file_id] = {"path": path, "size": size, "expires_at": time.monotonic() + self.ttl}
+            self.prefetched += 1
+            event_logger.info(f"Prefetched file {file_id} ({size} bytes)")
+            self._enforce_cap()
+
+    def consume(self, file_id: str):
+        """A print picked up a prefetched file; drop the prefetch pin"""
+        if file_id in self._store:
+            self.consumed += 1
+            self._drop(file_id)
+
+    async def expire(self):
+        """Unpin documents nobody came for; scheduled by the supervisor"""
+        now = time.monotonic()
+        for file_id in [fid for fid, entry in self._store.items() if entry["expires_at"] <= now]:
+            self.expired += 1
+            self._drop(file_id)
+
+    def _drop(self, file_id: str):
+        entry = self._store.pop(file_id, None)
+        if entry is not None:
+            file_cache.release(entry["path"])
+
+    def _stored_bytes(self) -> int:
+        return sum(entry["size"] for entry in self._store.values())
+
+    def _enforce_cap(self):
+        while self._store and self._stored_bytes() > self.max_bytes:
+            self._drop(next(iter(self._store)))
+
+    def stats(self) -> dict:
+        return {
+            "enabled": PREFETCH_ENABLED,
+            "connected": self.connected,
+            "files": len(self._store),
+            "bytes": self._stored_bytes(),
+            "announced": self.announced,
+            "prefetched": self.prefetched,
+            "consumed": self.consumed,
+            "expired": self.expired,
+            "skipped": self.skipped,
+            "failed": self.failed,
+        }
+
+
+# Global instance
+prefetcher = Prefetcher()
@@ -0,0 +1,305 @@
+import asyncio
+import mmap
+import os
+import re
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from app.logger import app_logger, event_logger
+
+try:
+    import pypdf
+    from pypdf.generic import ContentStream
+except ImportError:
+    pypdf = None
+
+PREFLIGHT_WORKERS = int(os.getenv("PREFLIGHT_WORKERS", "1"))
+PREFLIGHT_TIMEOUT = float(os.getenv("PREFLIGHT_TIMEOUT", "20"))
+
+# Print time model: pages per minute per printer, learned from completed jobs
+DEFAULT_PPM = float(os.getenv("DEFAULT_PPM", "15"))
+PPM_SMOOTHING = 0.3
+DUPLEX_SLOWDOWN = 1.5
+# Job deadline = startup allowance + slack x estimated print time, never below the minimum
+JOB_STARTUP_ALLOWANCE = 30
+JOB_DEADLINE_SLACK = 2.0
+JOB_DEADLINE_MIN = float(os.getenv("JOB_DEADLINE_MIN", "60"))
+
+_PAGE_RE = re.compile(rb"/Type\s*/Page(?![a-zA-Z])")
+_MEDIABOX_RE = re.compile(rb"/MediaBox\s*\[\s*([-\d.]+)\s+([-\d.]+)\s+([-\d.]+)\s+([-\d.]+)\s*\]")
+_COLOR_SPACES = ("/DeviceRGB", "/DeviceCMYK", "/CalRGB", "/ICCBased", "/Indexed")
+_COLOR_RE = re.compile(rb"/DeviceRGB|/DeviceCMYK|/CalRGB|/ICCBased|/Indexed")
+# Fill/stroke color operators in uncompressed content: "1 0 0 rg", "0 1 1 0 k"
+_NUM = rb"[-+]?(?:\d+\.?\d*|\.\d+)"
+_COLOR_OP_RE = re.compile(rb"((?:" + _NUM + rb"\s+){3,4})(?:rg|RG|k|K|sc|SC|scn|SCN)(?![A-Za-z])")
+_COLOR_OPERATORS = (b"rg", b"RG", b"k", b"K", b"sc", b"SC", b"scn", b"SCN")
+_INLINE_COLOR_SPACES = ("/RGB", "/CMYK", "/DeviceRGB", "/DeviceCMYK", "/I", "/Indexed", "/CalRGB", "/ICCBased")
+_MAX_FORM_DEPTH = 5
+# Page tree lookup for the byte scan
+_ROOT_RE = re.compile(rb"/Root\s+(\d+)\s+\d+\s+R")
+_PAGES_REF_RE = re.compile(rb"/Pages\s+(\d+)\s+\d+\s+R")
+_COUNT_RE = re.compile(rb"/Count\s+(\d+)(?![\d\s]*\d\s+R)")
+_OBJSTM_RE = re.compile(rb"/Type\s*/ObjStm")
+_STREAM_RE = re.compile(rb"stream\r?\n")
+_N_RE = re.compile(rb"/N\s+(\d+)")
+_FIRST_RE = re.compile(rb"/First\s+(\d+)")
+
+
+def analyze_pdf(path: str) -> dict:
+    """
+    Page count, page sizes (points) and color pages of a PDF. Runs in a
+    worker process. Uses pypdf when installed, otherwise scans the raw
+    bytes (page tree, MediaBoxes, color spaces and color operators).
+
+    color_checked is True only when every page's content was parsed, so
+    color_pages == 0 proves a grayscale document. The byte scan cannot see
+    into compressed streams and only ever reports positive evidence.
+    """
+    if pypdf is not None:
+        try:
+            return _analyze_with_pypdf(path)
+        except Exception:
+            pass  # damaged or unusual file - fall back to the byte scan
+    return _analyze_scan(path)
+
+
+def _analyze_scan(path: str) -> dict:
+    """
+    Byte scan over a memory map, so large PDFs are not read into the
+    worker's memory. The page count comes from /Count of the page tree
+    root (Root -> Catalog -> Pages), looking inside object streams
+    (PDF 1.5+) where page objects are usually compressed.
+    """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            raise ValueError("empty file")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            packed = _object_streams(data)
+            chunks = [data, *packed.values()]
+            pages = _page_tree_count(data, packed) or sum(len(_PAGE_RE.findall(c)) for c in chunks)
+            sizes = [
+                [round(float(x1) - float(x0), 1), round(float(y1) - float(y0), 1)]
+                for chunk in chunks for x0, y0, x1, y1 in _MEDIABOX_RE.findall(chunk)
+            ]
+            color = any(_COLOR_RE.search(chunk) for chunk in chunks) or any(
+                _chromatic(match.group(1).split()) for match in _COLOR_OP_RE.finditer(data))
+    return {
+        "pages": pages or None,
+        "page_sizes": sizes[:pages] if pages else sizes[:1],
+        "color_pages": pages if color else 0,
+        "color_checked": False,
+        "method": "scan",
+    }
+
+
+def _object_streams(data) -> dict:
+    """{object number: bytes} of every object packed in a Flate object stream"""
+    objects = {}
+    for match in _OBJSTM_RE.finditer(data):
+        start = data.rfind(b"obj", 0, match.start())
+        stream = _STREAM_RE.search(data, match.end())
+        if start < 0 or stream is None:
+            continue
+        header = data[start:stream.start()]
+        count, first = _N_RE.search(header), _FIRST_RE.search(header)
+        end = data.find(b"endstream", stream.end())
+        if count is None or first is None or end < 0:
+            continue
+        raw = data[stream.end():end]
+        try:
+            content = zlib.decompressobj().decompress(raw) if b"/FlateDecode" in header else raw
+            numbers = [int(n) for n in content[:int(first.group(1))].split()]
+        except (zlib.error, ValueError):
+            continue
+        offsets = [(numbers[i], int(first.group(1)) + numbers[i + 1])
+                   for i in range(0, min(len(numbers), 2 * int(count.group(1))) - 1, 2)]
+        for i, (number, offset) in enumerate(offsets):
+            objects[number] = content[offset:offsets[i + 1][1] if i + 1 < len(offsets) else len(content)]
+    return objects
+
+
+def _find_object(data, packed: dict, number: int):
+    """Body of an object, the last (newest) uncompressed definition winning"""
+    body = None
+    for match in re.finditer(rb"(?<!\d)%d\s+\d+\s+obj\b" % number, data):
+        end = data.find(b"endobj", match.end())
+        body = data[match.end():end if end >= 0 else match.end() + 4096]
+    return body if body is not None else packed.get(number)
+
+
+def _page_tree_count(data, packed: dict):
+    """/Count of the page tree root, or None if the chain cannot be followed"""
+    trailer = data.rfind(b"/Root")
+    root = _ROOT_RE.match(data, trailer) if trailer >= 0 else None
+    catalog = _find_object(data, packed, int(root.group(1))) if root else None
+    pages_ref = _PAGES_REF_RE.search(catalog) if catalog else None
+    tree = _find_object(data, packed, int(pages_ref.group(1))) if pages_ref else None
+    count = _COUNT_RE.search(tree) if tree else None
+    return int(count.group(1)) if count else None
+
+
+def _analyze_with_pypdf(path: str) -> dict:
+    reader = pypdf.PdfReader(path)
+    sizes = []
+    color_pages = 0
+    checked = True
+    for page in reader.pages:
+        box = page.mediabox
+        sizes.append([round(float(box.width), 1), round(float(box.height), 1)])
+        resources = page.get("/Resources") or {}
+        try:
+            color = _page_has_color(page) or _content_has_color(page.get_contents(), reader, resources)
+        except Exception:
+            checked = False
+            color = False
+        if color:
+            color_pages += 1
+    return {"pages": len(reader.pages), "page_sizes": sizes, "color_pages": color_pages,
+            "color_checked": checked, "method": "pypdf"}
+
+
+def _page_has_color(page) -> bool:
+    """A page counts as color if its resources use a color space other than gray"""
+    return _resources_have_color(page.get("/Resources") or {})
+
+
+def _resources_have_color(resources) -> bool:
+    resources = resources.get_object() if hasattr(resources, "get_object") else resources
+    names = []
+    color_spaces = resources.get("/ColorSpace") or {}
+    for value in color_spaces.values():
+        value = value.get_object()
+        names.append(value[0] if isinstance(value, list) else value)
+    for xobject in (resources.get("/XObject") or {}).values():
+        xobject = xobject.get_object()
+        if xobject.get("/Subtype") == "/Image":
+            space = xobject.get("/ColorSpace")
+            if space is not None:
+                space = space.get_object()
+                names.append(space[0] if isinstance(space, list) else space)
+    return any(name in _COLOR_SPACES for name in names)
+
+
+def _chromatic(operands) -> bool:
+    """Whether color operands set anything other than a gray"""
+    try:
+        values = [float(value) for value in operands]
+    except (TypeError, ValueError):
+        return True  # pattern or named color - assume color
+    if len(values) == 3:
+        return not values[0] == values[1] == values[2]
+    if len(values) == 4:
+        return any(values[:3])
+    return False
+
+
+def _content_has_color(contents, reader, resources, depth: int = 0) -> bool:
+    """Look for color operators, color inline images and colored forms in a content stream"""
+    if contents is None:
+        return False
+    if not isinstance(contents, ContentStream):
+        contents = ContentStream(contents, reader)
+    xobjects = resources.get("/XObject") or {}
+    for operands, operator in contents.operations:
+        if operator in _COLOR_OPERATORS:
+            if _chromatic(operands):
+                return True
+        elif operator == b"INLINE IMAGE":
+            settings = operands.get("settings") or {}
+            space = settings.get("/CS", settings.get("/ColorSpace"))
+            if isinstance(space, list):
+                space = space[0]
+            if space in _INLINE_COLOR_SPACES:
+                return True
+        elif operator == b"Do" and operands and depth < _MAX_FORM_DEPTH:
+            xobject = xobjects.get(operands[0])
+            xobject = xobject.get_object() if xobject is not None else None
+            if xobject is not None and xobject.get("/Subtype") == "/Form":
+                form_resources = (xobject.get("/Resources") or resources)
+                form_resources = form_resources.get_object() if hasattr(form_resources, "get_object") else form_resources
+                if _resources_have_color(form_resources) or \
+                        _content_has_color(xobject, reader, form_resources, depth + 1):
+                    return True
+    return False
+
+
+_executor = None
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=PREFLIGHT_WORKERS)
+    return _executor
+
+
+async def preflight(path: str):
+    """Analyze a PDF off the event loop; None if it could not be read in time"""
+    loop = asyncio.get_running_loop()
+    try:
+        info = await asyncio.wait_for(
+            loop.run_in_executor(_get_executor(), analyze_pdf, path), timeout=PREFLIGHT_TIMEOUT)
+    except Exception as e:
+        app_logger.warning(f"Preflight of {path} failed: {e}")
+        return None
+    event_logger.info(f"Preflight: {info['pages']} pages, {info['color_pages']} color ({info['method']})")
+    return info
+
+
+def shutdown_preflight():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+class PrintTimeModel:
+    """Pages-per-minute per printer, learned from completed jobs (EWMA)"""
+
+    def __init__(self, default_ppm: float = DEFAULT_PPM):
+        self.default_ppm = default_ppm
+        self.ppm = {}
+        self.samples = {}
+
+    @staticmethod
+    def impressions(info: dict, print_options: dict):
+        """Pages the printer has to produce, weighted for duplex"""
+        if not info or not info.get("pages"):
+            return None
+        copies = max(int(print_options.get("copies") or 1), 1)
+        duplex = print_options.get("duplex")
+        weight = DUPLEX_SLOWDOWN if duplex and duplex != "one-sided" else 1.0
+        return info["pages"] * copies * weight
+
+    def estimate(self, printer: str, impressions) -> float:
+        """Expected print time in seconds"""
+        if impressions is None:
+            return None
+        return round(impressions / self.ppm.get(printer, self.default_ppm) * 60, 1)
+
+    def deadline(self, estimate):
+        """Per-job timeout; None leaves the tracker's default in place"""
+        if estimate is None:
+            return None
+        return max(JOB_STARTUP_ALLOWANCE + JOB_DEADLINE_SLACK * estimate, JOB_DEADLINE_MIN)
+
+    def record(self, printer: str, impressions, seconds: float):
+        """Learn from a completed job (time from submission to completion)"""
+        if not impressions or seconds <= 0:
+            return
+        observed = impressions / (seconds / 60)
+        current = self.ppm.get(printer)
+        self.ppm[printer] = observed if current is None else current + PPM_SMOOTHING * (observed - current)
+        self.samples[printer] = self.samples.get(printer, 0) + 1
+
+    def stats(self) -> dict:
+        return {
+            "default_ppm": self.default_ppm,
+            "printers": {
+                printer: {"ppm": round(ppm, 2), "samples": self.samples.get(printer, 0)}
+                for printer, ppm in self.ppm.items()
+            },
+        }
+
+
+# Global instance
+print_time_model = PrintTimeModel()
@@ -0,0 +1,357 @@
+import asyncio
+import os
+import time
+import uuid
+from collections import OrderedDict
+from app.ws import ws_manager
+from app.logger import app_logger, event_logger
+from app.server_api import fetch_print_job, InvalidCode, TooManyAttempts, UpstreamFailure
+from app.printer import (
+    PrinterUnavailable, spool_document, submit_print, track_document, as_print_failure, build_print_options
+)
+from app.job_tracker import job_tracker, JobEvent, TrackedJob
+from app.printer_pool import printer_pool, job_needs
+from app.prefetch import prefetcher
+from app.print_scheduler import print_scheduler
+from app.file_cache import file_cache
+from app.preflight import preflight, print_time_model
+from app.recovery_poller import start_recovery_polling, is_in_recovery_mode
+from app.code_cache import normalize_code
+
+# How many finished job handles stay queryable through GET /jobs/{id}
+PRINT_JOB_HISTORY = 200
+# Replays of a code whose job was already submitted get the same result for this long
+PRINT_RESULT_TTL = float(os.getenv("PRINT_RESULT_TTL", "30"))
+
+
+class PrintJob:
+    """Local handle for one /print request as it moves through the pipeline"""
+
+    QUEUED = "queued"
+    FETCHING = "fetching"
+    PREFLIGHT = "preflight"
+    WAITING = "waiting"
+    SPOOLING = "spooling"
+    SUBMITTING = "submitting"
+    PRINTING = "printing"
+    COMPLETED = "completed"
+    FAILED = "failed"
+
+    def __init__(self, code: str):
+        self.id = uuid.uuid4().hex
+        self.code = code
+        self.stage = self.QUEUED
+        self.status = None
+        self.error = None
+        self.http_status = None
+        self.server_job_id = None
+        self.lp_job_id = None
+        self.printer = None
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+        self.stage_times = {}
+        self.admitted = False
+        self.queue_position = None
+        self.eta = None
+        self.pages = None
+        self.impressions = None
+        self.print_estimate = None
+
+    @property
+    def finished(self) -> bool:
+        return self.stage in (self.COMPLETED, self.FAILED)
+
+    def to_dict(self) -> dict:
+        # No code: this goes out on the unauthenticated /ws and /jobs endpoints
+        return {
+            "id": self.id,
+            "stage": self.stage,
+            "status": self.status,
+            "error": self.error,
+            "server_job_id": self.server_job_id,
+            "lp_job_id": self.lp_job_id,
+            "printer": self.printer,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+            "stage_times": self.stage_times,
+            "queue_position": self.queue_position,
+            "eta": self.eta,
+            "pages": self.pages,
+            "print_estimate": self.print_estimate,
+        }
+
+
+class PrintJobStore:
+    def __init__(self, history: int = PRINT_JOB_HISTORY, result_ttl: float = PRINT_RESULT_TTL):
+        self.history = history
+        self.result_ttl = result_ttl
+        self.jobs = OrderedDict()
+        # code -> [job, task, expires_at]; expires_at is set once the pipeline finished
+        self._by_code = {}
+        self.pipelines = 0
+        self.coalesced = 0
+        self.replayed = 0
+
+    def create(self, code: str) -> PrintJob:
+        job = PrintJob(code)
+        self.jobs[job.id] = job
+        while len(self.jobs) > self.history:
+            oldest_id = next(iter(self.jobs))
+            if not self.jobs[oldest_id].finished:
+                break
+            self.jobs.pop(oldest_id)
+        return job
+
+    def get(self, job_id: str):
+        return self.jobs.get(job_id)
+
+    def attach(self, code: str):
+        """(job, task) of a running or recently submitted pipeline for this code, else None"""
+        entry = self._by_code.get(code)
+        if entry is None:
+            return None
+        job, task, expires_at = entry
+        if not task.done():
+            self.coalesced += 1
+            return job, task
+        if expires_at is not None and time.monotonic() < expires_at and job.stage != PrintJob.FAILED:
+            self.replayed += 1
+            return job, task
+        self._by_code.pop(code, None)
+        return None
+
+    def register(self, code: str, job: PrintJob, task: asyncio.Task):
+        self.pipelines += 1
+        self._by_code[code] = [job, task, None]
+        task.add_done_callback(lambda _: self._finished(code, job))
+
+    def _finished(self, code: str, job: PrintJob):
+        entry = self._by_code.get(code)
+        if entry is None or entry[0] is not job:
+            return
+        if job.http_status == 200:
+            entry[2] = time.monotonic() + self.result_ttl
+        else:
+            # Failures are not replayed, the next attempt runs a new pipeline
+            self._by_code.pop(code, None)
+        now = time.monotonic()
+        for stale in [c for c, (_, _, expires_at) in self._by_code.items() if expires_at and expires_at <= now]:
+            self._by_code.pop(stale, None)
+
+    def stats(self) -> dict:
+        return {
+            "pipelines": self.pipelines,
+            "coalesced": self.coalesced,
+            "replayed": self.replayed,
+            "in_flight": sum(1 for _, task, _ in self._by_code.values() if not task.done()),
+        }
+
+
+# Global instance
+print_jobs = PrintJobStore()
+
+
+# Strong references so detached pipelines are not garbage collected
+_running = set()
+
+
+def start_print_job(code: str):
+    """
+    Create a job handle and start its pipeline on the running loop.
+    Concurrent requests for the same code share one pipeline, and replays
+    shortly after a successful submit get the same job back.
+    """
+    # One key for dedup here and for the rejected-code cache and rate limiter
+    code = normalize_code(code)
+    existing = print_jobs.attach(code)
+    if existing is not None:
+        event_logger.info("Request for code %s joined job %s", code, existing[0].id)
+        return existing
+    job = print_jobs.create(code)
+    job.admitted = print_scheduler.admit(job)
+    task = asyncio.create_task(run_print_job(job))
+    _running.add(task)
+    task.add_done_callback(_running.discard)
+    print_jobs.register(code, job, task)
+    return job, task
+
+
+async def set_stage(job: PrintJob, stage: str, status: str = None):
+    now = time.time()
+    job.stage_times[job.stage] = round(now - job.updated_at, 3)
+    job.stage = stage
+    job.updated_at = now
+    if status:
+        job.status = status
+    await ws_manager.broadcast({"event": "JOB_UPDATE", "job": job.to_dict()})
+
+
+async def run_print_job(job: PrintJob):
+    """
+    Fetch, wait for the printer, spool, submit and hand off to the
+    tracker without blocking the event loop. Downloads run while earlier
+    jobs are still printing. Failures are recorded on the job handle.
+    """
+    if not job.admitted:
+        await _fail(job, "QUEUE_FULL", 429, "Print queue is full, please try again shortly", event="QUEUE_FULL")
+        return
+    try:
+        # Step 1: Validate & fetch
+        event_logger.info(
+            "Request received to fetch the document with code : %s", job.code)
+        await set_stage(job, PrintJob.FETCHING)
+        await ws_manager.broadcast({"event": "FETCHING", "job_id": job.id})
+        async with print_scheduler.fetch_slots:
+            fetched = await fetch_print_job(job.code)
+        job.server_job_id = fetched["jobId2"]
+        prefetcher.consume(fetched["file_id"])
+        print_options = {
+            "color_mode": fetched["colorMode"],
+            "duplex": fetched["duplex"],
+            "copies": fetched["copies"],
+            "orientation": fetched["orientation"],
+            }
+        event_logger.info(
+            "successfull dowloaded the document with code : %s", job.code)
+
+        # Step 2: Preflight & wait for the printer
+        file_path = fetched["file_path"]
+        try:
+            await set_stage(job, PrintJob.PREFLIGHT)
+            info = await preflight(file_path)
+            needs = job_needs(print_options)
+            if info is not None:
+                job.pages = info["pages"]
+                job.impressions = print_time_model.impressions(info, print_options)
+                job.print_estimate = print_time_model.estimate(None, job.impressions)
+                # A color job proven to have no color pages can go to a monochrome printer
+                if info.get("color_checked") and info["color_pages"] == 0:
+                    needs["color"] = False
+            await set_stage(job, PrintJob.WAITING)
+            if not printer_pool.candidates(needs):
+                await printer_pool.refresh_async()
+                if not printer_pool.candidates(needs):
+                    raise PrinterUnavailable("NO_PRINTER_FOUND")
+            printer = await print_scheduler.acquire(job, needs)
+        except BaseException:
+            file_cache.release(file_path)
+            raise
+
+        # Step 3: Spool & submit, off the event loop
+        await set_stage(job, PrintJob.SPOOLING)
+        try:
+            job.printer, job_options = await asyncio.to_thread(spool_document, file_path, print_options, printer)
+            await set_stage(job, PrintJob.SUBMITTING)
+            await ws_manager.broadcast({"event": "PRINTING", "job_id": job.id})
+            job.lp_job_id = await submit_print(job.printer, file_path, job_options, job.code, job.server_job_id,
+                                               job_name=job.id)
+        except Exception as e:
+            raise as_print_failure(e, file_path)
+
+        # Step 4: Track with a deadline sized to the job
+        job.print_estimate = print_time_model.estimate(job.printer, job.impressions)
+        estimate = None
+        if job.print_estimate is not None:
+            estimate = {"pages": job.pages, "eta_seconds": job.print_estimate,
+                        "submitted_at": time.time()}
+            await ws_manager.broadcast({"event": "PRINT_ETA", "job_id": job.id,
+                                        "pages": job.pages, "eta": job.print_estimate})
+        track_document(job.lp_job_id, job.code, job.server_job_id, job.printer, file_path, local_id=job.id,
+                       print_options=print_options, timeout=print_time_model.deadline(job.print_estimate),
+                       estimate=estimate)
+        job.http_status = 200
+        await set_stage(job, PrintJob.PRINTING, "DONE")
+
+    except TooManyAttempts as ex:
+        app_logger.warning(f"Code lookup rate limited for {job.code}: {ex}")
+        await _fail(job, "INVALID_CODE", 429, f"{ex}")
+
+    except InvalidCode as ex:
+        app_logger.error(
+            f"Code entered is not valid. Resulted in invalid state : {ex}")
+        await _fail(job, "INVALID_CODE", 400, f"{ex}")
+
+    except UpstreamFailure as e:
+        app_logger.error(
+            f"Error invoked in print job: {e}"
+        )
+        # Recovery polling starts when the upstream circuit breaker trips
+        await _fail(job, "OUT_OF_SERVICE", 503, f"{e}", event="OUT_OF_SERVICE")
+
+    except PrinterUnavailable as e:
+        app_logger.error(
+            f"Error invoked in print job: {e}"
+        )
+        await _fail(job, "OUT_OF_SERVICE", 503, f"{e}", event="OUT_OF_SERVICE")
+
+    except Exception as e:
+        app_logger.exception(
+            "Error invoked in user request"
+        )
+        await _fail(job, "OUT_OF_SERVICE", 500, f"{e}", event="OUT_OF_SERVICE")
+        _start_recovery(f"{e}")
+
+    finally:
+        if job.lp_job_id is None:
+            # Never reached the printer: give up the queue place or printer slot
+            print_scheduler.release(job)
+
+
+async def _fail(job: PrintJob, status: str, http_status: int, error: str, event: str = None):
+    job.error = error
+    job.http_status = http_status
+    try:
+        await ws_manager.broadcast({"event": event or status, "job_id": job.id})
+    except Exception as broadcast_err:
+        app_logger.error(f"Failed to broadcast {event or status}: {broadcast_err}")
+    await set_stage(job, PrintJob.FAILED, status)
+
+
+def _start_recovery(reason: str):
+    # Start recovery polling if not already active
+    if not is_in_recovery_mode():
+        start_recovery_polling(reason)
+
+
+async def _on_job_event(event: JobEvent):
+    """Close the local handle when the tracker reports the CUPS outcome"""
+    job = print_jobs.get(event.job.local_id) if event.job.local_id else None
+    if job is None:
+        return
+    print_scheduler.release(job)
+    if event.kind == JobEvent.COMPLETED:
+        print_time_model.record(event.job.printer, job.impressions, event.job.elapsed())
+        await set_stage(job, PrintJob.COMPLETED)
+    else:
+        job.error = event.message
+        await set_stage(job, PrintJob.FAILED, "PRINT_FAILED")
+
+async def _failover(tracked: TrackedJob, message: str):
+    """Resubmit a job that failed on one printer to another idle printer of the pool"""
+    job = print_jobs.get(tracked.local_id) if tracked.local_id else None
+    if job is None or tracked.print_options is None or len(printer_pool.names()) < 2:
+        return None
+    printer_pool.quarantine(tracked.printer, message)
+    target = print_scheduler.failover(job, job_needs(tracked.print_options), exclude=tracked.tried)
+    if target is None:
+        return None
+    try:
+        job_options = await asyncio.to_thread(build_print_options, target, tracked.print_options)
+        lp_job_id = await submit_print(target, tracked.file_path, job_options, job.code, job.server_job_id,
+                                       job_name=job.id)
+    except Exception as e:
+        app_logger.error(f"Failover of job {job.id} to {target} failed: {e}")
+        return None
+    event_logger.info(f"Job {job.id} failed on {tracked.printer} ({message}), resubmitted to {target}")
+    replacement = TrackedJob(lp_job_id, tracked.code, tracked.server_job_id, target, tracked.file_path,
+                             timeout=tracked.timeout, local_id=tracked.local_id,
+                             print_options=tracked.print_options, estimate=tracked.estimate)
+    replacement.tried = tracked.tried | {target}
+    job.printer = target
+    job.lp_job_id = lp_job_id
+    await ws_manager.broadcast({"event": "PRINTER_FAILOVER", "job_id": job.id, "printer": target})
+    await set_stage(job, PrintJob.PRINTING)
+    return replacement
+
+job_tracker.add_listener(_on_job_event)
+job_tracker.set_failover(_failover)
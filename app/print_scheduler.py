@@ -0,0 +1,219 @@
+import asyncio
+import os
+import time
+from app.ws import ws_manager
+from app.logger import app_logger, event_logger
+from app.printer_pool import printer_pool
+
+# Jobs admitted at once (waiting + printing); further requests are turned away
+PRINT_QUEUE_MAX = int(os.getenv("PRINT_QUEUE_MAX", "10"))
+# Queued jobs allowed to download while the printer is busy
+PRINT_FETCH_AHEAD = int(os.getenv("PRINT_FETCH_AHEAD", "2"))
+# Assumed time per job until real prints have been measured
+PRINT_ETA_DEFAULT = float(os.getenv("PRINT_ETA_DEFAULT", "45"))
+PRINT_ETA_SMOOTHING = 0.3
+
+
+class PrintScheduler:
+    """
+    Hands out the pool's printers, one job per printer at a time. Jobs are
+    admitted into a bounded FIFO, may fetch their documents ahead of time
+    (a few at once), and are granted a suitable idle printer in admission
+    order among the jobs that are ready. A printer is held from submission
+    until the tracker reports the CUPS outcome.
+    """
+
+    def __init__(self, max_jobs: int = PRINT_QUEUE_MAX, fetch_ahead: int = PRINT_FETCH_AHEAD):
+        self.max_jobs = max_jobs
+        self.fetch_ahead = fetch_ahead
+        self.fetch_slots = asyncio.Semaphore(fetch_ahead)
+        self._queue = []  # admitted jobs not yet holding a printer, in order
+        self._waiting = {}  # job id -> (future, needs) for jobs ready to print
+        self._admitted_at = {}
+        self.printing = {}  # printer -> job
+        self._printing_since = {}  # printer -> monotonic start
+        self._broadcasts = set()
+        self.started_at = time.monotonic()
+        self.avg_print_time = PRINT_ETA_DEFAULT
+        self.admitted = 0
+        self.rejected = 0
+        self.max_depth = 0
+        self.busy_time = 0.0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.granted = 0
+
+    def set_pool_size(self, printers: int):
+        """Let one more document than there are printers download ahead"""
+        self.fetch_slots = asyncio.Semaphore(max(self.fetch_ahead, printers + 1))
+
+    @property
+    def depth(self) -> int:
+        return len(self._queue) + len(self.printing)
+
+    def printer_of(self, job):
+        for printer, printing in self.printing.items():
+            if printing is job:
+                return printer
+        return None
+
+    def admit(self, job) -> bool:
+        """Take a job into the queue; False when the queue is full"""
+        if self.depth >= self.max_jobs:
+            self.rejected += 1
+            app_logger.warning(f"Print queue full ({self.depth}), rejecting job {job.id}")
+            return False
+        self._queue.append(job)
+        self._admitted_at[job.id] = time.monotonic()
+        self.admitted += 1
+        self.max_depth = max(self.max_depth, self.depth)
+        self._publish()
+        return True
+
+    async def acquire(self, job, needs: dict = None) -> str:
+        """Wait until a printer suited to needs is free; returns its queue name"""
+        future = asyncio.get_running_loop().create_future()
+        self._waiting[job.id] = (future, needs or {})
+        self._grant_next()
+        try:
+            return await future
+        except asyncio.CancelledError:
+            self.release(job)
+            raise
+
+    def kick(self):
+        """Re-run granting, e.g. after a printer came back into rotation"""
+        self._grant_next()
+
+    async def refresh_pool(self):
+        """Periodic pool refresh, scheduled by the supervisor"""
+        await printer_pool.refresh_async()
+        self.kick()
+
+    def failover(self, job, needs: dict, exclude=()):
+        """Move a printing job to another idle printer; returns it or None"""
+        printer = self.printer_of(job)
+        target = printer_pool.choose(needs, busy=self.printing, exclude=set(exclude) | {printer})
+        if target is None:
+            return None
+        self._finish_printing(printer, count=False)
+        self.printing[target] = job
+        self._printing_since[target] = time.monotonic()
+        self._grant_next()
+        self._publish()
+        return target
+
+    def release(self, job):
+        """The job finished printing, failed or gave up its place; idempotent"""
+        printer = self.printer_of(job)
+        if printer is not None:
+            self._finish_printing(printer, count=bool(job.lp_job_id))
+        elif job in self._queue:
+            self._queue.remove(job)
+        else:
+            return
+        self._waiting.pop(job.id, None)
+        self._admitted_at.pop(job.id, None)
+        self._grant_next()
+        self._publish()
+
+    def _finish_printing(self, printer: str, count: bool):
+        printed_for = time.monotonic() - self._printing_since.pop(printer)
+        self.printing.pop(printer)
+        self.busy_time += printed_for
+        if count:
+            self.avg_print_time += PRINT_ETA_SMOOTHING * (printed_for - self.avg_print_time)
+
+    def _grant_next(self):
+        granted = False
+        for job in list(self._queue):
+            waiting = self._waiting.get(job.id)
+            if waiting is None or waiting[0].done():
+                continue
+            future, needs = waiting
+            printer = printer_pool.choose(needs, busy=self.printing)
+            if printer is None:
+                continue
+            self._queue.remove(job)
+            del self._waiting[job.id]
+            waited = time.monotonic() - self._admitted_at.get(job.id, time.monotonic())
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+            self.granted += 1
+            self.printing[printer] = job
+            self._printing_since[printer] = time.monotonic()
+            event_logger.info(f"Printer {printer} granted to job {job.id} after {waited:.1f}s in queue")
+            future.set_result(printer)
+            granted = True
+        if granted:
+            self._publish()
+
+    def position(self, job):
+        """1 = next to print, 0 = printing now, None = not queued"""
+        if self.printer_of(job) is not None:
+            return 0
+        if job in self._queue:
+            return self._queue.index(job) + 1
+        return None
+
+    def eta(self, job):
+        """Seconds until the job is expected to reach a printer"""
+        position = self.position(job)
+        if position is None:
+            return None
+        if position == 0:
+            return 0.0
+        printers = printer_pool.healthy_count()
+        remaining = 0.0
+        if len(self.printing) >= printers:
+            now = time.monotonic()
+            remaining = min(
+                max(self._expected(printing) - (now - self._printing_since[printer]), 5.0)
+                for printer, printing in self.printing.items()
+            )
+        ahead = sum(self._expected(queued) for queued in self._queue[:position - 1])
+        return round(remaining + ahead / printers, 1)
+
+    def _expected(self, job) -> float:
+        """Preflight estimate for the job, or the running average"""
+        return getattr(job, "print_estimate", None) or self.avg_print_time
+
+    def _publish(self):
+        """Push queue positions to the kiosk screens"""
+        jobs = list(self.printing.values()) + list(self._queue)
+        for job in jobs:
+            job.queue_position = self.position(job)
+            job.eta = self.eta(job)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        for job in jobs:
+            task = loop.create_task(ws_manager.broadcast({
+                "event": "QUEUE_UPDATE",
+                "job_id": job.id,
+                "position": job.queue_position,
+                "eta": job.eta,
+            }))
+            self._broadcasts.add(task)
+            task.add_done_callback(self._broadcasts.discard)
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        busy = self.busy_time + sum(now - since for since in self._printing_since.values())
+        capacity = (now - self.started_at) * max(len(printer_pool.names()), 1)
+        return {
+            "depth": self.depth,
+            "max_depth": self.max_depth,
+            "printing": {printer: job.id for printer, job in self.printing.items()},
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "avg_wait": round(self.total_wait / self.granted, 1) if self.granted else None,
+            "max_wait": round(self.max_wait, 1),
+            "avg_print_time": round(self.avg_print_time, 1),
+            "utilization": round(busy / capacity, 3) if capacity > 0 else None,
+        }
+
+
+# Global instance
+print_scheduler = PrintScheduler()
@@ -1,57 +1,47 @@
 import subprocess
-import threading
-import time
 import asyncio
-import os
 from app.ws import ws_manager
 from app.logger import app_logger, event_logger
 from app.health import printer_connected
 from app.state import kiosk_state
 from app.notification_queue import notification_queue
+from app.status_reporter import status_reporter
+from app.job_tracker import job_tracker, JobEvent, TrackedJob, JOB_TIMEOUT
+from app.printer_registry import printer_registry, PrinterNotFound
+from app.file_cache import file_cache
+from app.ipp import ipp_client, IppError, CUPS_IPP
 
 class PrinterUnavailable(Exception):
     pass
 
+class UnsupportedOption(PrinterUnavailable):
+    pass
+
 def get_default_printer():
     """Get the default printer name"""
     try:
-        result = subprocess.run(
-            ["lpstat", "-d"],
-            capture_output=True,
-            text=True,
-            timeout=5
-        )
-        
-        if result.returncode == 0 and result.stdout:
-            # Output: "system default destination: printer_name"
-            default = result.stdout.strip().split(":")[-1].strip()
-            return default
-        else:
-            # No default, get first available printer
-            result = subprocess.run(
-                ["lpstat", "-p"],
-                capture_output=True,
-                text=True,
-                timeout=5
-            )
-            
-            if result.returncode == 0 and "printer" in result.stdout:
-                # Extract first printer name
-                first_line = result.stdout.split("\n")[0]
-                printer_name = first_line.split()[1]
-                return printer_name
-            
-            raise PrinterUnavailable("NO_PRINTER_FOUND")
-            
+        return printer_registry.default_printer()
+    except PrinterNotFound:
+        raise PrinterUnavailable("NO_PRINTER_FOUND")
     except subprocess.TimeoutExpired:
         raise PrinterUnavailable("PRINTER_CHECK_TIMEOUT")
     except Exception as e:
         app_logger.error(f"Error getting printer: {e}")
         raise PrinterUnavailable(f"PRINTER_ERROR: {e}")
 
-def build_lp_command(printer: str, file_path: str, options: dict):
+def _pick_color_model(caps, color: bool):
+    """Choose the PPD ColorModel choice for color or grayscale output"""
+    preferred = ["RGB", "CMYK", "Color"] if color else ["Gray", "KGray", "Grayscale", "CMYGray"]
+    for choice in preferred:
+        if choice in caps.color_models:
+            return choice
+    return None
+
+def build_print_options(printer: str, options: dict, capabilities=None) -> list:
     """
-    Build lp command with print options
+    Turn print options into CUPS job options [(name, value)], checked
+    against the queue's cached capabilities. Raises UnsupportedOption for
+    options the queue cannot honour.
     
     options dict can include:
     - color_mode: "color" or "monochrome"
@@ -63,259 +53,197 @@ def build_lp_command(printer: str, file_path: str, options: dict):
     - quality: "draft", "normal", "high"
     """
     
-    cmd = ["lp", "-d", printer]
+    if capabilities is None:
+        capabilities = printer_registry.capabilities(printer)
+    
+    job_options = []
     
     # Color mode
-    if options.get("color_mode") == "monochrome":
-        cmd.extend(["-o", "ColorModel=Gray"])
-    elif options.get("color_mode") == "color":
-        cmd.extend(["-o", "ColorModel=RGB"])
+    color_mode = options.get("color_mode")
+    if color_mode == "color" and not capabilities.color:
+        app_logger.warning(f"{printer} is monochrome, printing color job in grayscale")
+        color_mode = "monochrome"
+    if color_mode in ("monochrome", "color"):
+        if capabilities.from_ppd and capabilities.color_models:
+            model = _pick_color_model(capabilities, color_mode == "color")
+            if model:
+                job_options.append(("ColorModel", model))
+        elif capabilities.from_ppd:
+            # No ColorModel in the PPD - use the standard IPP attribute
+            job_options.append(("print-color-mode", color_mode))
+        else:
+            job_options.append(("ColorModel", "Gray" if color_mode == "monochrome" else "RGB"))
     
     # Duplex (double-sided printing)
     duplex = options.get("duplex", "one-sided")
+    if duplex and not capabilities.duplex:
+        app_logger.warning(f"{printer} cannot print duplex, printing one-sided")
+        duplex = False
     if duplex:
-        cmd.extend(["-o", "sides=two-sided-long-edge"])
+        job_options.append(("sides", "two-sided-long-edge"))
     else:
-        cmd.extend(["-o", "sides=one-sided"])
+        job_options.append(("sides", "one-sided"))
     
     # Number of copies
     copies = options.get("copies", 1)
+    if copies > capabilities.max_copies:
+        raise UnsupportedOption(f"UNSUPPORTED_OPTION: {copies} copies exceeds {capabilities.max_copies}")
     if copies > 1:
-        cmd.extend(["-n", str(copies)])
+        job_options.append(("copies", copies))
     
     # Page range
     if "page_range" in options:
-        cmd.extend(["-P", options["page_range"]])
+        job_options.append(("page-ranges", options["page_range"]))
     
     # Orientation
     if options.get("orientation") == "landscape":
-        cmd.extend(["-o", "landscape"])
+        job_options.append(("orientation-requested", 4))
     
     # Paper size
     if "media" in options:
-        cmd.extend(["-o", f"media={options['media']}"])
+        if capabilities.media and options["media"] not in capabilities.media:
+            raise UnsupportedOption(f"UNSUPPORTED_OPTION: media {options['media']} not supported by {printer}")
+        job_options.append(("media", options["media"]))
     
     # Print quality
     quality = options.get("quality")
+    if quality and capabilities.qualities and quality not in capabilities.qualities:
+        app_logger.warning(f"{printer} does not offer {quality} quality, using the default")
+        quality = None
     if quality == "draft":
-        cmd.extend(["-o", "print-quality=3"])
+        job_options.append(("print-quality", 3))
     elif quality == "high":
-        cmd.extend(["-o", "print-quality=5"])
+        job_options.append(("print-quality", 5))
     
-    # Add file path at the end
+    return job_options
+
+def lp_command(printer: str, file_path: str, job_options: list) -> list:
+    """The lp invocation for job options from build_print_options()"""
+    cmd = ["lp", "-d", printer]
+    for name, value in job_options:
+        if name == "copies":
+            cmd.extend(["-n", str(value)])
+        elif name == "page-ranges":
+            cmd.extend(["-P", str(value)])
+        elif name == "orientation-requested" and value == 4:
+            cmd.extend(["-o", "landscape"])
+        else:
+            cmd.extend(["-o", f"{name}={value}"])
     cmd.append(file_path)
-    
     return cmd
 
-def print_document(file_path: str, code: str = None, jobId1: str = None, print_options: dict = None):
-    """
-    Print a document with specified options
+def spool_document(file_path: str, print_options: dict, printer: str = None):
+    """Check the printer and build the job options. Blocking."""
+    if not printer_connected():
+        raise PrinterUnavailable("PRINTER_OFFlINE")
     
-    Args:
-        file_path: Path to PDF file
-        code: Print code for tracking
-        job_id: Job ID from server
-        print_options: Dict with printing preferences (color, duplex, etc.)
-    """
-	
-    if print_options is None:
-        print_options = {}
+    # Get printer (the pool's pick, or the default queue)
+    printer = printer or get_default_printer()
+    event_logger.info(f"Using printer: {printer}")
+    
+    # Build job options
+    job_options = build_print_options(printer, print_options)
     
+    # Log the options for debugging
+    app_logger.info(f"Print options for {printer}: {job_options}")
+    return printer, job_options
+
+async def submit_print(printer: str, file_path: str, job_options: list, code: str = None, jobId1: str = None,
+                       job_name: str = None):
+    """
+    Submit a spooled document over IPP (or lp when CUPS_IPP is off); returns
+    the CUPS job id. job_name ends up in the CUPS job history, so it must
+    never be the print code.
+    """
+    if not CUPS_IPP:
+        return await asyncio.to_thread(submit_document, lp_command(printer, file_path, job_options), code, jobId1)
     try:
-        if printer_connected():
-        # Get printer
-            printer = get_default_printer()
-            event_logger.info(f"Using printer: {printer}")
-        
-        # Build command with options
-            cmd = build_lp_command(printer, file_path, print_options)
-        
-        # Log the command for debugging
-            app_logger.info(f"Print command: {' '.join(cmd)}")
-        
-        # Execute print command
-            result = subprocess.run(
-                cmd,
-                capture_output=True,
-                text=True,
-                timeout=10
-            )
-        
-            if result.returncode != 0:
-                app_logger.error(f"Print command failed: {result.stderr}")
-                raise PrinterUnavailable(f"PRINT_FAILED: {result.stderr}")
-        
-        # Extract job ID from lp output
-        # Output format: "request id is printer-123 (1 file(s))"
-            lp_job_id = None
-            if "request id is" in result.stdout:
-                lp_job_id = result.stdout.split("request id is")[1].split()[0].strip()
-                event_logger.info(f"Print job submitted: {lp_job_id} (code: {code}, server job: {jobId1})")
-        
-        # Start monitoring in background
-            threading.Thread(
-                target=monitor_job,
-                args=(lp_job_id, code, jobId1, printer, file_path),
-                daemon=True
-            ).start()
-        
-            return lp_job_id
-        else:
-            app_logger.error("Print command timed out")
-            delete_temp_file(file_path)
-            raise PrinterUnavailable("PRINTER_OFFlINE")
-    except subprocess.TimeoutExpired:
-        app_logger.error("Print command timed out")
-        delete_temp_file(file_path)
-        raise PrinterUnavailable("PRINT_TIMEOUT")
-    except Exception as e:
-        app_logger.error(f"Failed to print: {e}")
-        delete_temp_file(file_path)
-        raise PrinterUnavailable(f"PRINT_ERROR: {e}")
+        job_id = await ipp_client.print_job(printer, file_path, job_options, job_name=job_name)
+    except IppError as e:
+        app_logger.error(f"Print-Job failed: {e}")
+        raise PrinterUnavailable(f"PRINT_FAILED: {e}")
+    lp_job_id = f"{printer}-{job_id}"
+    event_logger.info(f"Print job submitted: {lp_job_id} (code: {code}, server job: {jobId1})")
+    return lp_job_id
 
-def monitor_job(lp_job_id: str, code: str, server_job_id: str, printer_name: str, file_path: str):
-    """Monitor print job status using lpstat"""
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
+def submit_document(cmd: list, code: str = None, jobId1: str = None):
+    """Run lp and return the CUPS job id. Blocking."""
+    result = subprocess.run(
+        cmd,
+        capture_output=True,
+        text=True,
+        timeout=10
+    )
     
-    timeout = 300  # 5 minutes
-    start_time = time.time()
+    if result.returncode != 0:
+        app_logger.error(f"Print command failed: {result.stderr}")
+        raise PrinterUnavailable(f"PRINT_FAILED: {result.stderr}")
+    
+    # Extract job ID from lp output
+    # Output format: "request id is printer-123 (1 file(s))"
+    lp_job_id = None
+    if "request id is" in result.stdout:
+        lp_job_id = result.stdout.split("request id is")[1].split()[0].strip()
+        event_logger.info(f"Print job submitted: {lp_job_id} (code: {code}, server job: {jobId1})")
+    return lp_job_id
+
+def track_document(lp_job_id: str, code: str, jobId1: str, printer: str, file_path: str, local_id: str = None,
+                   print_options: dict = None, timeout: float = None, estimate: dict = None):
+    """Hand a submitted job to the shared tracker"""
+    kiosk_state.set_handling_print_error(True)
+    job_tracker.track(TrackedJob(lp_job_id, code, jobId1, printer, file_path, timeout=timeout or JOB_TIMEOUT,
+                                 local_id=local_id, print_options=print_options, estimate=estimate))
+
+def as_print_failure(e: Exception, file_path: str) -> PrinterUnavailable:
+    """Log a failed spool/submit, release the file and map it to PrinterUnavailable"""
+    file_cache.release(file_path)
+    if isinstance(e, (subprocess.TimeoutExpired, asyncio.TimeoutError)):
+        app_logger.error("Print command timed out")
+        return PrinterUnavailable("PRINT_TIMEOUT")
+    if isinstance(e, UnsupportedOption):
+        app_logger.error(f"Rejected print options: {e}")
+        return e
+    if isinstance(e, PrinterUnavailable) and str(e) == "PRINTER_OFFlINE":
+        app_logger.error("Printer is not connected")
+        return e
+    app_logger.error(f"Failed to print: {e}")
+    return PrinterUnavailable(f"PRINT_ERROR: {e}")
+
+# Pending print-error cooldowns, referenced so they are not garbage-collected
+_cooldowns = set()
+
+async def _on_job_event(event: JobEvent):
+    """Deliver tracker transitions to the kiosk screen and the server"""
+    job = event.job
     kiosk_state.set_handling_print_error(True)
     try:
-        while True:
-            # Check timeout
-            if time.time() - start_time > timeout:
-                event_logger.error(f"Print job {lp_job_id} timed out")
-                #kiosk_state.set_handling_print_error(True)
-                # Cancel the job
-                try:
-                    subprocess.run(["cancel", lp_job_id], timeout=5)
-                except:
-                    pass
-                
-                loop.run_until_complete(
-                    ws_manager.broadcast({"event": "PRINT_FAILED"})
-                )
-                
-                if code:
-                    loop.run_until_complete(
-                        notify_server_failed(code, server_job_id, "Print Timed Out")
-                    )
-                time.sleep(30)
-                kiosk_state.set_handling_print_error(False)
-                break
-            
-            try:
-                # Check if job still exists in queue
-                result = subprocess.run(
-                    ["lpstat", "-o", lp_job_id],
-                    capture_output=True,
-                    text=True,
-                    timeout=5
-                )
-                
-                # Job not found = completed or cancelled
-                if result.returncode != 0 or not result.stdout:
-                    # Check if it was cancelled or completed
-                    # If we get here after reasonable time, assume completed
-                    elapsed = time.time() - start_time
-                    
-                    if elapsed < 0:
-                        # Job disappeared too quickly - likely error
-                        event_logger.error(f"Print job {lp_job_id} failed immediately")
-                        #kiosk_state.set_handling_print_error(True)
-                        loop.run_until_complete(
-                            ws_manager.broadcast({"event": "PRINT_FAILED"})
-                        )
-                        if code:
-                            loop.run_until_complete(
-                                notify_server_failed(code, server_job_id, "Job failed immediately")
-                            )
-                        time.sleep(30)
-                        kiosk_state.set_handling_print_error(False)
-                    else:
-                        result_status = subprocess.run(
-                        ["lpstat", "-W", "not-completed"],
-                        capture_output=True,
-                        text=True,
-                        timeout=5
-                            )
-                        if lp_job_id in result_status.stdout:
-                        # Job completed 
-                            event_logger.info(result_status.stdout)
-                            event_logger.info(f"Print job {lp_job_id} completed")
-                        else:
-                            if printer_connected():
-                                #event_logger.info("broadcast karro hogaya")
-                                #kiosk_state.set_handling_print_error(True)
-                                loop.run_until_complete(
-                                ws_manager.broadcast({"event": "DONE"})
-                                )
-                                if code:
-                                    loop.run_until_complete(
-                                        notify_server_success(code, server_job_id)
-                                    )
-                                time.sleep(10)
-                                kiosk_state.set_handling_print_error(False)
-                            else:
-                                event_logger.info("Cups print job completed but printer connection interuppted #bhai cups ka job huva lekin printer band hogaya")
-                                #kiosk_state.set_handling_print_error(True)
-                                loop.run_until_complete(
-                                    ws_manager.broadcast({"event": "PRINT_FAILED"})
-                                )
-                                if code:
-                                    loop.run_until_completed(
-                                        notify_server_failed(code, server_job_id, "Cups print job completed but printer connection interuppted")
-                                    )
-                                time.sleep(30)
-                                kiosk_state.set_handling_print_error(False)
-                            break
-                
-                # Job still in queue - check state
-                output = result.stdout.lower()
-                
-                if "error" in output or "aborted" in output:
-                    event_logger.error(f"Print job {lp_job_id} error: {result.stdout}")
-                    
-                    # Cancel it
-                    try:
-                        subprocess.run(["cancel", lp_job_id], timeout=5)
-                    except:
-                        pass
-                    #kiosk_state.set_handling_print_error(True)
-                    loop.run_until_complete(
-                        ws_manager.broadcast({"event": "PRINT_FAILED"})
-                    )
-                    
-                    if code:
-                        loop.run_until_complete(
-                            notify_server_failed(code, server_job_id, "Print error")
-                        )
-                    time.sleep(30)
-                    kiosk_state.set_handling_print_error(False)
-                    break
-                
-            except subprocess.TimeoutExpired:
-                app_logger.error(f"lpstat timeout for job {lp_job_id}")
-            except Exception as e:
-                app_logger.error(f"Error monitoring job {lp_job_id}: {e}")
-            
-            time.sleep(2)  # Check every 2 seconds
-            
-    except Exception as e:
-        app_logger.exception(f"Fatal error monitoring job {lp_job_id}")
-        kiosk_state.set_handling_print_error(True)
-        loop.run_until_complete(
-            ws_manager.broadcast({"event": "PRINT_FAILED"})
-        )
-        time.sleep(30)
-        kiosk_state.set_handling_print_error(False)
+        if event.kind == JobEvent.COMPLETED:
+            await ws_manager.broadcast({"event": "DONE", "job_id": job.local_id})
+            if job.code:
+                await notify_server_success(job.code, job.server_job_id, job.estimate)
+            cooldown = 10
+        else:
+            await ws_manager.broadcast({"event": "PRINT_FAILED", "job_id": job.local_id})
+            if job.code:
+                await notify_server_failed(job.code, job.server_job_id, event.message, job.estimate)
+            cooldown = 30
     finally:
-        loop.close()
-        delete_temp_file(file_path)
-async def notify_server_success(code: str, job_id: str):
+        # Unpins the cached PDF so it can serve a reprint
+        file_cache.release(job.file_path)
+    task = asyncio.create_task(_release_print_error(cooldown))
+    _cooldowns.add(task)
+    task.add_done_callback(_cooldowns.discard)
+
+async def _release_print_error(delay: float):
+    """Let the health watcher report again once the kiosk screen settled"""
+    await asyncio.sleep(delay)
+    if job_tracker.active_count() == 0:
+        kiosk_state.set_handling_print_error(False)
+
+job_tracker.add_listener(_on_job_event)
+
+async def notify_server_success(code: str, job_id: str, estimate: dict = None):
     """Notify server of successful print"""
-    import httpx
     from app.server_api import SERVER_URL, KIOSK_ID
     
     success_url = f"{SERVER_URL}/{KIOSK_ID}/job/{job_id}/status"
@@ -324,24 +252,17 @@ async def notify_server_success(code: str, job_id: str):
         "job_id": job_id,
         "kiosk_id": KIOSK_ID,
         "status": "completed",
-        "message": f"Print Job Completed"
+        "message": "Print Job Completed"
     }
-    try:
-        async with httpx.AsyncClient(timeout=5) as client:
-            resp = await client.post(success_url, json=payload)
-            if resp.status_code == 200:
-                event_logger.info(f"Server notified of success: {code}")
-            else:
-                app_logger.warning(f"Server notification failed: {resp.status_code}")
-                notification_queue.add(success_url, payload)
-                
-    except Exception as e:
-        app_logger.error(f"Failed to notify server: {e}")
-        notification_queue.add(success_url, payload)
+    if estimate:
+        payload["estimate"] = estimate
+    if await status_reporter.report(success_url, payload):
+        event_logger.info(f"Server notified of success: {code}")
+    else:
+        await notification_queue.add(success_url, payload)
 
-async def notify_server_failed(code: str, job_id: str, fail_message: str):
+async def notify_server_failed(code: str, job_id: str, fail_message: str, estimate: dict = None):
     """Notify server of failed print"""
-    import httpx
     from app.server_api import SERVER_URL, KIOSK_ID
     
     fail_url = f"{SERVER_URL}/{KIOSK_ID}/job/{job_id}/status"
@@ -352,27 +273,9 @@ async def notify_server_failed(code: str, job_id: str, fail_message: str):
         "status": "failed",
         "message": f"Print failed: {fail_message}"
     }
-    try:
-        async with httpx.AsyncClient(timeout=5) as client:
-            resp = await client.post(fail_url, json=payload)
-            
-            if resp.status_code == 200:
-                event_logger.info(f"Server notified of failure: {code}")
-            else:
-                app_logger.warning(f"Server notification failed: {resp.status_code}")
-                payload 
-                notification_queue.add(fail_url, payload)
-                
-    except Exception as e:
-        app_logger.error(f"Failed to notify server: {e}")
-
-def delete_temp_file(file_path: str):
-    """Safely delete temporary PDF file"""
-    try:
-        if file_path and os.path.exists(file_path):
-            os.remove(file_path)
-            event_logger.info(f"Temp file deleted: {file_path}")
-        else:
-            app_logger.warning(f"Temp file not found: {file_path}")
-    except Exception as e:
-        app_logger.error(f"Failed to delete temp file {file_path}: {e}")
+    if estimate:
+        payload["estimate"] = estimate
+    if await status_reporter.report(fail_url, payload):
+        event_logger.info(f"Server notified of failure: {code}")
+    else:
+        await notification_queue.add(fail_url, payload)
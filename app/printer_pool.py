@@ -0,0 +1,143 @@
+import asyncio
+import os
+import time
+from app.logger import app_logger, event_logger
+from app.printer_registry import printer_registry, PrinterNotFound
+from app.ipp import ipp_client, IppError, CUPS_IPP
+
+# How long a printer that failed a job is kept out of rotation
+PRINTER_QUARANTINE = float(os.getenv("PRINTER_QUARANTINE", "120"))
+PRINTER_POOL_REFRESH = 30
+
+
+def job_needs(print_options: dict) -> dict:
+    """The capabilities a job asks for"""
+    duplex = print_options.get("duplex")
+    return {
+        "color": print_options.get("color_mode") == "color",
+        "duplex": bool(duplex) and duplex != "one-sided",
+    }
+
+
+class PoolMember:
+    def __init__(self, name: str):
+        self.name = name
+        self.capabilities = None
+        self.enabled = True
+        self.status = None
+        self.quarantined_until = 0.0
+        self.quarantine_reason = None
+        self.last_assigned = 0.0
+        self.assigned = 0
+        self.failovers = 0
+
+    @property
+    def healthy(self) -> bool:
+        return self.enabled and time.monotonic() >= self.quarantined_until
+
+    def supports(self, needs: dict) -> bool:
+        caps = self.capabilities
+        if caps is None:
+            return True
+        return (caps.color or not needs.get("color")) and (caps.duplex or not needs.get("duplex"))
+
+    def to_dict(self) -> dict:
+        return {
+            "healthy": self.healthy,
+            "enabled": self.enabled,
+            "status": self.status,
+            "quarantined_for": round(max(self.quarantined_until - time.monotonic(), 0), 1) or None,
+            "quarantine_reason": self.quarantine_reason,
+            "color": self.capabilities.color if self.capabilities else None,
+            "duplex": self.capabilities.duplex if self.capabilities else None,
+            "assigned": self.assigned,
+            "failovers": self.failovers,
+        }
+
+
+class PrinterPool:
+    """
+    The CUPS queues the kiosk prints to, with their capabilities and
+    health. choose() routes a job to an idle printer that can honour its
+    options, preferring monochrome devices for monochrome jobs and
+    spreading work across equal printers.
+    """
+
+    def __init__(self):
+        self.members = {}
+
+    def refresh(self, states: dict = None, names: list = None):
+        """Re-read queues, capabilities and enabled state. Blocking."""
+        try:
+            names = names if names is not None else printer_registry.printers()
+        except (PrinterNotFound, OSError) as e:
+            app_logger.warning(f"Printer pool refresh failed: {e}")
+            return
+        if states is None:
+            states = printer_registry.printer_states()
+        members = {}
+        for name in names:
+            member = self.members.get(name) or PoolMember(name)
+            member.capabilities = printer_registry.capabilities(name)
+            if name in states:
+                member.enabled, member.status = states[name]
+            members[name] = member
+        self.members = members
+
+    async def refresh_async(self):
+        """Periodic refresh, scheduled by the supervisor"""
+        if not CUPS_IPP:
+            await asyncio.to_thread(self.refresh)
+            return
+        try:
+            states = await ipp_client.printer_states()
+            names = await printer_registry.resolve_printers(states)
+        except (PrinterNotFound, IppError, OSError, asyncio.TimeoutError) as e:
+            app_logger.warning(f"Printer pool refresh failed: {e}")
+            return
+        # Only the PPDs are read in the worker thread
+        await asyncio.to_thread(self.refresh, states, names)
+
+    def names(self) -> list:
+        return list(self.members)
+
+    def healthy_count(self) -> int:
+        return sum(1 for member in self.members.values() if member.healthy) or 1
+
+    def candidates(self, needs: dict) -> list:
+        """Healthy printers able to honour needs, or any healthy printer if none can"""
+        healthy = [member for member in self.members.values() if member.healthy]
+        capable = [member for member in healthy if member.supports(needs)]
+        return capable or healthy
+
+    def choose(self, needs: dict, busy=(), exclude=()):
+        """Pick an idle printer for a job, or None if all suitable printers are busy"""
+        idle = [member for member in self.candidates(needs)
+                if member.name not in busy and member.name not in exclude]
+        if not idle:
+            return None
+
+        def rank(member):
+            wasted_color = bool(member.capabilities and member.capabilities.color and not needs.get("color"))
+            return wasted_color, member.last_assigned
+
+        member = min(idle, key=rank)
+        member.last_assigned = time.monotonic()
+        member.assigned += 1
+        return member.name
+
+    def quarantine(self, name: str, reason: str):
+        member = self.members.get(name)
+        if member is None:
+            return
+        member.quarantined_until = time.monotonic() + PRINTER_QUARANTINE
+        member.quarantine_reason = reason
+        member.failovers += 1
+        event_logger.warning(f"Printer {name} taken out of rotation for {PRINTER_QUARANTINE}s: {reason}")
+
+    def stats(self) -> dict:
+        return {name: member.to_dict() for name, member in self.members.items()}
+
+
+# Global instance
+printer_pool = PrinterPool()
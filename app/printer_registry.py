@@ -0,0 +1,236 @@
+import asyncio
+import os
+import subprocess
+import threading
+from app.logger import app_logger, event_logger
+from app.ipp import ipp_client, CUPS_IPP
+
+# Pin the CUPS queue to use; otherwise the CUPS default (or first) queue is used
+PRINTER_QUEUE = os.getenv("PRINTER_QUEUE")
+# Comma separated queues for a multi-printer pool; otherwise every CUPS queue
+PRINTER_QUEUES = [q.strip() for q in os.getenv("PRINTER_QUEUES", "").split(",") if q.strip()]
+PRINTER_MAX_COPIES = int(os.getenv("PRINTER_MAX_COPIES", "9999"))
+
+CUPS_CONFIG_PATHS = [
+    "/etc/cups/printers.conf",
+    "/etc/cups/lpoptions",
+    "/etc/cups/ppd",
+]
+CUPS_PPD_DIR = "/etc/cups/ppd"
+
+
+class PrinterNotFound(Exception):
+    pass
+
+
+class PrinterCapabilities:
+    """What a CUPS queue supports, as read from its PPD"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.color = True
+        self.duplex = True
+        self.color_models = set()
+        self.media = set()
+        self.qualities = set()
+        self.max_copies = PRINTER_MAX_COPIES
+        self.from_ppd = False
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "color": self.color,
+            "duplex": self.duplex,
+            "color_models": sorted(self.color_models),
+            "media": sorted(self.media),
+            "qualities": sorted(self.qualities),
+            "max_copies": self.max_copies,
+            "from_ppd": self.from_ppd,
+        }
+
+
+def parse_ppd(name: str, text: str) -> PrinterCapabilities:
+    """Extract color, duplex, media, quality and copies support from PPD text"""
+    caps = PrinterCapabilities(name)
+    caps.from_ppd = True
+    caps.duplex = False
+    current_ui = None
+    for line in text.splitlines():
+        if line.startswith("*ColorDevice:"):
+            caps.color = "true" in line.lower()
+        elif line.startswith("*cupsMaxCopies:"):
+            value = line.split(":", 1)[1].strip().strip('"')
+            if value.isdigit():
+                caps.max_copies = int(value)
+        elif line.startswith("*OpenUI"):
+            # *OpenUI *PageSize/Media Size: PickOne
+            current_ui = line.split()[1].split("/")[0].split(":")[0].lstrip("*")
+        elif line.startswith("*CloseUI"):
+            current_ui = None
+        elif current_ui and line.startswith(f"*{current_ui} "):
+            choice = line[len(current_ui) + 2:].split("/")[0].split(":")[0].strip()
+            if current_ui == "PageSize":
+                caps.media.add(choice)
+            elif current_ui == "ColorModel":
+                caps.color_models.add(choice)
+            elif current_ui == "Duplex" and choice != "None":
+                caps.duplex = True
+            elif current_ui in ("cupsPrintQuality", "print-quality"):
+                caps.qualities.add(choice.lower())
+    return caps
+
+
+def parse_lpstat_printers(output: str) -> dict:
+    """
+    Parse `lpstat -p` output into {queue: (enabled, status line)}.
+    Lines look like "printer HpQueue is idle.  enabled since ..." or
+    "printer HpQueue disabled since ... -"; reason lines are indented.
+    """
+    printers = {}
+    for line in output.splitlines():
+        if line.startswith("printer "):
+            parts = line.split()
+            printers[parts[1]] = ("disabled" not in line, line.strip())
+    return printers
+
+
+class PrinterRegistry:
+    """
+    Resolves the CUPS destination once and caches it together with its
+    capabilities. The cache is dropped whenever the CUPS configuration
+    (printers.conf, lpoptions or a PPD) changes on disk.
+    """
+
+    def __init__(self, queue: str = PRINTER_QUEUE):
+        self.queue = queue
+        self._lock = threading.Lock()
+        self._signature = None
+        self._default = None
+        self._printers = None
+        self._capabilities = {}
+
+    def _config_signature(self):
+        signature = []
+        for path in CUPS_CONFIG_PATHS:
+            try:
+                st = os.stat(path)
+                signature.append((path, st.st_mtime_ns, st.st_size))
+            except OSError:
+                signature.append((path, None, None))
+        return tuple(signature)
+
+    def _check_config(self):
+        signature = self._config_signature()
+        if signature != self._signature:
+            if self._signature is not None:
+                event_logger.info("CUPS configuration changed, refreshing printer cache")
+            self._signature = signature
+            self._default = None
+            self._printers = None
+            self._capabilities = {}
+
+    def default_printer(self) -> str:
+        """Return the queue to print to, resolving it on first use"""
+        with self._lock:
+            self._check_config()
+            if self._default is None:
+                self._set_default(self.queue or self._resolve_default())
+            return self._default
+
+    def printers(self) -> list:
+        """Every queue the kiosk may print to, the default queue first"""
+        if PRINTER_QUEUES:
+            return list(PRINTER_QUEUES)
+        default = self.default_printer()
+        with self._lock:
+            if self._printers is None:
+                self._set_printers(default, [] if self.queue else list(self.printer_states()))
+            return list(self._printers)
+
+    async def resolve_default(self) -> str:
+        """default_printer() for the event loop; asks CUPS over IPP when CUPS_IPP is on"""
+        if not CUPS_IPP:
+            return await asyncio.to_thread(self.default_printer)
+        with self._lock:
+            self._check_config()
+            if self._default is not None or self.queue:
+                return self._default or self._set_default(self.queue)
+        name = await ipp_client.get_default()
+        if not name:
+            # No default, take the first queue CUPS knows about
+            queues = await ipp_client.get_printers(("printer-name",))
+            if not queues:
+                raise PrinterNotFound("NO_PRINTER_FOUND")
+            name = queues[0]["printer-name"]
+        with self._lock:
+            return self._default or self._set_default(name)
+
+    async def resolve_printers(self, states: dict = None) -> list:
+        """printers() for the event loop; states from CUPS-Get-Printers saves a request"""
+        if PRINTER_QUEUES:
+            return list(PRINTER_QUEUES)
+        if not CUPS_IPP:
+            return await asyncio.to_thread(self.printers)
+        default = await self.resolve_default()
+        with self._lock:
+            if self._printers is not None:
+                return list(self._printers)
+        if states is None and not self.queue:
+            states = await ipp_client.printer_states()
+        with self._lock:
+            if self._printers is None:
+                self._set_printers(default, [] if self.queue else list(states))
+            return list(self._printers)
+
+    def _set_default(self, name: str) -> str:
+        self._default = name
+        event_logger.info(f"Resolved printer queue: {name}")
+        return name
+
+    def _set_printers(self, default: str, names: list):
+        self._printers = [default] + [name for name in names if name != default]
+        event_logger.info(f"Printer pool: {', '.join(self._printers)}")
+
+    def printer_states(self) -> dict:
+        """Live {queue: (enabled, status line)} for every CUPS queue; not cached"""
+        result = subprocess.run(["lpstat", "-p"], capture_output=True, text=True, timeout=5)
+        return parse_lpstat_printers(result.stdout) if result.returncode == 0 else {}
+
+    def capabilities(self, name: str = None) -> PrinterCapabilities:
+        name = name or self.default_printer()
+        with self._lock:
+            self._check_config()
+            caps = self._capabilities.get(name)
+            if caps is None:
+                caps = self._load_capabilities(name)
+                self._capabilities[name] = caps
+            return caps
+
+    def _resolve_default(self) -> str:
+        result = subprocess.run(["lpstat", "-d"], capture_output=True, text=True, timeout=5)
+        # Output: "system default destination: printer_name"
+        if result.returncode == 0 and "system default destination:" in result.stdout:
+            return result.stdout.strip().split(":")[-1].strip()
+
+        # No default, get first available printer
+        result = subprocess.run(["lpstat", "-p"], capture_output=True, text=True, timeout=5)
+        if result.returncode == 0 and result.stdout.startswith("printer"):
+            # Output: "printer HP_LaserJet_Pro is idle..."
+            return result.stdout.split("\n")[0].split()[1]
+
+        raise PrinterNotFound("NO_PRINTER_FOUND")
+
+    def _load_capabilities(self, name: str) -> PrinterCapabilities:
+        ppd_path = os.path.join(CUPS_PPD_DIR, f"{name}.ppd")
+        try:
+            with open(ppd_path, errors="replace") as f:
+                caps = parse_ppd(name, f.read())
+        except OSError as e:
+            app_logger.warning(f"No PPD for {name} ({e}), assuming default capabilities")
+            caps = PrinterCapabilities(name)
+        event_logger.info(f"Printer capabilities for {name}: {caps.to_dict()}")
+        return caps
+
+
+# Global instance
+printer_registry = PrinterRegistry()
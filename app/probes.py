@@ -0,0 +1,211 @@
+import asyncio
+import time
+from app.health_snapshot import health_snapshot
+from app.logger import health_logger
+
+# Stable components back off by this factor per check, up to max_interval
+PROBE_BACKOFF_FACTOR = 1.5
+
+
+class Probe:
+    """
+    One health check with its own cadence.
+
+    The reported state only flips after `rise` consecutive successes or
+    `fall` consecutive failures (hysteresis). While a component is
+    degraded or flapping it is checked every min_interval; while a print
+    is active it shrinks towards min_interval; while stable and healthy it
+    grows towards max_interval.
+    """
+
+    def __init__(self, name: str, check, base_interval: float, min_interval: float, max_interval: float,
+                 rise: int = 2, fall: int = 2):
+        self.name = name
+        self.check = check
+        self.base_interval = base_interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.rise = rise
+        self.fall = fall
+        self.interval = base_interval
+        self.next_run = 0.0
+        self.reported = None
+        self.detail = None
+        self.streak = 0
+        self.runs = 0
+        self.flaps = 0
+        self.total_cost = 0.0
+        self.last_cost = None
+        self.last_result = None
+        self.last_run = None
+        self.changed = asyncio.Event()
+
+    def record(self, ok: bool, detail=None) -> bool:
+        """Apply one raw result; returns True when the reported state flipped"""
+        self.last_result = ok
+        self.detail = detail
+        flipped = False
+        if self.reported is None:
+            self.reported = ok
+            flipped = True
+        elif ok == self.reported:
+            self.streak = 0
+        else:
+            self.streak += 1
+            if self.streak >= (self.rise if ok else self.fall):
+                self.reported = ok
+                self.streak = 0
+                self.flaps += 1
+                flipped = True
+        if flipped:
+            self.changed.set()
+            self.changed = asyncio.Event()
+        return flipped
+
+    def force(self, ok: bool, detail=None):
+        """Set the reported state from outside evidence (e.g. a failed request)"""
+        if self.reported != ok:
+            self.reported = ok
+            self.streak = 0
+            self.detail = detail
+            self.changed.set()
+            self.changed = asyncio.Event()
+        self.interval = self.min_interval
+        self.next_run = time.monotonic() + self.min_interval
+
+    def schedule(self, busy: bool):
+        """Pick the next interval from the current state"""
+        degraded = not self.reported or self.streak > 0
+        if degraded:
+            self.interval = self.min_interval
+        elif busy:
+            self.interval = self.busy_interval()
+        else:
+            self.interval = min(max(self.interval, self.base_interval / PROBE_BACKOFF_FACTOR) * PROBE_BACKOFF_FACTOR,
+                                self.max_interval)
+        self.next_run = time.monotonic() + self.interval
+
+    def busy_interval(self) -> float:
+        """One step from the current interval (at most base) towards min_interval"""
+        return max(min(self.interval, self.base_interval) / PROBE_BACKOFF_FACTOR, self.min_interval)
+
+    def stats(self) -> dict:
+        return {
+            "state": self.reported,
+            "last_result": self.last_result,
+            "interval": round(self.interval, 1),
+            "runs": self.runs,
+            "flaps": self.flaps,
+            "last_cost": round(self.last_cost, 4) if self.last_cost is not None else None,
+            "avg_cost": round(self.total_cost / self.runs, 4) if self.runs else None,
+            "last_run": self.last_run,
+        }
+
+
+class ProbeScheduler:
+    """Runs every registered probe on its own adaptive cadence from one task"""
+
+    def __init__(self):
+        self.probes = {}
+        self._listeners = []
+        self._busy = lambda: False
+        self._wake = asyncio.Event()
+
+    def add(self, probe: Probe):
+        self.probes[probe.name] = probe
+
+    def add_listener(self, callback):
+        """Register callback(name, ok) fired when a probe's reported state flips"""
+        self._listeners.append(callback)
+
+    def set_busy_check(self, busy):
+        """busy() -> bool; while True (e.g. a print is active) probes run faster"""
+        self._busy = busy
+
+    def busy_started(self):
+        """A print just started: pull probes sleeping out a long backoff forward"""
+        now = time.monotonic()
+        for probe in self.probes.values():
+            interval = probe.busy_interval()
+            if probe.next_run > now + interval:
+                probe.interval = interval
+                probe.next_run = now + interval
+        self._wake.set()
+
+    def wake(self, name: str = None):
+        """Run the named probe (or all of them) now"""
+        for probe in self.probes.values():
+            if name is None or probe.name == name:
+                probe.next_run = 0.0
+        self._wake.set()
+
+    def report_failure(self, name: str, detail=None):
+        """Mark a component down from outside evidence and check it at the fast cadence"""
+        probe = self.probes[name]
+        probe.force(False, detail)
+        health_snapshot.update(name, False, detail)
+        self._notify(name, False)
+        self._wake.set()
+
+    def state(self, name: str):
+        return self.probes[name].reported
+
+    async def wait_for_state(self, name: str, ok: bool):
+        probe = self.probes[name]
+        while probe.reported != ok:
+            await probe.changed.wait()
+
+    async def run_probe(self, probe: Probe):
+        start = time.monotonic()
+        try:
+            result = await probe.check()
+        except Exception as e:
+            health_logger.error(f"Probe {probe.name} raised: {e}")
+            result = (False, f"{type(e).__name__}: {e}")
+        probe.last_cost = time.monotonic() - start
+        probe.total_cost += probe.last_cost
+        probe.runs += 1
+        probe.last_run = time.time()
+
+        ok, detail = result if isinstance(result, tuple) else (result, None)
+        flipped = probe.record(bool(ok), detail)
+        health_snapshot.update(probe.name, probe.reported, detail)
+        probe.schedule(self._busy())
+        if flipped:
+            health_logger.info(f"Probe {probe.name} is now {'healthy' if probe.reported else 'failing'}")
+            self._notify(probe.name, probe.reported)
+        return probe.reported
+
+    async def run_all(self) -> bool:
+        """Run every probe now (used by the snapshot's single-flight refresh)"""
+        await asyncio.gather(*(self.run_probe(probe) for probe in self.probes.values()))
+        return health_snapshot.healthy()
+
+    def _notify(self, name: str, ok: bool):
+        for callback in self._listeners:
+            try:
+                callback(name, ok)
+            except Exception:
+                health_logger.exception(f"Probe listener failed for {name}")
+
+    async def run(self):
+        """Scheduler loop, run as a supervised task"""
+        while True:
+            self._wake.clear()
+            now = time.monotonic()
+            due = [probe for probe in self.probes.values() if probe.next_run <= now]
+            if due:
+                await asyncio.gather(*(self.run_probe(probe) for probe in due))
+                continue
+            wait = min(probe.next_run for probe in self.probes.values()) - now if self.probes else 60
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=max(wait, 0.05))
+            except asyncio.TimeoutError:
+                pass
+
+    def stats(self) -> dict:
+        return {name: probe.stats() for name, probe in self.probes.items()}
+
+
+# Global instance
+probe_scheduler = ProbeScheduler()
@@ -1,64 +1,74 @@
 import asyncio
-import httpx
 from app.logger import app_logger, event_logger
+from app.supervisor import supervisor
 from app.ws import ws_manager
+from app.probes import probe_scheduler
+from app.health_snapshot import health_snapshot
+from app.circuit_breaker import upstream_breaker, CircuitBreaker
 
 # Global flag to track if we're in OUT_OF_SERVICE state
 _is_out_of_service = False
-_poller_task = None
 
-async def check_server_health(server_url: str) -> bool:
-    """Check if the server is reachable and responding"""
-    try:
-        async with httpx.AsyncClient(timeout=5) as client:
-            # Try a simple GET to the base URL or health endpoint
-            # Adjust this based on your actual server's health check endpoint
-            resp = await client.get(server_url.replace('/kiosk', '/health'), follow_redirects=True)
-            return resp.status_code == 200
-    except Exception as e:
-        app_logger.debug(f"Server health check failed: {e}")
-        return False
+# Strong references to breaker event broadcasts
+_broadcasts = set()
 
-async def poll_server_recovery(server_url: str, interval: int = 10):
-    """Poll the server until it's healthy again"""
+async def poll_server_recovery():
+    """Wait until the upstream probe reports the server healthy again"""
     global _is_out_of_service
     
     event_logger.info("Starting server recovery polling")
     
-    while _is_out_of_service:
-        await asyncio.sleep(interval)
-        
-        app_logger.info("Checking server availability...")
-        is_healthy = await check_server_health(server_url)
-        
-        if is_healthy:
-            event_logger.info("Server is back online! Broadcasting HEALTHY event")
-            _is_out_of_service = False
-            
-            try:
-                await ws_manager.broadcast({"event": "HEALTHY"})
-            except Exception as e:
-                app_logger.error(f"Failed to broadcast HEALTHY event: {e}")
-            
-            break
-        else:
-            app_logger.debug(f"Server still unavailable, will retry in {interval}s")
+    # The upstream probe now runs at its fast cadence until it recovers
+    await probe_scheduler.wait_for_state("upstream", True)
+    
+    event_logger.info("Server is back online! Broadcasting HEALTHY event")
+    _is_out_of_service = False
+    
+    try:
+        await ws_manager.broadcast({"event": "HEALTHY"})
+    except Exception as e:
+        app_logger.error(f"Failed to broadcast HEALTHY event: {e}")
     
     event_logger.info("Server recovery polling stopped")
 
-def start_recovery_polling(server_url: str, interval: int = 10):
+def start_recovery_polling(reason: str = "request failed"):
     """Start the recovery polling task"""
-    global _is_out_of_service, _poller_task
+    global _is_out_of_service
     
     if _is_out_of_service:
         app_logger.info("Recovery polling already active")
         return
     
     _is_out_of_service = True
+    probe_scheduler.report_failure("upstream", reason)
     
-    # Create a background task for polling
-    _poller_task = asyncio.create_task(poll_server_recovery(server_url, interval))
+    # Run the polling as a supervised background task
+    supervisor.spawn("recovery_poller", poll_server_recovery, restart=False)
 
 def is_in_recovery_mode() -> bool:
     """Check if system is currently in recovery mode"""
     return _is_out_of_service
+
+def _on_breaker_change(breaker: CircuitBreaker):
+    """Publish breaker state and start recovery polling when it trips"""
+    stats = breaker.stats()
+    health_snapshot.update("circuit", breaker.state != CircuitBreaker.OPEN, stats)
+    task = asyncio.get_running_loop().create_task(
+        ws_manager.broadcast({"event": "CIRCUIT_STATE", "circuit": breaker.name, **stats}))
+    _broadcasts.add(task)
+    task.add_done_callback(_broadcasts.discard)
+    if breaker.state == CircuitBreaker.OPEN:
+        start_recovery_polling(f"circuit open: {breaker.last_error}")
+
+def _on_probe_change(name: str, ok: bool):
+    """The upstream probe opens the breaker when it fails and admits trial calls when it recovers"""
+    if name != "upstream":
+        return
+    if ok:
+        upstream_breaker.reset()
+    else:
+        upstream_breaker.trip("upstream probe failing")
+
+upstream_breaker.add_listener(_on_breaker_change)
+probe_scheduler.add_listener(_on_probe_change)
+health_snapshot.update("circuit", True, upstream_breaker.stats())
@@ -1,44 +1,97 @@
-import httpx
-import tempfile
 import os
+from app.http_client import get_client
+from app.downloader import download_to_file, DownloadTooLarge
+from app.logger import app_logger
+from app.circuit_breaker import upstream_breaker, CircuitOpen
+from app.code_cache import invalid_codes
+from app.file_cache import file_cache
 
-SERVER_URL = "https://api.paynprint.com/api/kiosk" #apna url dalde idhar
+SERVER_URL = os.getenv("SERVER_URL", "https://api.paynprint.com/api/kiosk") #apna url dalde idhar
 KIOSK_ID= os.getenv("KIOSK_ID", "UNKNOWN")
 
 class InvalidCode(Exception):
     pass
 
+class TooManyAttempts(InvalidCode):
+    pass
+
 class UpstreamFailure(Exception):
     pass
 
+class FileTooLarge(UpstreamFailure):
+    pass
+
 async def fetch_print_job(code: str):
-    async with httpx.AsyncClient(timeout=8) as client:
-        try:
-            target_url = f"{SERVER_URL}/{KIOSK_ID}/process-code"
-            resp = await client.post(target_url, json={"code": code, "kiosk_id" : KIOSK_ID})
-        except Exception:
-            raise UpstreamFailure("SERVER_UNREACHABLE")
-
-        if (resp.status_code == 404 or resp.status_code == 400):
-            data1 = resp.json()
-            raise InvalidCode(f"{data1['error']}")
-
-        if resp.status_code != 200:
-            raise UpstreamFailure("BAD_SERVER_RESPONSE")
-
-        data = resp.json()
-        file_id = data["data"]["file"]["id"]
-
-        try:
-            file_resp = await client.get(f"{SERVER_URL}/file/{file_id}")
-            file_resp.raise_for_status()
-        except Exception:
-            raise UpstreamFailure("FILE_DOWNLOAD_FAILED")
-
-        tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".pdf")
-        tmp.write(file_resp.content)
-        tmp.close()
-        job_id = data["data"]["job"]["id"]
-        job_data = data["data"]["job"]
-
-        return {"file_path": tmp.name, "jobId2" : job_id, "colorMode": job_data["colorMode"], "duplex": job_data["duplex"], "copies" : job_data["copies"], "orientation" : ""}
+    """
+    Fetch through the upstream circuit breaker; fails fast while it is open.
+    Codes the server already rejected are answered from the negative cache.
+    A lookup token is only taken for requests that will reach the server.
+    """
+    rejected = invalid_codes.get(code)
+    if rejected is not None:
+        raise InvalidCode(rejected)
+    if upstream_breaker.rejecting():
+        upstream_breaker.rejected += 1
+        raise UpstreamFailure("SERVER_UNAVAILABLE")
+    if not invalid_codes.allow_lookup(code):
+        raise TooManyAttempts("Too many attempts, please wait a moment and try again")
+    try:
+        return await upstream_breaker.call(
+            _fetch_print_job, code, failures=(UpstreamFailure,), exclude=(FileTooLarge,))
+    except CircuitOpen:
+        raise UpstreamFailure("SERVER_UNAVAILABLE")
+    except InvalidCode as e:
+        invalid_codes.add(code, f"{e}")
+        raise
+
+async def _fetch_print_job(code: str):
+    client = get_client()
+    try:
+        target_url = f"{SERVER_URL}/{KIOSK_ID}/process-code"
+        resp = await client.post(target_url, json={"code": code, "kiosk_id" : KIOSK_ID}, timeout=8)
+    except Exception:
+        raise UpstreamFailure("SERVER_UNREACHABLE")
+
+    if (resp.status_code == 404 or resp.status_code == 400):
+        data1 = resp.json()
+        raise InvalidCode(f"{data1['error']}")
+
+    if resp.status_code != 200:
+        raise UpstreamFailure("BAD_SERVER_RESPONSE")
+
+    data = resp.json()
+    file_data = data["data"]["file"]
+    file_id = file_data["id"]
+
+    file_path = file_cache.acquire(file_id, file_data.get("sha256"))
+    if file_path is not None:
+        download = {"cached": True}
+    else:
+        file_path, download = await download_file(file_id, file_data.get("sha256"))
+    job_id = data["data"]["job"]["id"]
+    job_data = data["data"]["job"]
+
+    return {"file_path": file_path, "jobId2" : job_id, "colorMode": job_data["colorMode"], "duplex": job_data["duplex"], "copies" : job_data["copies"], "orientation" : "", "file_id": file_id, "download": download}
+
+async def download_file(file_id, expected_sha256):
+    """Download a file into the PDF cache; returns (path, download stats)"""
+    tmp = file_cache.new_file()
+    try:
+        download = await download_to_file(
+            f"{SERVER_URL}/file/{file_id}", tmp, expected_sha256=expected_sha256)
+    except DownloadTooLarge:
+        _discard(tmp)
+        raise FileTooLarge("FILE_TOO_LARGE")
+    except Exception as e:
+        app_logger.error(f"File download failed for {file_id}: {e}")
+        _discard(tmp)
+        raise UpstreamFailure("FILE_DOWNLOAD_FAILED")
+    tmp.close()
+    return file_cache.store(file_id, tmp.name, download["sha256"]), download
+
+def _discard(tmp):
+    tmp.close()
+    try:
+        os.remove(tmp.name)
+    except OSError:
+        pass
@@ -0,0 +1,157 @@
+import asyncio
+import gzip
+import json
+import os
+import time
+from app.http_client import get_client
+from app.logger import app_logger, event_logger
+from app.server_api import SERVER_URL, KIOSK_ID
+
+STATUS_BATCH_WINDOW = float(os.getenv("STATUS_BATCH_WINDOW", "0.5"))
+STATUS_BATCH_MAX = int(os.getenv("STATUS_BATCH_MAX", "20"))
+# How long to stick to per-job posts after the server rejected the bulk endpoint
+STATUS_BULK_RETRY_AFTER = 3600
+BULK_UNSUPPORTED_STATUS = {404, 405, 501}
+# Per-job posts in flight at once on the fallback path; stays under the client pool size
+STATUS_CONCURRENCY = int(os.getenv("STATUS_CONCURRENCY", "4"))
+
+
+class StatusReporter:
+    """
+    Gathers job status updates for a short window (or until the batch is
+    full) and sends them as one gzip-compressed bulk request. Falls back
+    to the per-job status endpoint when the server has no bulk endpoint.
+    """
+
+    def __init__(self, window: float = STATUS_BATCH_WINDOW, max_batch: int = STATUS_BATCH_MAX,
+                 bulk_url: str = None):
+        self.window = window
+        self.max_batch = max_batch
+        self.bulk_url = bulk_url or f"{SERVER_URL}/{KIOSK_ID}/job/status/bulk"
+        self._pending = []
+        self._timer = None
+        self._sending = set()
+        self._bulk_disabled_until = 0.0
+        self._limit = asyncio.Semaphore(STATUS_CONCURRENCY)
+        self.events = 0
+        self.bulk_requests = 0
+        self.single_requests = 0
+
+    @property
+    def bulk_supported(self) -> bool:
+        return time.monotonic() >= self._bulk_disabled_until
+
+    async def report(self, url: str, payload: dict) -> bool:
+        """Queue one status update for the next batch and wait for its outcome"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((url, payload, future))
+        self.events += 1
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        task = asyncio.get_running_loop().create_task(self._send_batch(batch))
+        self._sending.add(task)
+        task.add_done_callback(self._sending.discard)
+
+    async def _send_batch(self, batch: list):
+        try:
+            results = await self.send_many([(url, payload) for url, payload, _ in batch])
+        except Exception as e:
+            app_logger.error(f"Status batch failed: {e}")
+            results = [False] * len(batch)
+        for (_, _, future), ok in zip(batch, results):
+            if not future.done():
+                future.set_result(ok)
+
+    async def send_many(self, items: list, limit: asyncio.Semaphore = None) -> list:
+        """
+        Deliver [(url, payload), ...]; returns a success flag per item.
+        Every request, bulk or per-job, holds a slot of limit while in flight.
+        """
+        limit = limit or self._limit
+        if len(items) > 1 and self.bulk_supported:
+            async with limit:
+                results = await self._send_bulk(items)
+            if results is not None:
+                return results
+        return await asyncio.gather(*(self._send_limited(limit, url, payload) for url, payload in items))
+
+    async def _send_limited(self, limit: asyncio.Semaphore, url: str, payload: dict) -> bool:
+        async with limit:
+            return await self._send_single(url, payload)
+
+    async def _send_bulk(self, items: list):
+        """Returns per-item results, or None when the server has no bulk endpoint"""
+        body = gzip.compress(json.dumps({
+            "kiosk_id": KIOSK_ID,
+            "updates": [payload for _, payload in items],
+        }).encode())
+        self.bulk_requests += 1
+        try:
+            resp = await get_client().post(
+                self.bulk_url,
+                content=body,
+                headers={"Content-Type": "application/json", "Content-Encoding": "gzip"},
+                timeout=10
+            )
+        except Exception as e:
+            app_logger.error(f"Bulk status report failed: {e}")
+            return [False] * len(items)
+
+        if resp.status_code in BULK_UNSUPPORTED_STATUS:
+            app_logger.warning(f"Bulk status endpoint unavailable ({resp.status_code}), using per-job posts")
+            self._bulk_disabled_until = time.monotonic() + STATUS_BULK_RETRY_AFTER
+            return None
+        if resp.status_code != 200:
+            app_logger.warning(f"Bulk status report returned {resp.status_code}")
+            return [False] * len(items)
+
+        event_logger.info(f"Server notified of {len(items)} job statuses in one request")
+        return self._bulk_results(resp, items)
+
+    def _bulk_results(self, resp, items: list) -> list:
+        """Honour per-job results if the server sends them, else all succeeded"""
+        try:
+            results = resp.json().get("results")
+        except Exception:
+            results = None
+        if not isinstance(results, list):
+            return [True] * len(items)
+        accepted = {r.get("job_id") for r in results if isinstance(r, dict) and r.get("ok")}
+        return [payload.get("job_id") in accepted for _, payload in items]
+
+    async def _send_single(self, url: str, payload: dict) -> bool:
+        self.single_requests += 1
+        try:
+            resp = await get_client().post(url, json=payload, timeout=5)
+        except Exception as e:
+            app_logger.error(f"Failed to notify server: {e}")
+            return False
+        if resp.status_code != 200:
+            app_logger.warning(f"Server notification failed: {resp.status_code}")
+            return False
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "events": self.events,
+            "bulk_requests": self.bulk_requests,
+            "single_requests": self.single_requests,
+            "bulk_supported": self.bulk_supported,
+            "pending": len(self._pending),
+        }
+
+
+# Global instance
+status_reporter = StatusReporter()
@@ -0,0 +1,157 @@
+import asyncio
+import random
+import time
+from app.logger import app_logger
+
+# Restart backoff for crashed tasks: 1s, 2s, 4s ... capped
+RESTART_BACKOFF_MAX = 60
+
+
+class SupervisedTask:
+    def __init__(self, name: str, restart: bool, interval: float = None):
+        self.name = name
+        self.restart = restart
+        self.interval = interval
+        self.task = None
+        self.state = "pending"
+        self.runs = 0
+        self.failures = 0
+        self.restarts = 0
+        self.total_runtime = 0.0
+        self.last_runtime = None
+        self.last_started = None
+        self.last_error = None
+
+    def to_dict(self) -> dict:
+        return {
+            "state": self.state,
+            "interval": self.interval,
+            "runs": self.runs,
+            "failures": self.failures,
+            "restarts": self.restarts,
+            "total_runtime": round(self.total_runtime, 3),
+            "avg_runtime": round(self.total_runtime / self.runs, 4) if self.runs else None,
+            "last_runtime": round(self.last_runtime, 4) if self.last_runtime is not None else None,
+            "last_started": self.last_started,
+            "last_error": self.last_error,
+        }
+
+
+class Supervisor:
+    """
+    Runs every background and periodic job as a task on the app's event
+    loop. Crashed tasks are restarted with backoff, periodic tasks get
+    jitter, and shutdown cancels everything in one place.
+    """
+
+    def __init__(self):
+        self.tasks = {}
+        self._loop = None
+
+    def start(self, loop: asyncio.AbstractEventLoop = None):
+        self._loop = loop or asyncio.get_running_loop()
+
+    @property
+    def loop(self):
+        return self._loop
+
+    def is_running(self, name: str) -> bool:
+        entry = self.tasks.get(name)
+        return entry is not None and entry.task is not None and not entry.task.done()
+
+    def spawn(self, name: str, coro_factory, restart: bool = True):
+        """
+        Run coro_factory() as a long-lived task. With restart=True it is
+        started again after it crashes; a normal return ends it.
+        """
+        if self.is_running(name):
+            return self.tasks[name]
+        entry = SupervisedTask(name, restart)
+        self.tasks[name] = entry
+        entry.task = self._loop.create_task(self._supervise(entry, coro_factory))
+        return entry
+
+    def every(self, name: str, func, interval: float, jitter: float = 0.1, initial_delay: float = 0):
+        """Run await func() every interval seconds (+/- jitter fraction)"""
+        async def periodic():
+            if initial_delay:
+                await asyncio.sleep(initial_delay)
+            while True:
+                await self._timed(entry, func)
+                spread = interval * jitter
+                await asyncio.sleep(max(interval + random.uniform(-spread, spread), 0))
+
+        if self.is_running(name):
+            return self.tasks[name]
+        entry = SupervisedTask(name, restart=True, interval=interval)
+        self.tasks[name] = entry
+        entry.task = self._loop.create_task(self._supervise(entry, periodic, count_runs=False))
+        return entry
+
+    async def _timed(self, entry: SupervisedTask, func):
+        start = time.monotonic()
+        entry.last_started = time.time()
+        try:
+            await func()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            entry.failures += 1
+            entry.last_error = f"{type(e).__name__}: {e}"
+            app_logger.error(f"Periodic task {entry.name} failed: {e}", exc_info=True)
+        finally:
+            entry.runs += 1
+            entry.last_runtime = time.monotonic() - start
+            entry.total_runtime += entry.last_runtime
+
+    async def _supervise(self, entry: SupervisedTask, coro_factory, count_runs: bool = True):
+        attempt = 0
+        while True:
+            entry.state = "running"
+            start = time.monotonic()
+            if count_runs:
+                entry.last_started = time.time()
+            try:
+                await coro_factory()
+                entry.state = "finished"
+                return
+            except asyncio.CancelledError:
+                entry.state = "cancelled"
+                raise
+            except Exception as e:
+                entry.failures += 1
+                entry.last_error = f"{type(e).__name__}: {e}"
+                app_logger.error(f"Background task {entry.name} crashed: {e}", exc_info=True)
+                if not entry.restart:
+                    entry.state = "failed"
+                    return
+            finally:
+                if count_runs:
+                    entry.runs += 1
+                    entry.last_runtime = time.monotonic() - start
+                    entry.total_runtime += entry.last_runtime
+
+            if time.monotonic() - start > RESTART_BACKOFF_MAX:
+                attempt = 0  # it ran fine for a while, start the backoff over
+            delay = min(2 ** attempt, RESTART_BACKOFF_MAX)
+            attempt += 1
+            entry.restarts += 1
+            entry.state = "restarting"
+            app_logger.info(f"Restarting {entry.name} in {delay}s")
+            await asyncio.sleep(delay)
+
+    async def shutdown(self, timeout: float = 5):
+        """Cancel all supervised tasks and wait for them to finish"""
+        running = [entry.task for entry in self.tasks.values() if entry.task and not entry.task.done()]
+        for task in running:
+            task.cancel()
+        if running:
+            await asyncio.wait(running, timeout=timeout)
+        app_logger.info(f"Supervisor stopped {len(running)} tasks")
+
+    def stats(self) -> dict:
+        return {name: entry.to_dict() for name, entry in self.tasks.items()}
+
+
+# Global instance
+supervisor = Supervisor()
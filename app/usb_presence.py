@@ -0,0 +1,135 @@
+import asyncio
+import os
+import socket
+import threading
+import time
+from app.logger import health_logger
+
+# Known printer USB vendor IDs (hex)
+PRINTER_USB_VENDORS = {
+    "03f0",  # HP
+    "04a9",  # Canon
+    "04f9",  # Brother
+}
+
+USB_SYSFS_DIR = "/sys/bus/usb/devices"
+NETLINK_KOBJECT_UEVENT = 15
+# How long a sysfs scan is trusted when hotplug events are not available
+PRESENCE_FALLBACK_TTL = float(os.getenv("PRESENCE_FALLBACK_TTL", "2"))
+
+
+def scan_usb_printers(sysfs_dir: str = USB_SYSFS_DIR) -> set:
+    """Return the sysfs names of attached USB devices from a printer vendor"""
+    found = set()
+    try:
+        entries = list(os.scandir(sysfs_dir))
+    except FileNotFoundError:
+        return found
+    for entry in entries:
+        try:
+            with open(os.path.join(entry.path, "idVendor")) as f:
+                vendor = f.read().strip().lower()
+        except OSError:
+            # Interfaces and hubs without idVendor, or a device that just left
+            continue
+        if vendor in PRINTER_USB_VENDORS:
+            found.add(entry.name)
+    return found
+
+
+def parse_uevent(data: bytes) -> dict:
+    """Parse a kernel uevent datagram ("add@/devices/...\\0KEY=VALUE\\0...")"""
+    fields = {}
+    for part in data.split(b"\0")[1:]:
+        if b"=" in part:
+            key, _, value = part.partition(b"=")
+            fields[key.decode(errors="replace")] = value.decode(errors="replace")
+    return fields
+
+
+class PrinterPresence:
+    """
+    Cached USB printer presence.
+
+    The answer comes from a sysfs scan and is refreshed by kernel hotplug
+    uevents (netlink), so printer_connected() is an in-memory lookup. When
+    netlink is unavailable the scan is repeated at most every
+    PRESENCE_FALLBACK_TTL seconds.
+    """
+
+    def __init__(self, sysfs_dir: str = USB_SYSFS_DIR):
+        self.sysfs_dir = sysfs_dir
+        self._devices = None
+        self._scanned_at = 0.0
+        self._lock = threading.Lock()
+        self._sock = None
+        self._loop = None
+        self._listeners = []
+
+    def add_listener(self, callback):
+        """Register callback(connected: bool) fired when presence changes"""
+        self._listeners.append(callback)
+
+    def connected(self) -> bool:
+        if self._devices is None or (
+            self._sock is None and time.monotonic() - self._scanned_at > PRESENCE_FALLBACK_TTL
+        ):
+            self.refresh()
+        return bool(self._devices)
+
+    def refresh(self):
+        with self._lock:
+            previous = self._devices
+            self._devices = scan_usb_printers(self.sysfs_dir)
+            self._scanned_at = time.monotonic()
+            changed = previous is not None and bool(previous) != bool(self._devices)
+        if changed:
+            health_logger.info(f"Printer {'connected' if self._devices else 'disconnected'}: {sorted(self._devices)}")
+            for callback in self._listeners:
+                try:
+                    callback(bool(self._devices))
+                except Exception:
+                    health_logger.exception("Printer presence listener failed")
+
+    def start(self, loop: asyncio.AbstractEventLoop = None):
+        """Subscribe to kernel hotplug uevents on the given event loop"""
+        if self._sock is not None:
+            return
+        self.refresh()
+        try:
+            sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_KOBJECT_UEVENT)
+            sock.bind((0, 1))  # multicast group 1: kernel uevents
+            sock.setblocking(False)
+        except (AttributeError, OSError) as e:
+            health_logger.warning(f"USB hotplug events unavailable, falling back to sysfs polling: {e}")
+            return
+        self._loop = loop or asyncio.get_running_loop()
+        self._sock = sock
+        self._loop.add_reader(sock.fileno(), self._on_uevent)
+        health_logger.info("Listening for USB hotplug events")
+
+    def stop(self):
+        if self._sock is None:
+            return
+        self._loop.remove_reader(self._sock.fileno())
+        self._sock.close()
+        self._sock = None
+
+    def _on_uevent(self):
+        relevant = False
+        while True:
+            try:
+                data = self._sock.recv(65536)
+            except BlockingIOError:
+                break
+            except OSError as e:
+                health_logger.error(f"USB hotplug socket error: {e}")
+                break
+            if parse_uevent(data).get("SUBSYSTEM") == "usb":
+                relevant = True
+        if relevant:
+            self.refresh()
+
+
+# Global instance
+printer_presence = PrinterPresence()
@@ -1,22 +1,140 @@
+import asyncio
+import json
+import os
+import time
+from collections import deque
 from fastapi import WebSocket
-from typing import List
+from typing import Dict
+from app.logger import app_logger
+
+# Per-client send queue size and what to do when a client falls behind:
+#   "drop_oldest" - discard the oldest queued message to make room
+#   "coalesce"    - keep only the newest message per event type
+#   "disconnect"  - close the slow client
+WS_QUEUE_SIZE = int(os.getenv("WS_QUEUE_SIZE", "32"))
+WS_SLOW_CLIENT_POLICY = os.getenv("WS_SLOW_CLIENT_POLICY", "drop_oldest")
+WS_SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "5"))
+
+
+class WSClient:
+    def __init__(self, ws: WebSocket, queue_size: int):
+        self.ws = ws
+        self.queue_size = queue_size
+        self.pending = deque()
+        self.ready = asyncio.Event()
+        self.sender = None
+        self.connected_at = time.time()
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+
+    def stats(self) -> dict:
+        return {
+            "client": f"{self.ws.client.host}:{self.ws.client.port}" if self.ws.client else None,
+            "connected_at": self.connected_at,
+            "queued": len(self.pending),
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "last_lag": round(self.last_lag, 4),
+            "max_lag": round(self.max_lag, 4),
+        }
+
 
 class WSManager:
-    def __init__(self):
-        self.clients: List[WebSocket] = []
+    def __init__(self, queue_size: int = WS_QUEUE_SIZE, policy: str = WS_SLOW_CLIENT_POLICY):
+        self.clients: Dict[WebSocket, WSClient] = {}
+        self.queue_size = queue_size
+        self.policy = policy
+        self.evicted = 0
+        # Close tasks of evicted clients, referenced so they are not garbage-collected
+        self._closing = set()
 
     async def connect(self, ws: WebSocket):
         await ws.accept()
-        self.clients.append(ws)
+        client = WSClient(ws, self.queue_size)
+        client.sender = asyncio.create_task(self._send_loop(client))
+        self.clients[ws] = client
 
     def disconnect(self, ws: WebSocket):
-        self.clients.remove(ws)
+        client = self.clients.pop(ws, None)
+        if client and client.sender and client.sender is not asyncio.current_task():
+            client.sender.cancel()
 
     async def broadcast(self, message: dict):
-        for ws in self.clients:
-            try:
-                await ws.send_json(message)
-            except:
-                pass
+        """Serialize once and queue the message for every client"""
+        text = json.dumps(message)
+        event = message.get("event")
+        now = time.monotonic()
+        for client in list(self.clients.values()):
+            self._enqueue(client, (now, event, text))
+
+    def _enqueue(self, client: WSClient, item: tuple):
+        if len(client.pending) >= client.queue_size:
+            if self.policy == "disconnect":
+                app_logger.warning("Dropping slow WebSocket client")
+                client.dropped += 1
+                self.evicted += 1
+                self.disconnect(client.ws)
+                task = asyncio.create_task(self._close(client.ws))
+                self._closing.add(task)
+                task.add_done_callback(self._closing.discard)
+                return
+
+            if self.policy == "coalesce" and self._coalesce(client, item):
+                return
+
+            # drop_oldest (and coalesce with nothing to merge)
+            client.pending.popleft()
+            client.dropped += 1
+
+        client.pending.append(item)
+        client.ready.set()
+
+    def _coalesce(self, client: WSClient, item: tuple) -> bool:
+        """Replace the queued message of the same event type with the newest one"""
+        for index, queued in enumerate(client.pending):
+            if queued[1] == item[1]:
+                del client.pending[index]
+                client.pending.append(item)
+                client.coalesced += 1
+                return True
+        return False
+
+    async def _send_loop(self, client: WSClient):
+        try:
+            while True:
+                if not client.pending:
+                    client.ready.clear()
+                    await client.ready.wait()
+                queued_at, _, text = client.pending.popleft()
+                await asyncio.wait_for(client.ws.send_text(text), timeout=WS_SEND_TIMEOUT)
+                client.sent += 1
+                client.last_lag = time.monotonic() - queued_at
+                client.max_lag = max(client.max_lag, client.last_lag)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Dead or stuck socket - evict it so it stops holding messages
+            app_logger.info(f"Evicting WebSocket client after send failure: {e}")
+            self.evicted += 1
+            self.disconnect(client.ws)
+            await self._close(client.ws)
+
+    async def _close(self, ws: WebSocket):
+        try:
+            await ws.close()
+        except Exception:
+            pass
+
+    def stats(self) -> dict:
+        return {
+            "clients": len(self.clients),
+            "policy": self.policy,
+            "evicted": self.evicted,
+            "per_client": [client.stats() for client in self.clients.values()],
+        }
 
 ws_manager = WSManager()